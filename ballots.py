@@ -0,0 +1,307 @@
+from heapq import heappush, heapreplace, merge
+from itertools import combinations, islice, permutations, product
+from math import factorial, prod
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+from tva_types import VoterPreferences, VotingOption
+
+
+def get_ballot_classes(ballot: VoterPreferences, block_sizes: List[int]) -> Iterator[VoterPreferences]:
+    """ Yield one representative for every class of ballots that only differ inside blocks.
+
+    The candidates of a block keep their relative order from the given ballot, so the first
+    representative is the ballot itself. With blocks of size one every permutation is yielded.
+    """
+    if not block_sizes:
+        yield []
+        return
+
+    for block in combinations(ballot, block_sizes[0]):
+        remaining = [candidate for candidate in ballot if candidate not in block]
+        for tail in get_ballot_classes(remaining, block_sizes[1:]):
+            yield list(block) + tail
+
+def get_num_ballot_classes(block_sizes: List[int]) -> int:
+    """ Number of classes `get_ballot_classes` yields for the block sizes. """
+    return factorial(sum(block_sizes)) // prod(factorial(size) for size in block_sizes)
+
+def get_class_representative(ballot: VoterPreferences, original_ballot: VoterPreferences, block_sizes: List[int]) -> VoterPreferences:
+    """ Return the representative `get_ballot_classes` yields for the class of the ballot. """
+    positions = {candidate: i for i, candidate in enumerate(original_ballot)}
+    representative = []
+    start = 0
+    for size in block_sizes:
+        representative.extend(sorted(ballot[start:start + size], key=positions.__getitem__))
+        start += size
+    return representative
+
+def expand_ballot_class(representative: VoterPreferences, block_sizes: List[int]) -> Iterator[VoterPreferences]:
+    """ Yield all concrete ballots in the class of the representative. """
+    blocks = []
+    start = 0
+    for size in block_sizes:
+        blocks.append(representative[start:start + size])
+        start += size
+
+    for parts in product(*(permutations(block) for block in blocks)):
+        yield [candidate for part in parts for candidate in part]
+
+def get_permutation_key(ballot: VoterPreferences, original_ballot: VoterPreferences) -> Tuple[int, ...]:
+    """ Sort key that orders ballots the way `itertools.permutations` yields them from the original. """
+    positions = {candidate: i for i, candidate in enumerate(original_ballot)}
+    return tuple(positions[candidate] for candidate in ballot)
+
+def get_permutation_index(ballot: VoterPreferences, original_ballot: VoterPreferences) -> int:
+    """ Index of the ballot among the permutations `itertools.permutations` yields from the original (its Lehmer code). """
+    remaining = list(original_ballot)
+    index = 0
+    for candidate in ballot:
+        position = remaining.index(candidate)
+        index = index * len(remaining) + position
+        remaining.pop(position)
+    return index
+
+def get_permutation(index: int, original_ballot: VoterPreferences) -> VoterPreferences:
+    """ Decode a permutation index of the original ballot back into the ballot. """
+    positions = []
+    for radix in range(1, len(original_ballot) + 1):
+        positions.append(index % radix)
+        index //= radix
+
+    remaining = list(original_ballot)
+    return [remaining.pop(position) for position in reversed(positions)]
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    """ Yield consecutive lists of at most size items. """
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+class VoterClasses:
+    """ Voters grouped by identical ballots.
+
+    Attributes:
+        ballots:        Distinct ballots in order of first appearance
+        weights:        Number of voters casting each distinct ballot
+        voter_class:    Index of the distinct ballot cast by each voter
+    """
+
+    def __init__(self, preferences: List[VoterPreferences]):
+        self.ballots: List[VoterPreferences] = []
+        self.weights: List[int] = []
+        self.voter_class: List[int] = []
+
+        class_indices = {}
+        for pref in preferences:
+            key = tuple(pref)
+            if key not in class_indices:
+                class_indices[key] = len(self.ballots)
+                self.ballots.append(pref)
+                self.weights.append(0)
+            self.weights[class_indices[key]] += 1
+            self.voter_class.append(class_indices[key])
+
+    def expand(self, class_values: list) -> list:
+        """ Map values computed per distinct ballot back to every voter. """
+        return [class_values[class_index] for class_index in self.voter_class]
+
+    def restrict(self, candidates: set) -> 'VoterClasses':
+        """ Return the classes of the ballots restricted to the given candidates.
+
+        Only the distinct ballots are filtered, classes whose ballots become identical are merged.
+        """
+        restricted = VoterClasses([[candidate for candidate in ballot if candidate in candidates] for ballot in self.ballots])
+        restricted.weights = [0] * len(restricted.ballots)
+        for class_index, weight in zip(restricted.voter_class, self.weights):
+            restricted.weights[class_index] += weight
+        restricted.voter_class = [restricted.voter_class[class_index] for class_index in self.voter_class]
+        return restricted
+
+class VoterOptions:
+    """ Strategic voting options of a voter, stored per class of ballots in compact columns.
+
+    Every ballot in a class leads to the same outcome, so only the permutation index of a class
+    representative is kept, along with the outcome and happiness levels. The true happiness levels
+    are the same for all options and are stored once. Concrete options are expanded when iterating,
+    in the order of the voter's permutations.
+
+    Attributes:
+        original_ballot:            The voter's original ballot
+        block_sizes:                Blocks of ballot positions the scheme cannot tell apart
+        true_voter_happiness:       Happiness of the voter with the original voting outcome
+        true_overall_happiness:     Summed happiness of all voters with the original voting outcome
+        ballot_indices:             Permutation index of each class representative
+        outcomes:                   Voting outcome of each class
+        voter_happiness:            Happiness of the voter with the outcome of each class
+        overall_happiness:          Summed happiness of all voters with the outcome of each class
+    """
+
+    __slots__ = ("original_ballot", "block_sizes", "true_voter_happiness", "true_overall_happiness", "ballot_indices", "outcomes", "voter_happiness", "overall_happiness")
+
+    def __init__(self, original_ballot: VoterPreferences, block_sizes: List[int], true_voter_happiness: float, true_overall_happiness: float):
+        self.original_ballot = original_ballot
+        self.block_sizes = block_sizes
+        self.true_voter_happiness = true_voter_happiness
+        self.true_overall_happiness = true_overall_happiness
+        self.ballot_indices: List[int] = []
+        self.outcomes: List[str] = []
+        self.voter_happiness: List[float] = []
+        self.overall_happiness: List[float] = []
+
+    def add(self, representative: VoterPreferences, voting_outcome: str, voter_happiness: float, overall_happiness: float):
+        """ Add the options of every ballot in the class of the representative. """
+        self.ballot_indices.append(get_permutation_index(representative, self.original_ballot))
+        self.outcomes.append(voting_outcome)
+        self.voter_happiness.append(voter_happiness)
+        self.overall_happiness.append(overall_happiness)
+
+    def refresh_overall_happiness(self, true_overall_happiness: float, overall_happiness: Dict[str, float]):
+        """ Replace the overall happiness levels, which change whenever any voter changes their ballot. """
+        self.true_overall_happiness = true_overall_happiness
+        self.overall_happiness = [overall_happiness[outcome] for outcome in self.outcomes]
+
+    def __len__(self) -> int:
+        return len(self.ballot_indices) * prod(factorial(size) for size in self.block_sizes)
+
+    def __iter__(self) -> Iterator[VotingOption]:
+        expansions = [self.expand(class_index) for class_index in range(len(self.ballot_indices))]
+        for _, ballot, class_index in merge(*expansions):
+            yield VotingOption(ballot, self.outcomes[class_index], self.voter_happiness[class_index], self.true_voter_happiness, self.overall_happiness[class_index], self.true_overall_happiness)
+
+    def expand(self, class_index: int) -> Iterator[tuple]:
+        """ Yield the ballots of a class with their permutation index, expansions are already in permutation order. """
+        representative = get_permutation(self.ballot_indices[class_index], self.original_ballot)
+        for ballot in expand_ballot_class(representative, self.block_sizes):
+            yield get_permutation_index(ballot, self.original_ballot), ballot, class_index
+
+class OptionColumns:
+    """ Strategic voting options in the order they were added, stored in compact columns.
+
+    Unlike `VoterOptions` the options are not grouped into classes, so any list of options can be
+    stored, such as a group member's column of collusion rows. Ballots are kept as permutation
+    indices of a reference ballot, and the true happiness levels (the same for all options of a
+    voter) once.
+
+    Attributes:
+        reference_ballot:           Ballot the permutation indices refer to
+        true_voter_happiness:       Happiness of the voter with the original voting outcome
+        true_overall_happiness:     Summed happiness of all voters with the original voting outcome
+        ballot_indices:             Permutation index of each option's ballot
+        outcomes:                   Voting outcome of each option
+        voter_happiness:            Happiness of the voter with the outcome of each option
+        overall_happiness:          Summed happiness of all voters with the outcome of each option
+    """
+
+    __slots__ = ("reference_ballot", "true_voter_happiness", "true_overall_happiness", "ballot_indices", "outcomes", "voter_happiness", "overall_happiness")
+
+    def __init__(self, reference_ballot: VoterPreferences, true_voter_happiness: float, true_overall_happiness: float):
+        self.reference_ballot = reference_ballot
+        self.true_voter_happiness = true_voter_happiness
+        self.true_overall_happiness = true_overall_happiness
+        self.ballot_indices: List[int] = []
+        self.outcomes: List[str] = []
+        self.voter_happiness: List[float] = []
+        self.overall_happiness: List[float] = []
+
+    @staticmethod
+    def from_options(voting_options: List[VotingOption]) -> 'OptionColumns':
+        """ Store a list of options of one voter, referring their ballots to the first one. """
+        if not voting_options:
+            return OptionColumns([], 0.0, 0.0)
+
+        first = voting_options[0]
+        columns = OptionColumns(first.modified_preference_list, first.true_voter_happiness, first.true_overall_happiness)
+        for option in voting_options:
+            columns.ballot_indices.append(get_permutation_index(option.modified_preference_list, columns.reference_ballot))
+            columns.outcomes.append(option.voting_outcome)
+            columns.voter_happiness.append(option.voter_happiness)
+            columns.overall_happiness.append(option.overall_happiness)
+        return columns
+
+    def __len__(self) -> int:
+        return len(self.ballot_indices)
+
+    def __iter__(self) -> Iterator[VotingOption]:
+        for ballot_index, outcome, voter_happiness, overall_happiness in zip(self.ballot_indices, self.outcomes, self.voter_happiness, self.overall_happiness):
+            yield VotingOption(get_permutation(ballot_index, self.reference_ballot), outcome, voter_happiness, self.true_voter_happiness, overall_happiness, self.true_overall_happiness)
+
+class BoundedHeap:
+    """ The k best items by score, ties are won by the lower order (the earlier permutation).
+
+    Items are only created once they make it into the heap, so rejected candidates cost a comparison.
+
+    Attributes:
+        k:          Number of items kept
+        entries:    Min-heap of (score, negated order, item), the worst kept item comes first
+    """
+
+    def __init__(self, k: int):
+        self.k = k
+        self.entries: List[tuple] = []
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def accepts(self, score, order: int) -> bool:
+        """ Whether an item with this score and order would be kept. """
+        return len(self.entries) < self.k or (score, -order) > self.entries[0][:2]
+
+    def push(self, score, order: int, make_item: Callable[[], object]) -> bool:
+        """ Keep the item if it is among the k best so far, return whether it was kept. """
+        if not self.accepts(score, order):
+            return False
+        entry = (score, -order, make_item())
+        if len(self.entries) < self.k:
+            heappush(self.entries, entry)
+        else:
+            heapreplace(self.entries, entry)
+        return True
+
+    def items(self) -> list:
+        """ Return the kept items, best first. """
+        return [item for _, _, item in sorted(self.entries, key=lambda entry: entry[:2], reverse=True)]
+
+class TopOptions:
+    """ The k strategic voting options of a voter with the highest voter or overall happiness.
+
+    Ballots of a class are expanded in permutation order and only while they can still enter the
+    heap, so a class never contributes more than k options.
+
+    Attributes:
+        original_ballot:            The voter's original ballot
+        block_sizes:                Blocks of ballot positions the scheme cannot tell apart
+        true_voter_happiness:       Happiness of the voter with the original voting outcome
+        true_overall_happiness:     Summed happiness of all voters with the original voting outcome
+        top_key:                    Happiness the options are ranked by, voter_happiness or overall_happiness
+        heap:                       The best options so far
+    """
+
+    def __init__(self, original_ballot: VoterPreferences, block_sizes: List[int], true_voter_happiness: float, true_overall_happiness: float, k: int, top_key: str = "voter_happiness"):
+        self.original_ballot = original_ballot
+        self.block_sizes = block_sizes
+        self.true_voter_happiness = true_voter_happiness
+        self.true_overall_happiness = true_overall_happiness
+        self.top_key = top_key
+        self.heap = BoundedHeap(k)
+
+    def add(self, representative: VoterPreferences, voting_outcome: str, voter_happiness: float, overall_happiness: float):
+        """ Offer the options of every ballot in the class of the representative. """
+        score = voter_happiness if self.top_key == "voter_happiness" else overall_happiness
+        for ballot in expand_ballot_class(representative, self.block_sizes):
+            make_option = lambda: VotingOption(ballot, voting_outcome, voter_happiness, self.true_voter_happiness, overall_happiness, self.true_overall_happiness)
+            if not self.heap.push(score, get_permutation_index(ballot, self.original_ballot), make_option):
+                # the remaining ballots of the class tie on score and come later
+                break
+
+    def refresh_overall_happiness(self, true_overall_happiness: float, overall_happiness: Dict[str, float]):
+        """ Replace the overall happiness levels of the kept options, which only stay the best if they are ranked by voter happiness. """
+        self.true_overall_happiness = true_overall_happiness
+        for _, _, option in self.heap.entries:
+            option.true_overall_happiness = true_overall_happiness
+            option.overall_happiness = overall_happiness[option.voting_outcome]
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def __iter__(self) -> Iterator[VotingOption]:
+        return iter(self.heap.items())
@@ -0,0 +1,177 @@
+import argparse
+import glob
+import json
+import os
+from typing import Dict, Iterator, List, Optional
+
+from cache import ResultCache
+from collusion import get_collusion_tva_result
+from parallel import iter_jobs
+from tva_io import generic_serializer, get_scheme_summary, parse_groups, parse_prefs, parse_scheme_names, validate_cache_size, validate_engine, validate_mode, validate_runoff, validate_workers
+from voting import get_basic_tva_result, get_runoff_tva_results
+
+def get_elections(source: str, defaults: dict) -> List[dict]:
+    """ Read the elections of a directory of CSV files, a glob pattern or a JSONL manifest.
+
+    Every manifest line holds an input file and optionally an id, mode, schemes, groups and runoff,
+    missing fields are taken from the defaults. Relative inputs are resolved against the manifest.
+    Elections without an id are identified by their input and parameters, see `get_default_id`.
+    """
+    if source.endswith(".jsonl"):
+        elections = []
+        base_directory = os.path.dirname(source)
+        with open(source) as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                election = {**defaults, **json.loads(line)}
+                election["input"] = os.path.join(base_directory, election["input"])
+                elections.append(election)
+    elif os.path.isdir(source):
+        elections = [{**defaults, "input": path} for path in sorted(glob.glob(os.path.join(source, "*.csv")))]
+    else:
+        elections = [{**defaults, "input": path} for path in sorted(glob.glob(source))]
+
+    for election in elections:
+        if "id" not in election:
+            election["id"] = get_default_id(election)
+    return elections
+
+def get_default_id(election: dict) -> str:
+    """ Id of an election without one: its input, mode and schemes, and the groups or runoff rounds of its mode. """
+    schemes = election["schemes"] if isinstance(election["schemes"], str) else ",".join(election["schemes"])
+    parts = [election["input"], election["mode"], schemes]
+    if election["mode"] == 'collusion':
+        parts.append(election["groups"] if isinstance(election["groups"], str) else json.dumps(election["groups"], separators=(',', ':')))
+    elif election["mode"] == 'runoff':
+        rounds = election["runoff"] if isinstance(election["runoff"], list) else [election["runoff"]]
+        parts.append(",".join(str(advancing) for advancing in rounds))
+    return ":".join(parts)
+
+def get_finished_ids(output_file: str, retry_errors: bool = False) -> set:
+    """ Return the ids of the elections the output already has a record for.
+
+    The last record of an election counts. An election whose last record is an error is only
+    redone when retrying errors, so resuming does not append the same error again.
+    """
+    failed: Dict[str, bool] = {}
+    if not os.path.exists(output_file):
+        return set()
+
+    with open(output_file) as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a line cut off by an interrupted run is simply redone
+                continue
+            failed[record["id"]] = "error" in record
+    return {election_id for election_id, is_error in failed.items() if not (is_error and retry_errors)}
+
+def run_election(election: dict, engine: str, summary_only: bool, cache: Optional[ResultCache]) -> dict:
+    """ Analyse one election and return its result line. """
+    record = {"id": election["id"], "input": election["input"], "mode": election["mode"], "schemes": election["schemes"]}
+
+    system_preferences = parse_prefs(election["input"])
+    validate_mode(election["mode"])
+    schemes = parse_scheme_names(election["schemes"])
+
+    runoff_results = []
+    if election["mode"] == 'collusion':
+        groups_str = election["groups"] if isinstance(election["groups"], str) else json.dumps(election["groups"])
+        groups = parse_groups(groups_str, list(range(len(system_preferences))))
+        record["groups"] = groups
+        tva_result = get_collusion_tva_result(system_preferences, schemes, groups, engine, cache=cache)
+    elif election["mode"] == 'runoff':
+        rounds = election["runoff"] if isinstance(election["runoff"], list) else [election["runoff"]]
+        validate_runoff(rounds, len(system_preferences[0]))
+        record["runoff"] = rounds
+        if rounds[0] > 1:
+            *runoff_results, tva_result = get_runoff_tva_results(system_preferences, schemes, rounds, engine, cache=cache)
+        else:
+            tva_result = get_basic_tva_result(system_preferences, schemes, engine=engine, cache=cache) if rounds[0] > 0 else {}
+    else:
+        tva_result = get_basic_tva_result(system_preferences, schemes, engine=engine, cache=cache)
+
+    if summary_only:
+        tva_result = {scheme_name: get_scheme_summary(scheme_result) for scheme_name, scheme_result in tva_result.items()}
+        runoff_results = [{scheme_name: get_scheme_summary(scheme_result) for scheme_name, scheme_result in round_result.items()} for round_result in runoff_results]
+
+    record["result"] = tva_result
+    if runoff_results:
+        record["runoff_rounds"] = runoff_results
+    return record
+
+def init_batch_worker(engine: str, summary_only: bool, cache_dir: Optional[str], cache_size: int) -> dict:
+    """ Worker state for batch mode, every worker opens the shared result cache. """
+    return {"engine": engine, "summary_only": summary_only, "cache": ResultCache(cache_dir, cache_size) if cache_dir else None}
+
+def run_batch_job(state: dict, election: dict) -> str:
+    """ Analyse one election on a worker and return its result line as JSON.
+
+    Invalid elections exit through the validators, their line records the error instead of a result.
+    """
+    try:
+        record = run_election(election, state["engine"], state["summary_only"], state["cache"])
+    except SystemExit:
+        record = {"id": election["id"], "input": election["input"], "error": "invalid election"}
+    except Exception as error:
+        record = {"id": election["id"], "input": election["input"], "error": f"{error.__class__.__name__}: {error}"}
+    return json.dumps(record, default=generic_serializer)
+
+def iter_result_lines(elections: List[dict], workers: int, state_args: tuple) -> Iterator[str]:
+    """ Yield the result line of every election in order, on a process pool with more than one worker. """
+    if workers > 1:
+        yield from iter_jobs(workers, init_batch_worker, state_args, run_batch_job, [(election,) for election in elections])
+        return
+
+    state = init_batch_worker(*state_args)
+    for election in elections:
+        yield run_batch_job(state, election)
+
+def parse_args():
+    """ Parse command line arguments. """
+
+    parser = argparse.ArgumentParser(description="Calculate TVA results for many elections, one JSONL line per election.")
+    parser.add_argument('source', type=str, help='Directory of CSV files, glob pattern or JSONL manifest of elections.')
+    parser.add_argument('-o', '--output', type=str, help='Output JSONL file, elections it already holds are skipped.', required=True)
+    parser.add_argument('-m', '--mode', type=str, help='Default mode: basic, runoff, collusion.', default='basic')
+    parser.add_argument('-s', '--schemes', nargs='+', type=str, help='Default voting schemes.', default=['plurality', 'voting_for_two', 'borda', 'anti_plurality'])
+    parser.add_argument('-g', '--groups', type=str, help='Default nested list of collusion groups.', default='[]')
+    parser.add_argument('-r', '--runoff', nargs='+', type=int, help='Default number of runoff elections (or candidates advancing per round).', default=[0])
+    parser.add_argument('-e', '--engine', type=str, help='One of python, numpy.', default='python')
+    parser.add_argument('-w', '--workers', type=int, help='Number of worker processes, each analyses whole elections.', default=1)
+    parser.add_argument('--summary-only', action='store_true', help='Only write outcomes, happiness levels, option counts per voter and the strategic voting risk.')
+    parser.add_argument('--cache-dir', type=str, help='Directory of the result cache.', default='.tva_cache')
+    parser.add_argument('--cache-size', type=int, help='Size cap of the result cache in MB.', default=256)
+    parser.add_argument('--no-cache', action='store_true', help='Neither read nor write cached results.')
+    parser.add_argument('--retry-errors', action='store_true', help='Redo the elections whose last line in the output is an error.')
+    args = parser.parse_args()
+
+    validate_engine(args.engine)
+    validate_workers(args.workers)
+    validate_cache_size(args.cache_size)
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    defaults: Dict[str, object] = {"mode": args.mode, "schemes": args.schemes, "groups": args.groups, "runoff": args.runoff}
+    elections = get_elections(args.source, defaults)
+    finished = get_finished_ids(args.output, args.retry_errors)
+    pending = [election for election in elections if election["id"] not in finished]
+    print(f"Elections: {len(elections)}, already done: {len(elections) - len(pending)}")
+
+    state_args = (args.engine, args.summary_only, None if args.no_cache else args.cache_dir, args.cache_size * 2**20)
+    with open(args.output, "a+") as file:
+        # end a line cut off by an interrupted run, it is redone below
+        if file.tell() > 0:
+            file.seek(file.tell() - 1)
+            if file.read(1) != "\n":
+                file.write("\n")
+
+        for line in iter_result_lines(pending, args.workers, state_args):
+            file.write(line + "\n")
+            file.flush()
+
+    print("Results written to", args.output)
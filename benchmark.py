@@ -0,0 +1,188 @@
+import argparse
+import json
+import string
+import sys
+import time
+from random import Random
+from typing import Callable, Dict, List
+
+from collusion import get_collusion_tva_result
+from tva_io import scheme_by_name
+from tva_types import SystemPreferences
+from voting import get_basic_tva_result, get_runoff_tva_results
+
+CANDIDATES = string.ascii_uppercase + string.ascii_lowercase
+""" Candidate names of generated profiles, the input format only allows single letters. """
+
+def impartial_culture(num_voters: int, num_candidates: int, rng: Random) -> SystemPreferences:
+    """ Every voter casts a uniformly random ballot. """
+    candidates = list(CANDIDATES[:num_candidates])
+    return [rng.sample(candidates, num_candidates) for _ in range(num_voters)]
+
+def mallows(num_voters: int, num_candidates: int, rng: Random, dispersion: float = 0.5) -> SystemPreferences:
+    """ Ballots scattered around a random reference ranking, drawn by repeated insertion.
+
+    A dispersion of 0 gives every voter the reference ranking, 1 is impartial culture.
+    """
+    reference = rng.sample(CANDIDATES[:num_candidates], num_candidates)
+    preferences = []
+    for _ in range(num_voters):
+        ballot: List[str] = []
+        for i, candidate in enumerate(reference):
+            # inserting j places above the bottom has probability proportional to dispersion^j
+            weights = [dispersion ** j for j in range(i + 1)]
+            ballot.insert(i - rng.choices(range(i + 1), weights)[0], candidate)
+        preferences.append(ballot)
+    return preferences
+
+def single_peaked(num_voters: int, num_candidates: int, rng: Random) -> SystemPreferences:
+    """ Ballots single-peaked on the alphabetical axis, each built outwards from a random peak. """
+    axis = list(CANDIDATES[:num_candidates])
+    preferences = []
+    for _ in range(num_voters):
+        left = right = rng.randrange(num_candidates)
+        ballot = [axis[left]]
+        while len(ballot) < num_candidates:
+            if right == num_candidates - 1 or (left > 0 and rng.random() < 0.5):
+                left -= 1
+                ballot.append(axis[left])
+            else:
+                right += 1
+                ballot.append(axis[right])
+        preferences.append(ballot)
+    return preferences
+
+def many_duplicates(num_voters: int, num_candidates: int, rng: Random, num_distinct: int = 3) -> SystemPreferences:
+    """ Voters choose among a handful of random ballots, so most ballots are cast many times. """
+    ballots = impartial_culture(num_distinct, num_candidates, rng)
+    return [list(rng.choice(ballots)) for _ in range(num_voters)]
+
+GENERATORS: Dict[str, Callable[[int, int, Random], SystemPreferences]] = {
+    'impartial_culture': impartial_culture,
+    'mallows': mallows,
+    'single_peaked': single_peaked,
+    'many_duplicates': many_duplicates
+}
+""" Profile generators by name. """
+
+def generate_profile(generator: str, num_voters: int, num_candidates: int, seed: int = 0) -> SystemPreferences:
+    """ Generate a profile, the same seed always gives the same profile. """
+    return GENERATORS[generator](num_voters, num_candidates, Random(seed))
+
+def time_call(function: Callable, repeat: int, warmup: int = 1) -> float:
+    """ Return the fastest of repeated calls in seconds, after untimed warmup calls (lazy imports, caches). """
+    for _ in range(warmup):
+        function()
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def get_benchmark_cases(args) -> List[dict]:
+    """ Return a case per combination of the grid, in the order they are run. """
+    cases = []
+    for generator in args.generators:
+        for num_voters in args.voters:
+            for num_candidates in args.candidates:
+                for scheme_name in args.schemes:
+                    case = {"generator": generator, "voters": num_voters, "candidates": num_candidates, "scheme": scheme_name}
+                    for mode in args.modes:
+                        if mode == 'collusion':
+                            cases.extend({**case, "mode": mode, "group_size": group_size} for group_size in args.group_sizes if group_size <= num_voters)
+                        elif mode == 'runoff':
+                            if num_candidates > 2:
+                                cases.append({**case, "mode": mode, "group_size": None})
+                        else:
+                            cases.append({**case, "mode": mode, "group_size": None})
+    return cases
+
+def run_case(case: dict, seed: int, repeat: int, warmup: int, engine: str, workers: int) -> float:
+    """ Time the analysis of one case of the grid. """
+    prefs = generate_profile(case["generator"], case["voters"], case["candidates"], seed)
+    schemes = {case["scheme"]: scheme_by_name(case["scheme"])}
+
+    if case["mode"] == 'collusion':
+        groups = [list(range(case["group_size"]))] + [[voter] for voter in range(case["group_size"], case["voters"])]
+        return time_call(lambda: get_collusion_tva_result(prefs, schemes, groups, engine, workers), repeat, warmup)
+    if case["mode"] == 'runoff':
+        return time_call(lambda: get_runoff_tva_results(prefs, schemes, [2], engine, workers), repeat, warmup)
+    return time_call(lambda: get_basic_tva_result(prefs, schemes, engine=engine, workers=workers), repeat, warmup)
+
+def get_case_key(case: dict) -> tuple:
+    """ Key that identifies a case across benchmark runs. """
+    return (case["generator"], case["voters"], case["candidates"], case["scheme"], case["mode"], case["group_size"])
+
+def compare_to_baseline(results: List[dict], baseline: List[dict], tolerance: float) -> List[dict]:
+    """ Return the cases that got slower than the baseline by more than the tolerance (a fraction). """
+    baseline_seconds = {get_case_key(result): result["seconds"] for result in baseline}
+    regressions = []
+    for result in results:
+        before = baseline_seconds.get(get_case_key(result))
+        if before is not None and result["seconds"] > before * (1 + tolerance):
+            regressions.append({**result, "baseline_seconds": before})
+    return regressions
+
+def parse_args():
+    """ Parse command line arguments. """
+
+    parser = argparse.ArgumentParser(description="Time TVA analyses on seeded synthetic profiles.")
+    parser.add_argument('-g', '--generators', nargs='+', type=str, help='Profile generators: ' + ', '.join(GENERATORS) + '.', default=list(GENERATORS))
+    parser.add_argument('-n', '--voters', nargs='+', type=int, help='Numbers of voters.', default=[20, 100])
+    parser.add_argument('-m', '--candidates', nargs='+', type=int, help='Numbers of candidates.', default=[3, 4, 5])
+    parser.add_argument('-s', '--schemes', nargs='+', type=str, help='Voting schemes.', default=['plurality', 'voting_for_two', 'borda', 'anti_plurality'])
+    parser.add_argument('--modes', nargs='+', type=str, help='Modes to time: basic, collusion, runoff.', default=['basic', 'collusion', 'runoff'])
+    parser.add_argument('--group-sizes', nargs='+', type=int, help='Sizes of the collusion group.', default=[2, 3])
+    parser.add_argument('--seed', type=int, help='Seed of the profile generators.', default=0)
+    parser.add_argument('--repeat', type=int, help='Number of timed runs per case, the fastest counts.', default=3)
+    parser.add_argument('--warmup', type=int, help='Number of untimed runs per case.', default=1)
+    parser.add_argument('-e', '--engine', type=str, help='Tally engine.', default='python')
+    parser.add_argument('-w', '--workers', type=int, help='Number of worker processes.', default=1)
+    parser.add_argument('-o', '--output', type=str, help='Output file name for the results.')
+    parser.add_argument('-b', '--baseline', type=str, help='Results of an earlier run to compare against.')
+    parser.add_argument('-t', '--tolerance', type=float, help='Allowed slowdown against the baseline, as a fraction.', default=0.2)
+    args = parser.parse_args()
+
+    for generator in args.generators:
+        if generator not in GENERATORS:
+            print("Invalid generator:", generator)
+            sys.exit(1)
+    for scheme_name in args.schemes:
+        if scheme_by_name(scheme_name) is None:
+            print("Invalid voting scheme:", scheme_name)
+            sys.exit(1)
+    for mode in args.modes:
+        if mode not in ['basic', 'collusion', 'runoff']:
+            print("Invalid mode:", mode)
+            sys.exit(1)
+    if max(args.candidates) > len(CANDIDATES) or min(args.candidates) < 2:
+        print("Invalid number of candidates:", args.candidates)
+        sys.exit(1)
+
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    results = []
+    for case in get_benchmark_cases(args):
+        seconds = run_case(case, args.seed, args.repeat, args.warmup, args.engine, args.workers)
+        results.append({**case, "seconds": seconds})
+        print(f"{case['generator']:>18} n={case['voters']:<5} m={case['candidates']:<3} {case['scheme']:>15} {case['mode']:>9} {case['group_size'] or '':>3} {seconds:10.4f}s")
+
+    report = {"config": {"seed": args.seed, "repeat": args.repeat, "warmup": args.warmup, "engine": args.engine, "workers": args.workers}, "results": results}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+            print("Results written to", args.output)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {get_case_key(regression)} {regression['baseline_seconds']:.4f}s -> {regression['seconds']:.4f}s")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against", args.baseline)
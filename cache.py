@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+from typing import Iterable, Optional, Union
+
+from ballots import OptionColumns, VoterOptions
+from tva_io import Profile, generic_serializer
+from tva_types import SystemPreferences
+
+CACHE_VERSION = 2
+""" Part of every key, bump it when the results for the same inputs change. """
+
+class ResultCache:
+    """ Scheme results on disk, addressed by a hash of everything they depend on.
+
+    Every result is a JSON file named by its key. The options of every voter are stored in the
+    columns of their compact form (see `encode_options`), so neither writing nor reading a result
+    expands them. Reading a result marks it as used, and the least recently used results are
+    evicted once the directory grows beyond max_bytes.
+
+    Attributes:
+        directory:      Directory of the cached results
+        max_bytes:      Size cap of all cached results
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def get_key(self, preferences: Union[SystemPreferences, Profile], scheme_name: str, **params) -> str:
+        """ Hash the preferences, scheme and search parameters (mode, groups, runoff, happiness variant).
+
+        A loaded profile is hashed by its packed ballots, so the ballots are not decoded for the key.
+        """
+        if isinstance(preferences, Profile):
+            preferences = {"candidates": preferences.candidates, "ballots": hashlib.sha256(preferences.ballots).hexdigest()}
+        content = json.dumps({"version": CACHE_VERSION, "preferences": preferences, "scheme": scheme_name, **params}, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key: str) -> Optional[dict]:
+        """ Return the cached scheme result, or None. """
+        path = self.get_path(key)
+        try:
+            with open(path) as file:
+                scheme_result = json.load(file)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+
+        scheme_result["voters"] = [decode_options(entry) for entry in scheme_result["voters"]]
+        return scheme_result
+
+    def put(self, key: str, scheme_result: dict):
+        """ Store a scheme result and evict the least recently used ones beyond the size cap. """
+        path = self.get_path(key)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump({**scheme_result, "voters": [encode_options(voting_options) for voting_options in scheme_result["voters"]]}, file, default=generic_serializer)
+        os.replace(temporary_path, path)
+        self.evict()
+
+    def evict(self):
+        """ Remove the least recently used results until the cache fits its size cap. """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_bytes -= size
+
+    def clear(self):
+        """ Remove all cached results. """
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json") or entry.name.endswith(".tmp"):
+                os.remove(entry.path)
+
+COMPACT_OPTIONS = {"classes": VoterOptions, "options": OptionColumns}
+""" Compact forms of a voter's options by their kind in the cache. """
+
+def encode_options(voting_options: Iterable) -> dict:
+    """ Return the columns of a voter's options, options that are not stored per class (top-k, collusion) are stored in order. """
+    if not isinstance(voting_options, (VoterOptions, OptionColumns)):
+        voting_options = OptionColumns.from_options(list(voting_options))
+    kind = "classes" if isinstance(voting_options, VoterOptions) else "options"
+    return {"kind": kind, **{attribute: getattr(voting_options, attribute) for attribute in type(voting_options).__slots__}}
+
+def decode_options(entry: dict) -> Union[VoterOptions, OptionColumns]:
+    """ Restore a voter's options from their columns without expanding them. """
+    options_type = COMPACT_OPTIONS[entry.pop("kind")]
+    voting_options = options_type.__new__(options_type)
+    for attribute, value in entry.items():
+        setattr(voting_options, attribute, value)
+    return voting_options
@@ -1,98 +1,661 @@
-from itertools import permutations
-from typing import Dict, List
+import time
+from collections import OrderedDict
+from heapq import merge
+from itertools import islice, product
+from math import factorial, prod
+from random import Random
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
 
-import pandas as pd
-from tva_types import Scheme, SystemPreferences, VotingOption
-from voting import get_strategic_voting_risk, get_vote_result
+from ballots import BoundedHeap, VoterClasses, expand_ballot_class, get_ballot_classes, get_class_representative, get_num_ballot_classes, get_permutation_index, get_permutation_key
+from cache import ResultCache
+from schemes import add_pairwise_preferences, get_ballot_blocks
+from parallel import SharedProfile, run_jobs
+from stats import SearchStats
+from tally import BaseTally, Tally, get_reachable_winners, get_tally, get_winner, is_positional
+from tva_types import Scheme, SystemPreferences, VoterPreferences, VotingOption
+from voting import NEIGHBOURHOOD_SIZE, RESTART_AFTER, HappinessTable, OptionFilter, SchemeContext, get_happiness_table, get_random_moves, get_search_coverage, get_strategic_voting_risk, get_tallied_outcome
 
+SHARDS_PER_WORKER = 4
+""" Number of shards a collusion group is split into per worker, more shards even out their sizes. """
+
+def get_strategic_options_for_group(original_system_prefs: SystemPreferences, scheme: Scheme, collusion_group: List[int], tally: Optional[BaseTally] = None, happiness_table: Optional[HappinessTable] = None, stats: Optional[SearchStats] = None, option_filter: Optional[OptionFilter] = None) -> List[VotingOption]:
+    """ Find the rows of strategic voting options of a collusion group, one option per member in a row.
+
+    The option filter can stop the search at the first strategic row or keep only the best rows,
+    ranked by the summed happiness of the members or the overall happiness.
+    """
+    if option_filter is None:
+        option_filter = OptionFilter()
+    shard = get_strategic_options_for_group_shard(original_system_prefs, scheme, collusion_group, (0, 1), tally, happiness_table, stats, option_filter)
+    return merge_group_shards([shard], option_filter)
+
+def get_strategic_options_for_group_shard(original_system_prefs: SystemPreferences, scheme: Scheme, collusion_group: List[int], shard: Tuple[int, int], tally: Optional[BaseTally] = None, happiness_table: Optional[HappinessTable] = None, stats: Optional[SearchStats] = None, option_filter: Optional[OptionFilter] = None) -> list:
+    """ Search the rows of a collusion group in one shard of the first member's ballot classes.
+
+    A shard (index, number of shards) takes every number-of-shards-th class of the first member,
+    starting at its index. Returns the rows keyed by the permutations of the members in their
+    order, or the entries of the best rows with top-k, for `merge_group_shards`.
+    """
+    if option_filter is None:
+        option_filter = OptionFilter()
 
-def get_strategic_options_for_group(original_system_prefs: SystemPreferences, scheme: Scheme, collusion_group: List[int]) -> List[VotingOption]:
     # calculate true group happiness
-    true_outcome, true_happiness_levels = get_vote_result(original_system_prefs, original_system_prefs, scheme)
-    modified_system_prefs = [pref.copy() for pref in original_system_prefs]
-    return get_strategic_options_for_group_rek(modified_system_prefs, original_system_prefs, true_happiness_levels, scheme, collusion_group, 0)
+    if tally is None:
+        tally = get_tally(original_system_prefs, scheme)
+    if happiness_table is None:
+        happiness_table = get_happiness_table(original_system_prefs, tally)
+    true_outcome = get_tallied_outcome(original_system_prefs, scheme, tally)
+    true_happiness_levels = happiness_table.levels[true_outcome]
+
+    target_outcomes = get_target_outcomes(happiness_table, true_happiness_levels, collusion_group)
+    top_rows = BoundedHeap(option_filter.top_k) if option_filter.top_k > 0 else None
+    # scores without the group's ballots, the search adds the members' points to them
+    group_scores = tally.replace_scores({}, collusion_group) if is_positional(tally) else None
+
+    # an approximate search covers the combinations it evaluates, an exhaustive one covers all
+    block_sizes = get_ballot_blocks(scheme, len(original_system_prefs[collusion_group[0]]))
+    num_combinations = get_num_ballot_classes(block_sizes) ** len(collusion_group)
+    approximate = option_filter.budget is not None and not option_filter.budget.fits(num_combinations)
+    if stats is not None and option_filter.budget is not None and shard[0] == 0:
+        stats.count("search_space_classes", num_combinations)
+
+    # skip the search if no ballots of the group can lead to an outcome the group wants
+    if group_scores is not None and not target_outcomes & get_reachable_winners(group_scores, tally.score_vector, len(collusion_group)):
+        if stats is not None and shard[0] == 0:
+            stats.count("pruned_subtrees")
+            if option_filter.budget is not None:
+                stats.count("covered_classes", num_combinations)
+        return []
+    if stats is not None and option_filter.budget is not None and shard[0] == 0 and not approximate:
+        stats.count("covered_classes", num_combinations)
+
+    if approximate:
+        keyed_options = get_approximate_options_for_group(original_system_prefs, true_happiness_levels, scheme, collusion_group, block_sizes, tally, happiness_table, target_outcomes, group_scores, stats, option_filter, top_rows)
+    elif group_scores is not None:
+        keyed_options = get_strategic_options_for_group_aggregated(original_system_prefs, true_happiness_levels, scheme, collusion_group, tally, happiness_table, target_outcomes, group_scores, stats, option_filter, top_rows, shard)
+    else:
+        # only the group's ballots are replaced, the full profile is copied only to rescore it without a tally
+        modified_system_prefs = [pref.copy() for pref in original_system_prefs] if tally is None else {}
+        # the pairwise matrix without the group's ballots, the members' pairs are added on the way down
+        matrix = tally.replace_matrix({}, collusion_group) if tally is not None and tally.pairwise else None
+        member_classes = get_member_classes(original_system_prefs, collusion_group, block_sizes, shard)
+        keyed_options = get_strategic_options_for_group_rek(modified_system_prefs, original_system_prefs, true_happiness_levels, scheme, collusion_group, 0, tally, happiness_table, stats, option_filter, top_rows, member_classes, target_outcomes, matrix)
+    if top_rows is not None:
+        return top_rows.entries
+
+    keyed_options.sort(key=lambda keyed_option: keyed_option[0])
+    return keyed_options
+
+def merge_group_shards(shards: List[list], option_filter: OptionFilter) -> List[List[VotingOption]]:
+    """ Merge the shards of a collusion group into its rows, in the same order as a search in one piece. """
+    if option_filter.top_k > 0:
+        top_rows = BoundedHeap(option_filter.top_k)
+        for entries in shards:
+            for score, negative_order, row in entries:
+                top_rows.push(score, -negative_order, lambda: row)
+        return top_rows.items()
+
+    # list the options in the order of the nested permutations of the group members, every shard is sorted already
+    rows = [voting_options for _, voting_options in merge(*shards, key=lambda keyed_option: keyed_option[0])]
+    if option_filter.risk_only:
+        # each shard stops at its first row, the first of all shards is the one a single search finds
+        return rows[:1]
+    return rows
+
+
+def get_target_outcomes(happiness_table: HappinessTable, true_happiness_levels: List[float], collusion_group: List[int]) -> set:
+    """ Return the outcomes that raise the group's happiness without lowering any member's. """
+    true_group_happiness = sum(true_happiness_levels[voter_index] for voter_index in collusion_group)
+    target_outcomes = set()
+    for outcome, happiness_levels in happiness_table.levels.items():
+        group_happiness = sum(happiness_levels[voter_index] for voter_index in collusion_group)
+        anyone_unhappy = any(happiness_levels[voter_index] < true_happiness_levels[voter_index] for voter_index in collusion_group)
+        if group_happiness > true_group_happiness and not anyone_unhappy:
+            target_outcomes.add(outcome)
+    return target_outcomes
+
+class PackedScores:
+    """ Points the ballots of a group give every candidate, packed into one integer with a field per candidate.
+
+    Fields are wide enough for the points of all members, so adding packed integers adds the points
+    of every candidate without carrying into the next field. Aggregates of the group's ballots are
+    then summed and hashed as single integers. Score vectors never award negative points.
+
+    Attributes:
+        score_vector:   Points awarded for each position of a ballot
+        width:          Bits per field
+        shifts:         Position of each candidate's field
+    """
+
+    def __init__(self, candidates: List[str], score_vector: List[int], num_ballots: int):
+        self.score_vector = score_vector
+        self.width = max(1, (max(score_vector) * num_ballots).bit_length())
+        self.shifts = {candidate: i * self.width for i, candidate in enumerate(candidates)}
+
+    def pack(self, ballot: VoterPreferences) -> int:
+        """ Return the points of a ballot as a packed integer. """
+        return sum(points << self.shifts[candidate] for points, candidate in zip(self.score_vector, ballot))
+
+    def add_to(self, scores: Dict[str, int], packed: int) -> Dict[str, int]:
+        """ Return the scores with the packed points added. """
+        mask = (1 << self.width) - 1
+        return {candidate: score + ((packed >> self.shifts[candidate]) & mask) for candidate, score in scores.items()}
+
+class OutcomeCache:
+    """ Values by key, evicting the least recently used beyond max_size. """
+
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self.outcomes: OrderedDict = OrderedDict()
 
+    def get(self, key: tuple):
+        """ Return the cached value for the key, or None. """
+        value = self.outcomes.get(key)
+        if value is not None:
+            self.outcomes.move_to_end(key)
+        return value
 
-def get_strategic_options_for_group_rek(modified_system_prefs: SystemPreferences, original_system_prefs: SystemPreferences, true_happiness_levels: List[float], scheme: Scheme, collusion_group: List[int], depth: int) -> List[VotingOption]:
+    def put(self, key: tuple, value):
+        """ Cache a value, evicting the least recently used one when full. """
+        self.outcomes[key] = value
+        if len(self.outcomes) > self.max_size:
+            self.outcomes.popitem(last=False)
+
+class AggregateSearch:
+    """ Depth-first search of a collusion group's ballot classes over the packed points of the members' ballots.
+
+    The members' classes are nested as in the plain search, carrying the aggregate of the members so
+    far. Many combinations add up to the same aggregate, so the outcome of a complete aggregate is
+    decided once, and a partial aggregate from which no wanted outcome is reachable (a dead end) is
+    only searched once. Both are kept in a bounded cache. Strategic combinations are yielded as they
+    are found, so the caller can stop the search at any point.
+
+    Attributes:
+        group_scores:       Scores without the group's ballots
+        packed_scores:      Packing of the members' points
+        target_outcomes:    Outcomes the group wants
+        contributions:      Packed points of every class of every member
+        cache:              Outcomes of complete aggregates by (number of members, aggregate) and dead
+                            ends by (depth, aggregate), where they are False
+        stats:              Search statistics to count into, or None
+        class_size:         Number of ballots in every class
+        top_rows:           Best rows so far with top-k, or None
+        best_score:         Highest score a row can have with top-k
+        class_orders:       Lowest order of a row with each class of each member, with top-k
+    """
+
+    def __init__(self, group_scores: Dict[str, int], packed_scores: PackedScores, target_outcomes: set, contributions: List[List[int]], stats: Optional[SearchStats] = None, class_size: int = 1):
+        self.group_scores = group_scores
+        self.packed_scores = packed_scores
+        self.target_outcomes = target_outcomes
+        self.contributions = contributions
+        self.cache = OutcomeCache()
+        self.stats = stats
+        self.class_size = class_size
+        self.top_rows: Optional[BoundedHeap] = None
+        self.best_score = 0.0
+        self.class_orders: List[List[int]] = []
+
+    def bound_orders(self, top_rows: BoundedHeap, best_score: float, class_orders: List[List[int]]):
+        """ Skip the classes whose rows can no longer enter the best rows, even with the best score. """
+        self.top_rows = top_rows
+        self.best_score = best_score
+        self.class_orders = class_orders
+
+    def decide(self, aggregate: int) -> str:
+        """ Return the outcome of a complete aggregate. """
+        key = (len(self.contributions), aggregate)
+        outcome = self.cache.get(key)
+        if outcome is None:
+            outcome = get_winner(self.packed_scores.add_to(self.group_scores, aggregate))
+            self.cache.put(key, outcome)
+            if self.stats is not None:
+                self.stats.count("scheme_evaluations")
+        elif self.stats is not None:
+            self.stats.count("cache_hits")
+        return outcome
+
+    def is_dead_end(self, depth: int, aggregate: int) -> bool:
+        """ Whether no outcome the group wants can follow a partial aggregate of the members before depth. """
+        key = (depth, aggregate)
+        if self.cache.get(key) is not None:
+            if self.stats is not None:
+                self.stats.count("cache_hits")
+            return True
+        if not self.target_outcomes & get_reachable_winners(self.packed_scores.add_to(self.group_scores, aggregate), self.packed_scores.score_vector, len(self.contributions) - depth):
+            self.cache.put(key, False)
+            if self.stats is not None:
+                self.stats.count("pruned_subtrees")
+            return True
+        return False
+
+    def walk(self, depth: int = 0, aggregate: int = 0, order: int = 0, prefix: tuple = ()) -> Iterator[tuple]:
+        """ Yield the class indices of all members leading to a wanted outcome, with the outcome, in the order of the members' classes.
+
+        Returns whether the classes from depth on were searched in full without a wanted outcome.
+        """
+        dead_end = True
+        last = depth == len(self.contributions) - 1
+        for class_index, contribution in enumerate(self.contributions[depth]):
+            if self.stats is not None:
+                self.stats.count("ballot_classes")
+                self.stats.count("permutations", self.class_size)
+            class_order = order
+            if self.top_rows is not None:
+                class_order += self.class_orders[depth][class_index]
+                if not self.top_rows.accepts(self.best_score, class_order):
+                    dead_end = False
+                    continue
+
+            if last:
+                outcome = self.decide(aggregate + contribution)
+                if outcome in self.target_outcomes:
+                    dead_end = False
+                    yield prefix + (class_index,), outcome
+            elif not self.is_dead_end(depth + 1, aggregate + contribution):
+                if (yield from self.walk(depth + 1, aggregate + contribution, class_order, prefix + (class_index,))):
+                    self.cache.put((depth + 1, aggregate + contribution), False)
+                else:
+                    dead_end = False
+        return dead_end
+
+def get_member_classes(original_system_prefs: SystemPreferences, collusion_group: List[int], block_sizes: List[int], shard: Tuple[int, int] = (0, 1)) -> List[List[VoterPreferences]]:
+    """ Return the ballot classes of every member, the first member's classes only of the shard. """
+    member_classes = []
+    for depth, member in enumerate(collusion_group):
+        ballot_classes = get_ballot_classes(original_system_prefs[member], block_sizes)
+        if depth == 0 and shard[1] > 1:
+            # the first member's classes are dealt out to the shards in turn
+            ballot_classes = islice(ballot_classes, shard[0], None, shard[1])
+        member_classes.append(list(ballot_classes))
+    return member_classes
+
+def get_strategic_options_for_group_aggregated(original_system_prefs: SystemPreferences, true_happiness_levels: List[float], scheme: Scheme, collusion_group: List[int], tally: Tally, happiness_table: HappinessTable, target_outcomes: set, group_scores: Dict[str, int], stats: Optional[SearchStats] = None, option_filter: Optional[OptionFilter] = None, top_rows: Optional[BoundedHeap] = None, shard: Tuple[int, int] = (0, 1)) -> List[tuple]:
+    """ Search the rows of a collusion group of a positional scheme over the aggregated points of the members' ballots.
+
+    See `AggregateSearch`. With risk-only the search stops at the first strategic row, with top-k
+    it skips the classes that can only lead to rows ranked below the best rows so far.
+    """
+    block_sizes = get_ballot_blocks(scheme, len(original_system_prefs[collusion_group[0]]))
+    packed_scores = PackedScores(list(group_scores), tally.score_vector, len(collusion_group))
+    member_classes = get_member_classes(original_system_prefs, collusion_group, block_sizes, shard)
+    contributions = [[packed_scores.pack(ballot) for ballot in ballots] for ballots in member_classes]
+    search = AggregateSearch(group_scores, packed_scores, target_outcomes, contributions, stats, prod(factorial(size) for size in block_sizes))
+
+    if top_rows is not None:
+        # the order of a row is the members' permutation indices as digits, a class representative has the lowest in its class
+        num_permutations = factorial(len(original_system_prefs[collusion_group[0]]))
+        if option_filter.top_key == "voter_happiness":
+            best_score = max(sum(happiness_table.levels[outcome][member] for member in collusion_group) for outcome in target_outcomes)
+        else:
+            best_score = max(happiness_table.overall[outcome] for outcome in target_outcomes)
+        class_orders = [[get_permutation_index(ballot, original_system_prefs[member]) * num_permutations ** (len(collusion_group) - depth - 1) for ballot in ballots] for depth, (member, ballots) in enumerate(zip(collusion_group, member_classes))]
+        search.bound_orders(top_rows, best_score, class_orders)
+
+    strategic_voting_options: List[tuple] = []
+    for class_indices, outcome in search.walk():
+        representatives = [member_classes[depth][class_index] for depth, class_index in enumerate(class_indices)]
+        add_strategic_rows(strategic_voting_options, representatives, outcome, original_system_prefs, true_happiness_levels, collusion_group, happiness_table, block_sizes, stats, option_filter, top_rows)
+        if option_filter is not None and option_filter.risk_only:
+            break
+    return strategic_voting_options
+
+def get_strategic_options_for_group_rek(modified_system_prefs: Union[SystemPreferences, Dict[int, VoterPreferences]], original_system_prefs: SystemPreferences, true_happiness_levels: List[float], scheme: Scheme, collusion_group: List[int], depth: int, tally: Optional[BaseTally] = None, happiness_table: Optional[HappinessTable] = None, stats: Optional[SearchStats] = None, option_filter: Optional[OptionFilter] = None, top_rows: Optional[BoundedHeap] = None, member_classes: Optional[List[List[VoterPreferences]]] = None, target_outcomes: Optional[set] = None, matrix: Optional[List[int]] = None) -> List[tuple]:
+    """ Search the rows of a collusion group by nesting the members' ballot classes, for schemes without scores to aggregate.
+
+    With a pairwise tally the matrix of all other voters is carried down, every member adds the pairs
+    of their ballot before the next one's classes are searched and removes them afterwards. The last
+    member's ballots are decided on the matrix with the rule's single-ballot shortcut if it has one.
+    """
 
     # the next voter is always first in the list
     voter_index = collusion_group[depth]
     voter_original_prefs = original_system_prefs[voter_index]
-    voter_pref_permutations = list(permutations(voter_original_prefs))
-    strategic_voting_options: List[List[VotingOption]] = []
+    block_sizes = get_ballot_blocks(scheme, len(voter_original_prefs))
+    strategic_voting_options: List[tuple] = []
+    if happiness_table is None:
+        happiness_table = get_happiness_table(original_system_prefs, tally)
+    if stats is not None:
+        class_size = prod(factorial(size) for size in block_sizes)
 
-    # iterate through all permutations of this voter
-    for i, permutation in enumerate(voter_pref_permutations):
+    # iterate through one ballot per class of permutations the scheme cannot tell apart
+    if member_classes is None:
+        member_classes = get_member_classes(original_system_prefs, collusion_group, block_sizes)
+    if depth == len(collusion_group) - 1 and matrix is not None:
+        decide = tally.get_ballot_rule(matrix)
+    for voter_prefs in member_classes[depth]:
+        if stats is not None:
+            stats.count("ballot_classes")
+            stats.count("permutations", class_size)
 
         # update the system preferences
-        voter_prefs = list(permutation)
         modified_system_prefs[voter_index] = voter_prefs
 
         if depth == len(collusion_group) - 1:
 
-            # calculate the results for the current permutation
-            outcome, happiness_levels = get_vote_result(modified_system_prefs, original_system_prefs, scheme)
-
-            # overall happiness
-            overall_happiness = sum(happiness_levels)
-            true_overall_happiness = sum(true_happiness_levels)
-
-            # check if the collusion group has higher overall happiness
-            group_happiness = sum(happiness_levels[voter_index] for voter_index in collusion_group)
-            true_group_happiness = sum(true_happiness_levels[voter_index] for voter_index in collusion_group)
-            better_overall = group_happiness > true_group_happiness
-            if (not better_overall):
+            # calculate the results for the current permutation, only the group's ballots are replaced
+            if matrix is not None:
+                outcome = decide(voter_prefs)
+            elif tally is None:
+                outcome, _ = scheme(modified_system_prefs)
+            else:
+                outcome = tally.replace_ballots({member: modified_system_prefs[member] for member in collusion_group})
+            if stats is not None:
+                stats.count("scheme_evaluations")
+            if target_outcomes is not None and outcome not in target_outcomes:
                 continue
 
-            # check if anyone in the collusion group has individual lower happiness
-            anyone_unhappy = any(happiness_levels[voter_index] < true_happiness_levels[voter_index] for voter_index in collusion_group)
-            if (anyone_unhappy):
-                continue
-
-            # store the strategic voting options
-            strategic_voting_options.append([VotingOption(voter_prefs, outcome, happiness_levels[voter_index], true_happiness_levels[voter_index], overall_happiness, true_overall_happiness) for voter_index in collusion_group])
+            representatives = [modified_system_prefs[member] for member in collusion_group]
+            if add_strategic_rows(strategic_voting_options, representatives, outcome, original_system_prefs, true_happiness_levels, collusion_group, happiness_table, block_sizes, stats, option_filter, top_rows) and option_filter is not None and option_filter.risk_only:
+                break
         else:
             # recursively call the function for the next voter in the collusion group
-            strategic_voting_options.extend(get_strategic_options_for_group_rek(modified_system_prefs, original_system_prefs, true_happiness_levels, scheme, collusion_group, depth + 1))
+            if matrix is not None:
+                add_pairwise_preferences(matrix, tally.candidate_ids, voter_prefs)
+            strategic_voting_options.extend(get_strategic_options_for_group_rek(modified_system_prefs, original_system_prefs, true_happiness_levels, scheme, collusion_group, depth + 1, tally, happiness_table, stats, option_filter, top_rows, member_classes, target_outcomes, matrix))
+            if matrix is not None:
+                add_pairwise_preferences(matrix, tally.candidate_ids, voter_prefs, -1)
+            if option_filter is not None and option_filter.risk_only and strategic_voting_options:
+                break
 
     # restore the original preferences
     modified_system_prefs[voter_index] = voter_original_prefs
 
     return strategic_voting_options
 
-def get_collusion_tva_result(original_system_prefs: SystemPreferences, schemes: Dict[str, Scheme], collusion_groups: List[List[int]]) -> dict:
-    """ Calculate the basic TVA result for a given voting scheme and set of preferences. """
+def get_approximate_options_for_group(original_system_prefs: SystemPreferences, true_happiness_levels: List[float], scheme: Scheme, collusion_group: List[int], block_sizes: List[int], tally: Optional[BaseTally], happiness_table: HappinessTable, target_outcomes: set, group_scores: Optional[Dict[str, int]], stats: Optional[SearchStats] = None, option_filter: Optional[OptionFilter] = None, top_rows: Optional[BoundedHeap] = None) -> List[tuple]:
+    """ Search a sample of the combinations of the members' ballot classes within the budget of the option filter.
+
+    The search starts with one combination per outcome the group wants, in which every member ranks
+    that outcome first and the others from the weakest to the strongest (as the other voters rank
+    them). It then climbs from the best of them with random swap and insert moves of one member's
+    ballot towards combinations that make the group happier, and restarts from random ballots when
+    the moves stop helping. Every combination is evaluated at most once. Rows can only be missed,
+    so the strategic voting risk is a lower bound of the exhaustive one.
+    """
+
+    budget = option_filter.budget
+    deadline = time.perf_counter() + budget.seconds if budget.seconds > 0 else None
+    rng = Random(f"{budget.seed}:{collusion_group}")
+
+    original_ballots = [original_system_prefs[member] for member in collusion_group]
+    num_combinations = get_num_ballot_classes(block_sizes) ** len(collusion_group)
+    max_evaluations = min(budget.evaluations or num_combinations, num_combinations)
+    group_happiness = lambda outcome: sum(happiness_table.levels[outcome][member] for member in collusion_group)
+
+    if group_scores is not None:
+        ranking = sorted(original_ballots[0], key=lambda candidate: (-group_scores[candidate], candidate))
+    else:
+        # candidates missing from the full outcome (without votes) count as the weakest
+        _, full_outcome = get_tallied_outcome(original_system_prefs, scheme, tally, True)
+        ranking = full_outcome + [candidate for candidate in original_ballots[0] if candidate not in full_outcome]
+    targets = sorted(target_outcomes, key=lambda outcome: (-group_happiness(outcome), outcome))
+    combinations = [[[target] + [candidate for candidate in reversed(ranking) if candidate != target]] * len(collusion_group) for target in targets]
+
+    # the original ballots' combination is known without evaluating it
+    seen = {tuple(tuple(ballot) for ballot in original_ballots)}
+    strategic_voting_options: List[tuple] = []
+    current, current_happiness, stalled = original_ballots, group_happiness(get_tallied_outcome(original_system_prefs, scheme, tally)), 0
+    done = False
+    while not done and len(seen) < max_evaluations and (deadline is None or time.perf_counter() < deadline):
+        best, best_happiness = None, -1.0
+        for ballots in combinations:
+            representatives = [get_class_representative(ballot, original_ballot, block_sizes) for ballot, original_ballot in zip(ballots, original_ballots)]
+            key = tuple(tuple(representative) for representative in representatives)
+            if key in seen or len(seen) >= max_evaluations:
+                continue
+            seen.add(key)
+
+            # only the group's ballots are replaced
+            if tally is None:
+                modified_system_prefs = list(original_system_prefs)
+                for member, representative in zip(collusion_group, representatives):
+                    modified_system_prefs[member] = representative
+                outcome, _ = scheme(modified_system_prefs)
+            else:
+                outcome = tally.replace_ballots(dict(zip(collusion_group, representatives)))
+            if group_happiness(outcome) > best_happiness:
+                best, best_happiness = representatives, group_happiness(outcome)
+            if add_strategic_rows(strategic_voting_options, representatives, outcome, original_system_prefs, true_happiness_levels, collusion_group, happiness_table, block_sizes, stats, option_filter, top_rows) and option_filter.risk_only:
+                done = True
+                break
+
+        # move to the best new combination unless it is worse, give up on the region after a while
+        if best is not None and best_happiness >= current_happiness:
+            stalled = 0 if best_happiness > current_happiness else stalled + 1
+            current, current_happiness = best, best_happiness
+        else:
+            stalled += 1
+        if stalled >= RESTART_AFTER:
+            current = [rng.sample(original_ballot, len(original_ballot)) for original_ballot in original_ballots]
+            current_happiness, stalled = -1.0, 0
+        combinations = get_group_moves(current, NEIGHBOURHOOD_SIZE, rng)
+
+    if stats is not None:
+        stats.count("covered_classes", len(seen))
+        stats.count("ballot_classes", len(seen))
+        stats.count("permutations", len(seen) * prod(factorial(size) for size in block_sizes) ** len(collusion_group))
+        stats.count("scheme_evaluations", len(seen) - 1)
+
+    return strategic_voting_options
+
+def get_group_moves(ballots: List[VoterPreferences], num_moves: int, rng: Random) -> List[List[VoterPreferences]]:
+    """ Return combinations that each differ from the ballots by a random move of one member's ballot. """
+    moves = []
+    for _ in range(num_moves):
+        member_position = rng.randrange(len(ballots))
+        moved = list(ballots)
+        moved[member_position] = get_random_moves(ballots[member_position], 1, rng)[0]
+        moves.append(moved)
+    return moves
+
+def add_strategic_rows(strategic_voting_options: List[tuple], representatives: List[VoterPreferences], outcome: str, original_system_prefs: SystemPreferences, true_happiness_levels: List[float], collusion_group: List[int], happiness_table: HappinessTable, block_sizes: List[int], stats: Optional[SearchStats] = None, option_filter: Optional[OptionFilter] = None, top_rows: Optional[BoundedHeap] = None) -> bool:
+    """ Add the rows of the members' ballot classes if their outcome is strategic for the group, and return whether it is.
+
+    Rows are keyed by the permutations of the members. With risk-only the row of the
+    representatives is enough, with top-k the rows are offered to the best rows.
+    """
+    happiness_levels = happiness_table.levels[outcome]
+
+    # overall happiness
+    overall_happiness = happiness_table.overall[outcome]
+    true_overall_happiness = sum(true_happiness_levels)
+
+    # check if the collusion group has higher overall happiness
+    group_happiness = sum(happiness_levels[voter_index] for voter_index in collusion_group)
+    true_group_happiness = sum(true_happiness_levels[voter_index] for voter_index in collusion_group)
+    better_overall = group_happiness > true_group_happiness
+    if (not better_overall):
+        return False
+
+    # check if anyone in the collusion group has individual lower happiness
+    anyone_unhappy = any(happiness_levels[voter_index] < true_happiness_levels[voter_index] for voter_index in collusion_group)
+    if (anyone_unhappy):
+        return False
+
+    make_row = lambda ballots: [VotingOption(ballots[-1], outcome, happiness_levels[voter_index], true_happiness_levels[voter_index], overall_happiness, true_overall_happiness) for voter_index in collusion_group]
+    if option_filter is not None and option_filter.risk_only:
+        # a single strategic row of the representatives shows the group can manipulate
+        key = tuple(get_permutation_key(ballot, original_system_prefs[member]) for ballot, member in zip(representatives, collusion_group))
+        strategic_voting_options.append((key, make_row(representatives)))
+        if stats is not None:
+            stats.count("options", len(collusion_group))
+    elif top_rows is not None:
+        score = group_happiness if option_filter.top_key == "voter_happiness" else overall_happiness
+        add_top_rows(top_rows, score, representatives, original_system_prefs, collusion_group, block_sizes, make_row)
+    else:
+        # store the strategic voting options for every combination of ballots in the members' classes
+        member_ballots = [list(expand_ballot_class(representative, block_sizes)) for representative in representatives]
+        for ballots in product(*member_ballots):
+            key = tuple(get_permutation_key(ballot, original_system_prefs[member]) for ballot, member in zip(ballots, collusion_group))
+            strategic_voting_options.append((key, make_row(ballots)))
+        if stats is not None:
+            stats.count("options", prod(len(ballots) for ballots in member_ballots) * len(collusion_group))
+    return True
+
+def add_top_rows(top_rows: BoundedHeap, score: float, representatives: List[VoterPreferences], original_system_prefs: SystemPreferences, collusion_group: List[int], block_sizes: List[int], make_row: Callable[[tuple], list]):
+    """ Offer the rows of every combination of ballots in the members' classes to the best rows.
+
+    Combinations come in the order of the nested permutations, which is also the tie-break, so the
+    first rejected one ends the offer.
+    """
+    if not top_rows.accepts(score, 0):
+        return
+
+    num_permutations = factorial(len(original_system_prefs[collusion_group[0]]))
+    member_ballots = [list(expand_ballot_class(representative, block_sizes)) for representative in representatives]
+    for ballots in product(*member_ballots):
+        order = 0
+        for ballot, member in zip(ballots, collusion_group):
+            order = order * num_permutations + get_permutation_index(ballot, original_system_prefs[member])
+        if not top_rows.push(score, order, lambda: make_row(ballots)):
+            break
+
+def get_group_search_keys(collusion_groups: List[List[int]], voter_classes: VoterClasses) -> List[tuple]:
+    """ Return the key under which each group's options are searched, voters outside of groups with identical ballots share one. """
+    return [("voter_class", voter_classes.voter_class[group[0]]) if len(group) == 1 else ("group", group_index) for group_index, group in enumerate(collusion_groups)]
+
+def get_collusion_tva_result(original_system_prefs: SystemPreferences, schemes: Dict[str, Scheme], collusion_groups: List[List[int]], engine: str = 'python', workers: int = 1, profile: bool = False, cache: Optional[ResultCache] = None, option_filter: Optional[OptionFilter] = None) -> dict:
+    """ Calculate the basic TVA result for a given voting scheme and set of preferences.
+
+    The engine selects how schemes are tallied, see `tally.ENGINES`. With more than one worker the
+    groups are split into shards of their first member's ballot classes, which are searched on a
+    process pool with the profile in shared memory. Profiling adds search statistics to every
+    scheme result. With a cache, only schemes without a cached result are searched. The option
+    filter selects which options are kept for every group, with a budget groups beyond it are
+    searched approximately.
+    """
+    if option_filter is None:
+        option_filter = OptionFilter()
 
     num_voters = len(original_system_prefs)
-    num_groups = len(collusion_groups)
+    voter_classes = VoterClasses(original_system_prefs)
+
+    search_keys = get_group_search_keys(collusion_groups, voter_classes)
+    search_groups: Dict[tuple, int] = {}
+    for group_index, search_key in enumerate(search_keys):
+        search_groups.setdefault(search_key, group_index)
+
+    cache_keys: Dict[str, str] = {}
+    cached_results: Dict[str, dict] = {}
+    if cache is not None:
+        for scheme_name in schemes:
+            cache_keys[scheme_name] = cache.get_key(original_system_prefs, scheme_name, mode="collusion", groups=collusion_groups, happiness_variant=0, **option_filter.get_cache_params())
+            scheme_result = cache.get(cache_keys[scheme_name])
+            if scheme_result is not None:
+                cached_results[scheme_name] = scheme_result
+
+    # an approximate search splits its budget over the searched groups and counts what it covered
+    search_filter = option_filter.share_budget(len(search_groups))
+    collect_stats = profile or option_filter.budget is not None
+
+    contexts: Dict[str, SchemeContext] = {}
+    searches = [(scheme_name, group_index) for scheme_name in schemes if scheme_name not in cached_results for group_index in search_groups.values()]
+    job_stats: Dict[str, SearchStats] = {}
+    options_by_job: Dict[tuple, List[List[VotingOption]]] = {}
+    if workers > 1 and searches:
+        jobs = []
+        for scheme_name, group_index in searches:
+            num_shards = get_num_shards(schemes[scheme_name], original_system_prefs, collusion_groups[group_index], workers, search_filter)
+            jobs.extend((scheme_name, group_index, (shard_index, num_shards)) for shard_index in range(num_shards))
+
+        shared_profile = SharedProfile(original_system_prefs)
+        try:
+            job_results = run_jobs(workers, init_collusion_worker, (shared_profile, schemes, collusion_groups, engine, collect_stats, search_filter), run_collusion_job, jobs)
+        finally:
+            shared_profile.close()
+
+        shards_by_search: Dict[tuple, list] = {}
+        for (scheme_name, group_index, _), (shard, stats) in zip(jobs, job_results):
+            shards_by_search.setdefault((scheme_name, group_index), []).append(shard)
+            if stats is not None:
+                job_stats.setdefault(scheme_name, SearchStats()).merge(stats)
+        for search, shards in shards_by_search.items():
+            options_by_job[search] = merge_group_shards(shards, option_filter)
+    else:
+        for scheme_name, group_index in searches:
+            if scheme_name not in contexts:
+                contexts[scheme_name] = SchemeContext(original_system_prefs, schemes[scheme_name], engine=engine, voter_classes=voter_classes, profile=collect_stats)
+            options_by_job[(scheme_name, group_index)] = search_group(original_system_prefs, contexts[scheme_name], collusion_groups[group_index], contexts[scheme_name].stats, search_filter)
 
     collusion_tva_result = {}
     for scheme_name, scheme in schemes.items():
-        non_strategic_outcome, non_strategic_happiness_levels = get_vote_result(original_system_prefs, original_system_prefs, scheme)
+        if scheme_name in cached_results:
+            collusion_tva_result[scheme_name] = cached_results[scheme_name]
+            continue
+
+        if scheme_name not in contexts:
+            contexts[scheme_name] = SchemeContext(original_system_prefs, scheme, engine=engine, voter_classes=voter_classes, profile=collect_stats)
+        context = contexts[scheme_name]
+        if scheme_name in job_stats:
+            context.stats.merge(job_stats[scheme_name])
 
         scheme_result = {}
-        scheme_result["non_strategic_outcome"] = non_strategic_outcome
-        scheme_result["non_strategic_happiness_levels"] = non_strategic_happiness_levels
-        scheme_result["non_strategic_overall_happiness"] = sum(non_strategic_happiness_levels)
+        scheme_result["non_strategic_outcome"] = context.outcome
+        scheme_result["non_strategic_happiness_levels"] = context.happiness_table.levels[context.outcome]
+        scheme_result["non_strategic_overall_happiness"] = context.happiness_table.overall[context.outcome]
         scheme_result["voters"] = []
 
         num_strategic_voters = 0
         strategic_options_dict: Dict[int, List[VotingOption]] = {}
-        for group_index in range(num_groups):
-            collusion_group = collusion_groups[group_index]
-            strategic_group_voting_options = get_strategic_options_for_group(original_system_prefs, scheme, collusion_group)
+        for group_index, collusion_group in enumerate(collusion_groups):
+            strategic_group_voting_options = options_by_job[(scheme_name, search_groups[search_keys[group_index]])]
 
             if len(strategic_group_voting_options) > 0:
                 num_strategic_voters += len(collusion_group)
 
-            # options for groups are stored in rows so this is ugly af
-            options_df = pd.DataFrame(strategic_group_voting_options)
-            for index in range(len(collusion_group)):
-                strategic_options_dict[collusion_group[index]] = options_df[index].tolist() if options_df.shape[1] > 0 else []
+            # options for groups are stored in rows, each member gets their column
+            for member_position, voter_index in enumerate(collusion_group):
+                strategic_options_dict[voter_index] = [row[member_position] for row in strategic_group_voting_options]
 
         # sorted voters by key
         scheme_result["voters"] = [strategic_options_dict[voter_index] for voter_index in range(num_voters)]
         scheme_result["strategic_voting_risk"] = get_strategic_voting_risk(num_strategic_voters, num_voters)
+        if option_filter.budget is not None:
+            scheme_result["approximate_search"] = get_search_coverage(option_filter.budget, context.stats.counters["search_space_classes"], context.stats.counters["covered_classes"], scheme_result["strategic_voting_risk"])
+        if profile:
+            scheme_result["stats"] = {"mode": "collusion", **context.stats.to_dict()}
         collusion_tva_result[scheme_name] = scheme_result
+        if cache is not None:
+            cache.put(cache_keys[scheme_name], scheme_result)
+
+    return collusion_tva_result
+
+def search_group(original_system_prefs: SystemPreferences, context: SchemeContext, collusion_group: List[int], stats: Optional[SearchStats] = None, option_filter: Optional[OptionFilter] = None) -> List[List[VotingOption]]:
+    """ Find the strategic voting options of a collusion group with the shared state of a scheme, counting into the given stats. """
+    if stats is None:
+        return get_strategic_options_for_group(original_system_prefs, context.scheme, collusion_group, context.tally, context.happiness_table, option_filter=option_filter)
+
+    with stats.timer("search"):
+        return get_strategic_options_for_group(original_system_prefs, context.scheme, collusion_group, context.tally, context.happiness_table, stats, option_filter)
+
+def search_group_shard(original_system_prefs: SystemPreferences, context: SchemeContext, collusion_group: List[int], shard: Tuple[int, int], stats: Optional[SearchStats] = None, option_filter: Optional[OptionFilter] = None) -> list:
+    """ Search one shard of a collusion group with the shared state of a scheme, counting into the given stats. """
+    if stats is None:
+        return get_strategic_options_for_group_shard(original_system_prefs, context.scheme, collusion_group, shard, context.tally, context.happiness_table, option_filter=option_filter)
+
+    with stats.timer("search"):
+        return get_strategic_options_for_group_shard(original_system_prefs, context.scheme, collusion_group, shard, context.tally, context.happiness_table, stats, option_filter)
+
+def get_num_shards(scheme: Scheme, original_system_prefs: SystemPreferences, collusion_group: List[int], workers: int, option_filter: OptionFilter) -> int:
+    """ Number of shards a group is searched in, single voters and approximate searches run in one piece. """
+    if len(collusion_group) == 1:
+        return 1
+    block_sizes = get_ballot_blocks(scheme, len(original_system_prefs[collusion_group[0]]))
+    num_classes = get_num_ballot_classes(block_sizes)
+    if option_filter.budget is not None and not option_filter.budget.fits(num_classes ** len(collusion_group)):
+        return 1
+    return min(workers * SHARDS_PER_WORKER, num_classes)
+
+def init_collusion_worker(shared_profile: SharedProfile, schemes: Dict[str, Scheme], collusion_groups: List[List[int]], engine: str, profile: bool = False, option_filter: Optional[OptionFilter] = None) -> dict:
+    """ Worker state for collusion mode, ballots are read from the shared profile as needed and scheme contexts are built on a worker's first job of a scheme. """
+    original_system_prefs = shared_profile.attach()
+    return {"prefs": original_system_prefs, "schemes": schemes, "groups": collusion_groups, "engine": engine, "profile": profile, "option_filter": option_filter, "voter_classes": VoterClasses(original_system_prefs), "contexts": {}}
 
-    return collusion_tva_result
\ No newline at end of file
+def run_collusion_job(state: dict, scheme_name: str, group_index: int, shard: Tuple[int, int]) -> tuple:
+    """ Search one shard of a collusion group for one scheme on a worker, returning it with the job's stats. """
+    contexts = state["contexts"]
+    if scheme_name not in contexts:
+        contexts[scheme_name] = SchemeContext(state["prefs"], state["schemes"][scheme_name], engine=state["engine"], voter_classes=state["voter_classes"])
+    stats = SearchStats() if state["profile"] else None
+    return search_group_shard(state["prefs"], contexts[scheme_name], state["groups"][group_index], shard, stats, state["option_filter"]), stats
@@ -1,27 +1,36 @@
+from cache import ResultCache
 from collusion import get_collusion_tva_result
-from tva_io import parse_args, write_to_output
-from voting import get_basic_tva_result
+from tva_io import get_round_output_file, parse_args, write_to_output
+from voting import OptionFilter, SearchBudget, get_basic_tva_result, get_runoff_tva_results
 
 if __name__ == "__main__":
-    mode, system_preferences, schemes, collusion_groups, output_file, runoff_elections, runoff_output_file = parse_args()
+    system_preferences, schemes, collusion_groups, args = parse_args()
+    mode, output_file, runoff_elections, runoff_output_file = args.mode, args.output, args.runoff, args.runoff_output
+
+    # results are cached per scheme, except when profiling since the stats describe an actual search,
+    # and when the search is limited by wall time since its results depend on the machine
+    cache = None
+    if args.clear_cache:
+        ResultCache(args.cache_dir, args.cache_size * 2**20).clear()
+    if not args.no_cache and not args.profile and args.budget_seconds == 0:
+        cache = ResultCache(args.cache_dir, args.cache_size * 2**20)
+
+    budget = SearchBudget(args.budget_evaluations, args.budget_seconds, args.seed) if args.budget_evaluations > 0 or args.budget_seconds > 0 else None
+    option_filter = OptionFilter(args.risk_only, args.top_k, args.top_key, args.best_response, budget)
 
     if mode == 'basic':
-        tva_result = get_basic_tva_result(system_preferences, schemes)
-        write_to_output(tva_result, output_file)
+        tva_result = get_basic_tva_result(system_preferences, schemes, engine=args.engine, workers=args.workers, profile=args.profile, cache=cache, option_filter=option_filter)
+        write_to_output(tva_result, output_file, args.format, args.summary_only)
     elif mode == 'collusion':
-        tva_result = get_collusion_tva_result(system_preferences, schemes, collusion_groups)
-        write_to_output(tva_result, output_file)
+        tva_result = get_collusion_tva_result(system_preferences, schemes, collusion_groups, args.engine, args.workers, args.profile, cache, option_filter)
+        write_to_output(tva_result, output_file, args.format, args.summary_only)
     elif mode == 'runoff':
-        if runoff_elections > 1:
-            basic_tva_result, result = get_basic_tva_result(system_preferences, schemes, runoff=runoff_elections)
-            write_to_output(basic_tva_result, runoff_output_file)
-            for pref in system_preferences:
-                temp = []
-                for val in pref:
-                    if val in result[:runoff_elections]:
-                        temp.append(val)
-                system_preferences[system_preferences.index(pref)] = temp
+        if runoff_elections[0] > 1:
+            *round_results, tva_result = get_runoff_tva_results(system_preferences, schemes, runoff_elections, args.engine, args.workers, args.profile, cache, option_filter)
+            for round_index, round_result in enumerate(round_results):
+                write_to_output(round_result, get_round_output_file(runoff_output_file, round_index, len(round_results)), args.format, args.summary_only)
+        elif runoff_elections[0] > 0:
+            tva_result = get_basic_tva_result(system_preferences, schemes, engine=args.engine, workers=args.workers, profile=args.profile, cache=cache, option_filter=option_filter)
 
-        if runoff_elections > 0:
-            tva_result = get_basic_tva_result(system_preferences, schemes)
-            write_to_output(tva_result, output_file)
\ No newline at end of file
+        if runoff_elections[0] > 0:
+            write_to_output(tva_result, output_file, args.format, args.summary_only)
\ No newline at end of file
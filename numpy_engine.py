@@ -0,0 +1,108 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from ballots import VoterClasses
+from tally import BaseTally, get_ranking
+from tva_types import SystemPreferences, VoterPreferences
+
+
+class RankMatrixTally(BaseTally):
+    """ Score tally of a positional voting scheme on an integer rank matrix.
+
+    The profile is encoded once as an n x m matrix holding the position of every candidate in every
+    ballot. Candidates are stored as columns in alphabetical order, so taking the first maximum of a
+    score row breaks ties alphabetically, just like the scheme functions do.
+
+    Attributes:
+        preferences:            Preferences the tally was built from
+        candidates:             Candidates in alphabetical order (the matrix columns)
+        ranks:                  Position of each candidate (column) in each voter's ballot (row)
+        score_vector:           Points awarded for each position of a ballot
+        points:                 The score vector as an array
+        scores:                 Summed points of each candidate over all ballots
+        counts_votes_only:      Whether candidates without points are left out of the ranking and
+                                appended in the order of the first ballot (as `Counter` does)
+    """
+
+    positional = True
+    rank_happiness = True
+
+    def __init__(self, preferences: SystemPreferences, score_vector: List[int], counts_votes_only: bool = False, voter_classes: Optional[VoterClasses] = None):
+        self.preferences = preferences
+        self.candidates = sorted(preferences[0])
+        self.candidate_ids = {candidate: i for i, candidate in enumerate(self.candidates)}
+        self.score_vector = score_vector
+        self.points = np.array(score_vector, dtype=np.int64)
+        self.counts_votes_only = counts_votes_only
+        if voter_classes is None:
+            voter_classes = VoterClasses(preferences)
+
+        # identical ballots are encoded and scored once and weighted by the number of voters casting them
+        class_ranks = self.encode(voter_classes.ballots)
+        self.ranks = class_ranks[voter_classes.voter_class]
+        self.scores = (self.points[class_ranks] * np.array(voter_classes.weights, dtype=np.int64)[:, None]).sum(axis=0)
+
+    def encode(self, ballots: List[VoterPreferences]) -> np.ndarray:
+        """ Encode ballots as rows of candidate positions. """
+        ranks = np.empty((len(ballots), len(self.candidates)), dtype=np.intp)
+        positions = np.arange(len(self.candidates))
+        for row, ballot in enumerate(ballots):
+            ranks[row, [self.candidate_ids[candidate] for candidate in ballot]] = positions
+        return ranks
+
+    def update_voter(self, voter_index: int, old_ballot: Optional[VoterPreferences], new_ballot: Optional[VoterPreferences]):
+        """ Move the rank row and points of a voter who changed their ballot, added voters have no old ballot and removed ones no new ballot. """
+        if old_ballot is not None:
+            self.scores -= self.points[self.ranks[voter_index]]
+        if new_ballot is None:
+            self.ranks = np.delete(self.ranks, voter_index, axis=0)
+            return
+
+        row = self.encode([new_ballot])
+        self.scores += self.points[row[0]]
+        if old_ballot is None:
+            self.ranks = np.insert(self.ranks, voter_index, row, axis=0)
+        else:
+            self.ranks[voter_index] = row[0]
+
+    def replace_score_array(self, replacements: Dict[int, VoterPreferences], removed: List[int] = []) -> np.ndarray:
+        """ Return the scores (as columns) if voters cast the replacement ballots and the removed voters cast none. """
+        scores = self.scores.copy()
+        if replacements:
+            scores -= self.points[self.ranks[list(replacements)]].sum(axis=0)
+            scores += self.points[self.encode(list(replacements.values()))].sum(axis=0)
+        if removed:
+            scores -= self.points[self.ranks[removed]].sum(axis=0)
+        return scores
+
+    def replace_scores(self, replacements: Dict[int, VoterPreferences], removed: List[int] = []) -> Dict[str, int]:
+        """ Return the scores if voters cast the replacement ballots and the removed voters cast none. """
+        return dict(zip(self.candidates, self.replace_score_array(replacements, removed).tolist()))
+
+    def replace_ballots(self, replacements: Dict[int, VoterPreferences], get_full_outcome: bool = False):
+        """ Return the outcome (and optionally the full outcome) if voters cast the replacement ballots. """
+        scores = self.replace_score_array(replacements)
+
+        outcome = self.candidates[int(scores.argmax())]
+        if get_full_outcome:
+            first_ballot = replacements.get(0, self.preferences[0])
+            return outcome, get_ranking(dict(zip(self.candidates, scores.tolist())), first_ballot, self.counts_votes_only)
+        return outcome
+
+    def replace_ballot_batch(self, voter_index: int, ballots: List[VoterPreferences], get_full_outcome: bool = False) -> list:
+        """ Score a batch of alternative ballots of one voter in a single array operation. """
+        scores = self.scores - self.points[self.ranks[voter_index]] + self.points[self.encode(ballots)]
+        outcomes = [self.candidates[i] for i in scores.argmax(axis=1).tolist()]
+        if not get_full_outcome:
+            return outcomes
+
+        results = []
+        for outcome, ballot, row in zip(outcomes, ballots, scores.tolist()):
+            first_ballot = ballot if voter_index == 0 else self.preferences[0]
+            results.append((outcome, get_ranking(dict(zip(self.candidates, row)), first_ballot, self.counts_votes_only)))
+        return results
+
+    def happiness(self, outcome: str) -> List[float]:
+        """ Calculate the happiness levels of all voters with the outcome from the rank matrix. """
+        return (1 - self.ranks[:, self.candidate_ids[outcome]] / (len(self.candidates) - 1)).tolist()
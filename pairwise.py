@@ -0,0 +1,184 @@
+from typing import Callable, Dict, List, Optional
+
+from ballots import VoterClasses
+from schemes import add_pairwise_preferences, condorcet_ranking, copeland_ranking
+from tally import BaseTally
+from tva_types import SystemPreferences, VoterPreferences
+
+
+class PairwiseTally(BaseTally):
+    """ Pairwise majority matrix of a Condorcet-family scheme over a fixed set of preferences.
+
+    The matrix counts, for every ordered pair of candidates, the voters ranking the first above the
+    second. It is built once. The outcome of replacing ballots is then derived by removing the pairs
+    of the original ballots and adding those of the replacements, O(m^2) per ballot, before the
+    scheme's rule decides on the matrix.
+
+    Attributes:
+        preferences:        Preferences the tally was built from
+        candidates:         Candidates in the order of the first ballot (the rows and columns of the matrix)
+        candidate_ids:      Row of each candidate
+        rule:               Decides the outcome and full outcome on a matrix, see `schemes.PAIRWISE_RULES`
+        matrix:             Pairwise majority matrix of all ballots, flattened by rows
+    """
+
+    pairwise = True
+
+    def __init__(self, preferences: SystemPreferences, rule: Callable[[List[int], List[str]], tuple], voter_classes: Optional[VoterClasses] = None):
+        self.preferences = preferences
+        self.candidates = list(preferences[0])
+        self.candidate_ids = {candidate: i for i, candidate in enumerate(self.candidates)}
+        self.rule = rule
+        if voter_classes is None:
+            voter_classes = VoterClasses(preferences)
+
+        # identical ballots are counted once and weighted by the number of voters casting them
+        self.matrix = [0] * (len(self.candidates) ** 2)
+        for ballot, weight in zip(voter_classes.ballots, voter_classes.weights):
+            add_pairwise_preferences(self.matrix, self.candidate_ids, ballot, weight)
+
+    def replace_matrix(self, replacements: Dict[int, VoterPreferences], removed: List[int] = []) -> List[int]:
+        """ Return the matrix if voters cast the replacement ballots and the removed voters cast none. """
+        matrix = self.matrix.copy()
+        for voter_index, ballot in replacements.items():
+            add_pairwise_preferences(matrix, self.candidate_ids, self.preferences[voter_index], -1)
+            add_pairwise_preferences(matrix, self.candidate_ids, ballot)
+        for voter_index in removed:
+            add_pairwise_preferences(matrix, self.candidate_ids, self.preferences[voter_index], -1)
+        return matrix
+
+    def update_voter(self, voter_index: int, old_ballot: Optional[VoterPreferences], new_ballot: Optional[VoterPreferences]):
+        """ Move the pairs of a voter who changed their ballot, added voters have no old ballot and removed ones no new ballot. """
+        if old_ballot is not None:
+            add_pairwise_preferences(self.matrix, self.candidate_ids, old_ballot, -1)
+        if new_ballot is not None:
+            add_pairwise_preferences(self.matrix, self.candidate_ids, new_ballot)
+
+    def replace_ballots(self, replacements: Dict[int, VoterPreferences], get_full_outcome: bool = False):
+        """ Return the outcome (and optionally the full outcome) if voters cast the replacement ballots. """
+        outcome, full_outcome = self.rule(self.replace_matrix(replacements), self.candidates)
+        return (outcome, full_outcome) if get_full_outcome else outcome
+
+    def replace_ballot_batch(self, voter_index: int, ballots: List[VoterPreferences], get_full_outcome: bool = False) -> list:
+        """ Return the outcomes for a batch of alternative ballots of one voter, whose own pairs are removed once. """
+        decide = self.get_ballot_rule(self.replace_matrix({}, [voter_index]), get_full_outcome)
+        return [decide(ballot) for ballot in ballots]
+
+    def get_ballot_rule(self, matrix: List[int], get_full_outcome: bool = False) -> Callable[[VoterPreferences], object]:
+        """ Return a function deciding the outcome (and optionally the full outcome) if one more ballot is added to the matrix.
+
+        Rules with a shortcut for a single ballot decide on the ballot directly, otherwise each ballot
+        is added to the matrix and removed again after the rule decided. The matrix must not change
+        while the function is used.
+        """
+        if self.rule in BALLOT_RULES:
+            ballot_rule = BALLOT_RULES[self.rule](matrix, self.candidates)
+            return lambda ballot: ballot_rule.decide([self.candidate_ids[candidate] for candidate in ballot], get_full_outcome)
+
+        def decide(ballot: VoterPreferences):
+            add_pairwise_preferences(matrix, self.candidate_ids, ballot)
+            outcome, full_outcome = self.rule(matrix, self.candidates)
+            add_pairwise_preferences(matrix, self.candidate_ids, ballot, -1)
+            return (outcome, full_outcome) if get_full_outcome else outcome
+        return decide
+
+def get_positions(ballot_ids: List[int]) -> List[int]:
+    """ Return the position of every candidate (by ID) in a ballot of candidate IDs. """
+    positions = [0] * len(ballot_ids)
+    for position, candidate_id in enumerate(ballot_ids):
+        positions[candidate_id] = position
+    return positions
+
+def get_ranked_outcome(scores: List[int], candidates: List[str], get_full_outcome: bool):
+    """ Return the candidate with the highest score (ties broken alphabetically), and optionally all candidates ranked that way. """
+    if get_full_outcome:
+        ranking = [candidate for _, candidate in sorted(zip((-score for score in scores), candidates))]
+        return ranking[0], ranking
+    return candidates[min(range(len(candidates)), key=lambda i: (-scores[i], candidates[i]))]
+
+class CopelandBallots:
+    """ Copeland outcomes of the ballots a voter could cast, on the matrix of all other voters.
+
+    A ballot moves every pairwise margin by one, so only pairs with a margin of at most one can
+    change their result. The points of all other pairs are summed up once.
+
+    Attributes:
+        candidates:     Candidates by ID
+        fixed_scores:   Points of every candidate from the pairs no ballot can change
+        close_pairs:    Pairs of candidate IDs whose result depends on the ballot, with their margin
+    """
+
+    def __init__(self, matrix: List[int], candidates: List[str]):
+        num_candidates = len(candidates)
+        self.candidates = candidates
+        self.fixed_scores = [0] * num_candidates
+        self.close_pairs = []
+        for a in range(num_candidates):
+            for b in range(a + 1, num_candidates):
+                margin = matrix[a * num_candidates + b] - matrix[b * num_candidates + a]
+                if abs(margin) <= 1:
+                    self.close_pairs.append((a, b, margin))
+                else:
+                    self.fixed_scores[a if margin > 0 else b] += 2
+
+    def decide(self, ballot_ids: List[int], get_full_outcome: bool = False):
+        """ Return the outcome (and optionally the full outcome) if the voter casts the ballot. """
+        positions = get_positions(ballot_ids)
+        scores = self.fixed_scores.copy()
+        for a, b, margin in self.close_pairs:
+            margin += 1 if positions[a] < positions[b] else -1
+            if margin > 0:
+                scores[a] += 2
+            elif margin < 0:
+                scores[b] += 2
+            else:
+                scores[a] += 1
+                scores[b] += 1
+        return get_ranked_outcome(scores, self.candidates, get_full_outcome)
+
+class CondorcetBallots:
+    """ Condorcet (with Borda fallback) outcomes of the ballots a voter could cast, on the matrix of all other voters.
+
+    Only a candidate that no other candidate beats without the voter can become the Condorcet
+    winner, and it does if the ballot ranks it above every candidate it leads by at most one.
+
+    Attributes:
+        candidates:     Candidates by ID
+        borda_scores:   Borda score of every candidate without the voter
+        contenders:     IDs of the candidates that could become the Condorcet winner, with the
+                        IDs of the candidates the ballot has to rank below them
+    """
+
+    def __init__(self, matrix: List[int], candidates: List[str]):
+        num_candidates = len(candidates)
+        self.candidates = candidates
+        self.borda_scores = [sum(matrix[a * num_candidates:(a + 1) * num_candidates]) for a in range(num_candidates)]
+        self.contenders = []
+        for a in range(num_candidates):
+            margins = {b: matrix[a * num_candidates + b] - matrix[b * num_candidates + a] for b in range(num_candidates) if b != a}
+            if all(margin >= 0 for margin in margins.values()):
+                self.contenders.append((a, [b for b, margin in margins.items() if margin <= 1]))
+
+    def decide(self, ballot_ids: List[int], get_full_outcome: bool = False):
+        """ Return the outcome (and optionally the full outcome) if the voter casts the ballot. """
+        positions = get_positions(ballot_ids)
+        winner = next((a for a, critical in self.contenders if all(positions[a] < positions[b] for b in critical)), None)
+        if winner is not None and not get_full_outcome:
+            return self.candidates[winner]
+
+        num_candidates = len(self.candidates)
+        scores = [self.borda_scores[a] + num_candidates - 1 - positions[a] for a in range(num_candidates)]
+        outcome = get_ranked_outcome(scores, self.candidates, get_full_outcome)
+        if winner is None:
+            return outcome
+
+        ranking = outcome[1]
+        ranking.remove(self.candidates[winner])
+        ranking.insert(0, self.candidates[winner])
+        return ranking[0], ranking
+
+BALLOT_RULES: Dict[Callable, type] = {
+    copeland_ranking: CopelandBallots,
+    condorcet_ranking: CondorcetBallots,
+}
+""" Shortcuts of the rules for a single ballot added to a fixed matrix, the other rules decide on the full matrix. """
@@ -0,0 +1,104 @@
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Iterable, Iterator, List, Sequence
+
+from tva_types import SystemPreferences
+
+worker_state = None
+""" State of the current worker process, set up once when the worker starts. """
+
+def init_worker(setup: Callable, setup_args: tuple):
+    """ Set up the worker state, so shared data is sent to every worker once instead of with every job. """
+    global worker_state
+    worker_state = setup(*setup_args)
+
+def run_job(job: tuple):
+    """ Run a job function on the worker state. """
+    job_function, job_args = job
+    return job_function(worker_state, *job_args)
+
+def run_jobs(workers: int, setup: Callable, setup_args: tuple, job_function: Callable, jobs: List[tuple]) -> list:
+    """ Run the jobs on a process pool and return their results in the order of the jobs.
+
+    Functions must be defined at module level so they can be sent to the workers.
+    """
+    chunksize = max(1, len(jobs) // (workers * 4))
+    return list(iter_jobs(workers, setup, setup_args, job_function, jobs, chunksize))
+
+def iter_jobs(workers: int, setup: Callable, setup_args: tuple, job_function: Callable, jobs: Iterable[tuple], chunksize: int = 1) -> Iterator:
+    """ Run the jobs on a process pool and yield their results in the order of the jobs as they finish. """
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(setup, setup_args)) as executor:
+        yield from executor.map(run_job, ((job_function, job_args) for job_args in jobs), chunksize=chunksize)
+
+class SharedProfile:
+    """ Ballots of a profile in shared memory, workers attach to them by name instead of receiving a copy.
+
+    Every position of a ballot is stored as a two byte candidate ID. Only the name, the candidates
+    and the number of voters are pickled, workers attach to the block with `attach`. The process
+    that shared the profile has to close it.
+
+    Attributes:
+        name:           Name of the shared memory block
+        candidates:     Candidate names by ID, in the order of the first ballot
+        num_voters:     Number of ballots
+        memory:         The shared memory block (None where the profile was unpickled)
+    """
+
+    def __init__(self, preferences: SystemPreferences):
+        self.candidates = list(preferences[0])
+        self.num_voters = len(preferences)
+        candidate_ids = {candidate: candidate_id for candidate_id, candidate in enumerate(self.candidates)}
+        ballots = array('H', (candidate_ids[candidate] for ballot in preferences for candidate in ballot))
+
+        self.memory = SharedMemory(create=True, size=max(1, len(ballots) * ballots.itemsize))
+        self.memory.buf[:len(ballots) * ballots.itemsize] = ballots.tobytes()
+        self.name = self.memory.name
+
+    def __getstate__(self) -> dict:
+        return {"name": self.name, "candidates": self.candidates, "num_voters": self.num_voters}
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state, memory=None)
+
+    def attach(self) -> 'SharedBallots':
+        """ Attach to the shared memory block, ballots are read from it as they are accessed. """
+        return SharedBallots(SharedMemory(name=self.name), self.candidates, self.num_voters)
+
+    def close(self):
+        """ Release the shared memory, once the workers are done with it. """
+        self.memory.close()
+        self.memory.unlink()
+
+class SharedBallots(Sequence):
+    """ Ballots of a shared profile, read from the attached shared memory block without copying it.
+
+    Accessing a voter decodes their ballot from the candidate IDs in the block, so a worker never
+    holds the full profile as lists of names.
+
+    Attributes:
+        memory:         The attached shared memory block, open as long as the ballots are used
+        candidates:     Candidate names by ID
+        num_voters:     Number of ballots
+        candidate_ids:  Candidate IDs of all ballots, a view into the block
+    """
+
+    def __init__(self, memory: SharedMemory, candidates: List[str], num_voters: int):
+        self.memory = memory
+        self.candidates = candidates
+        self.num_voters = num_voters
+        self.candidate_ids = memory.buf.cast('H')
+
+    def __len__(self) -> int:
+        return self.num_voters
+
+    def __getitem__(self, voter_index):
+        if isinstance(voter_index, slice):
+            return [self[i] for i in range(*voter_index.indices(self.num_voters))]
+        if voter_index < 0:
+            voter_index += self.num_voters
+        if not 0 <= voter_index < self.num_voters:
+            raise IndexError(voter_index)
+
+        num_candidates = len(self.candidates)
+        return [self.candidates[candidate_id] for candidate_id in self.candidate_ids[voter_index * num_candidates:(voter_index + 1) * num_candidates]]
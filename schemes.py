@@ -1,49 +1,143 @@
 from collections import Counter
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional
 
 from tva_types import SystemPreferences, Scheme
 
 
-def plurality(preferences: SystemPreferences) -> tuple[str, list[str]]:
+def plurality(preferences: SystemPreferences, weights: Optional[List[int]] = None) -> tuple[str, list[str]]:
     """ Return winner based on the Plurality voting scheme. """
-    votes = [pref[0] for pref in preferences]
-    outcome = Counter(votes).most_common()
+    votes = Counter()
+    for pref, weight in zip(preferences, get_weights(preferences, weights)):
+        votes[pref[0]] += weight
+    outcome = votes.most_common()
     outcome.sort(key=lambda x: (-x[1], x[0]))
     return outcome[0][0], get_outcome_order(outcome, preferences[0])
 
-def voting_for_two(preferences: SystemPreferences) -> tuple[str, list[str]]:
+def voting_for_two(preferences: SystemPreferences, weights: Optional[List[int]] = None) -> tuple[str, list[str]]:
     """ Return winner based on the Voting-for-Two scheme. """
-    votes = [pref[0] for pref in preferences] + [pref[1] for pref in preferences]
-    outcome = Counter(votes).most_common()
+    votes = Counter()
+    for pref, weight in zip(preferences, get_weights(preferences, weights)):
+        votes[pref[0]] += weight
+        votes[pref[1]] += weight
+    outcome = votes.most_common()
     outcome.sort(key=lambda x: (-x[1], x[0]))
     return outcome[0][0], get_outcome_order(outcome, preferences[0])
 
-def anti_plurality(preferences: SystemPreferences) -> tuple[str, list[str]]:
+def anti_plurality(preferences: SystemPreferences, weights: Optional[List[int]] = None) -> tuple[str, list[str]]:
     """ Return winner based on the Anti-Plurality voting scheme. """
     # Count the number of times each candidate is placed last
-    last_place_votes = Counter(pref[-1] for pref in preferences)
+    weights = get_weights(preferences, weights)
+    last_place_votes = Counter()
+    for pref, weight in zip(preferences, weights):
+        last_place_votes[pref[-1]] += weight
 
     # Calculate the score for each candidate by subtracting the number of last place votes from the total votes
     candidates = preferences[0]
     scores = {candidate: 0 for candidate in candidates}
-    total_votes = len(preferences)
+    total_votes = sum(weights)
     for candidate in scores:
         scores[candidate] = total_votes - last_place_votes.get(candidate, 0)
 
     outcome = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
     return outcome[0][0], get_outcome_order(outcome, preferences[0])
 
-def borda(preferences: SystemPreferences) -> tuple[str, list[str]]:
+def borda(preferences: SystemPreferences, weights: Optional[List[int]] = None) -> tuple[str, list[str]]:
     """ Return winner based on the Borda voting scheme. """
     candidates = preferences[0]
     scores = {candidate: 0 for candidate in candidates}
-    for pref in preferences:
+    for pref, weight in zip(preferences, get_weights(preferences, weights)):
         for i, candidate in enumerate(pref):
             # Assign points based on the position in the preference list
-            scores[candidate] += len(candidates) - i - 1
+            scores[candidate] += weight * (len(candidates) - i - 1)
     outcome = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
     return outcome[0][0], get_outcome_order(outcome, preferences[0])
 
+def copeland(preferences: SystemPreferences, weights: Optional[List[int]] = None) -> tuple[str, list[str]]:
+    """ Return winner based on the Copeland scheme. """
+    return copeland_ranking(get_pairwise_matrix(preferences, weights), preferences[0])
+
+def condorcet(preferences: SystemPreferences, weights: Optional[List[int]] = None) -> tuple[str, list[str]]:
+    """ Return the Condorcet winner, or the Borda winner if there is none. """
+    return condorcet_ranking(get_pairwise_matrix(preferences, weights), preferences[0])
+
+def schulze(preferences: SystemPreferences, weights: Optional[List[int]] = None) -> tuple[str, list[str]]:
+    """ Return winner based on the Schulze scheme. """
+    return schulze_ranking(get_pairwise_matrix(preferences, weights), preferences[0])
+
+def get_pairwise_matrix(preferences: SystemPreferences, weights: Optional[List[int]] = None) -> List[int]:
+    """ Return the pairwise majority matrix over the candidates of the first ballot, flattened by rows.
+
+    Entry a * m + b is the number of voters ranking candidate a above candidate b, candidates are
+    numbered by their position in the first ballot.
+    """
+    candidate_ids = {candidate: i for i, candidate in enumerate(preferences[0])}
+    matrix = [0] * (len(candidate_ids) ** 2)
+    for pref, weight in zip(preferences, get_weights(preferences, weights)):
+        add_pairwise_preferences(matrix, candidate_ids, pref, weight)
+    return matrix
+
+def add_pairwise_preferences(matrix: List[int], candidate_ids: Dict[str, int], ballot: List[str], weight: int = 1):
+    """ Add every pair a ballot cast by weight voters ranks to the matrix (a negative weight removes them). """
+    num_candidates = len(candidate_ids)
+    ids = [candidate_ids[candidate] for candidate in ballot]
+    for position, above in enumerate(ids):
+        row = above * num_candidates
+        for below in ids[position + 1:]:
+            matrix[row + below] += weight
+
+def copeland_ranking(matrix: List[int], candidates: List[str]) -> tuple[str, list[str]]:
+    """ Rank candidates by two points per pairwise majority win and one per tie. """
+    num_candidates = len(candidates)
+    scores = {}
+    for a, candidate in enumerate(candidates):
+        score = 0
+        for b in range(num_candidates):
+            if b != a:
+                score += 2 if matrix[a * num_candidates + b] > matrix[b * num_candidates + a] else 1 if matrix[a * num_candidates + b] == matrix[b * num_candidates + a] else 0
+        scores[candidate] = score
+    outcome = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+    return outcome[0][0], get_outcome_order(outcome, candidates)
+
+def condorcet_ranking(matrix: List[int], candidates: List[str]) -> tuple[str, list[str]]:
+    """ Put the candidate winning every pairwise majority first, if there is one, and rank the rest by Borda score.
+
+    The Borda score of a candidate is the number of times it is ranked above any other candidate,
+    the sum of its row of the matrix.
+    """
+    num_candidates = len(candidates)
+    scores = {candidate: sum(matrix[a * num_candidates:(a + 1) * num_candidates]) for a, candidate in enumerate(candidates)}
+    outcome_order = get_outcome_order(sorted(scores.items(), key=lambda x: (-x[1], x[0])), candidates)
+
+    for a, candidate in enumerate(candidates):
+        if all(matrix[a * num_candidates + b] > matrix[b * num_candidates + a] for b in range(num_candidates) if b != a):
+            outcome_order.remove(candidate)
+            outcome_order.insert(0, candidate)
+            break
+    return outcome_order[0], outcome_order
+
+def schulze_ranking(matrix: List[int], candidates: List[str]) -> tuple[str, list[str]]:
+    """ Rank candidates by the number of others they beat on the strongest paths of pairwise majorities.
+
+    A candidate beating the most others is never beaten itself, so the first one is a Schulze winner.
+    """
+    num_candidates = len(candidates)
+    strengths = [support if support > matrix[(i % num_candidates) * num_candidates + i // num_candidates] else 0 for i, support in enumerate(matrix)]
+    for k in range(num_candidates):
+        for a in range(num_candidates):
+            if a == k or strengths[a * num_candidates + k] == 0:
+                continue
+            for b in range(num_candidates):
+                if b != a and b != k:
+                    strengths[a * num_candidates + b] = max(strengths[a * num_candidates + b], min(strengths[a * num_candidates + k], strengths[k * num_candidates + b]))
+
+    wins = {candidate: sum(1 for b in range(num_candidates) if strengths[a * num_candidates + b] > strengths[b * num_candidates + a]) for a, candidate in enumerate(candidates)}
+    outcome = sorted(wins.items(), key=lambda x: (-x[1], x[0]))
+    return outcome[0][0], get_outcome_order(outcome, candidates)
+
+def get_weights(preferences: SystemPreferences, weights: Optional[List[int]]) -> List[int]:
+    """ Return the number of voters behind each ballot, one each if no weights are given. """
+    return weights if weights is not None else [1] * len(preferences)
+
 def get_outcome_order(outcome: dict, candidates: List[str]) -> list[str]:
     """ Return the candidates in the order they appear in the outcome. """
     outcome_order = []
@@ -52,4 +146,46 @@ def get_outcome_order(outcome: dict, candidates: List[str]) -> list[str]:
     for candidate in candidates:
         if candidate not in outcome_order:
             outcome_order.append(candidate)
-    return outcome_order
\ No newline at end of file
+    return outcome_order
+
+POSITIONAL_SCORES: Dict[Scheme, Callable[[int], List[int]]] = {
+    plurality: lambda num_candidates: [1] + [0] * (num_candidates - 1),
+    voting_for_two: lambda num_candidates: [1, 1] + [0] * (num_candidates - 2),
+    anti_plurality: lambda num_candidates: [1] * (num_candidates - 1) + [0],
+    borda: lambda num_candidates: list(range(num_candidates - 1, -1, -1)),
+}
+""" Points awarded for each ballot position by the schemes that are positional scoring rules. """
+
+VOTE_COUNTING_SCHEMES = {plurality, voting_for_two}
+""" Schemes that only rank candidates with votes, the rest follow in the order of the first ballot. """
+
+PAIRWISE_RULES: Dict[Scheme, Callable[[List[int], List[str]], tuple]] = {
+    copeland: copeland_ranking,
+    condorcet: condorcet_ranking,
+    schulze: schulze_ranking,
+}
+""" Rules deciding the outcome and full outcome on the pairwise majority matrix, for the Condorcet-family schemes. """
+
+def get_score_vector(scheme: Scheme, num_candidates: int) -> Optional[List[int]]:
+    """ Return the points per ballot position, or None if the scheme is not a positional scoring rule. """
+    if scheme not in POSITIONAL_SCORES:
+        return None
+    return POSITIONAL_SCORES[scheme](num_candidates)
+
+def get_ballot_blocks(scheme: Scheme, num_candidates: int) -> List[int]:
+    """ Return the sizes of consecutive runs of ballot positions the scheme does not distinguish.
+
+    Reordering candidates inside a block never changes the outcome: plurality only sees the top choice,
+    voting for two the unordered top two and anti-plurality the last place.
+    """
+    score_vector = get_score_vector(scheme, num_candidates)
+    if score_vector is None:
+        return [1] * num_candidates
+
+    blocks = [1]
+    for previous_points, points in zip(score_vector, score_vector[1:]):
+        if points == previous_points:
+            blocks[-1] += 1
+        else:
+            blocks.append(1)
+    return blocks
@@ -0,0 +1,363 @@
+import argparse
+import asyncio
+import json
+import sys
+from contextlib import redirect_stdout
+from typing import Any, Callable, Dict, List, Optional
+
+from ballots import TopOptions, VoterClasses, VoterOptions
+from schemes import add_pairwise_preferences, condorcet_ranking, copeland_ranking
+from tally import add_points, get_reachable_winners
+from tva_io import generic_serializer, get_scheme_summary, parse_prefs, parse_scheme_names, validate_engine, validate_option_filter
+from tva_types import Scheme, SystemPreferences, VoterPreferences
+from voting import OptionFilter, SchemeContext, get_scheme_result, search_voter
+
+def options_could_change(old_scores: Dict[str, int], new_scores: Dict[str, int], score_vector: List[int], ballot: VoterPreferences) -> bool:
+    """ Whether a voter casting the ballot could get other outcomes from their ballots after the scores changed.
+
+    The outcomes of a voter only depend on the scores of all other voters, and every outcome is among
+    the candidates that are reachable with one free ballot. If no candidate reachable before or
+    after the change got a different score, every ballot of the voter keeps its outcome.
+    """
+    old_scores, new_scores = old_scores.copy(), new_scores.copy()
+    add_points(old_scores, score_vector, ballot, -1)
+    add_points(new_scores, score_vector, ballot, -1)
+
+    changed = {candidate for candidate in new_scores if new_scores[candidate] != old_scores[candidate]}
+    if not changed:
+        return False
+    return bool(changed & (get_reachable_winners(old_scores, score_vector, 1) | get_reachable_winners(new_scores, score_vector, 1)))
+
+def get_margins(matrix: List[int], candidate_ids: Dict[str, int], ballot: VoterPreferences) -> List[List[int]]:
+    """ Return the pairwise margin of every candidate over every other (by ID) on the matrix without the ballot. """
+    matrix = matrix.copy()
+    add_pairwise_preferences(matrix, candidate_ids, ballot, -1)
+    num_candidates = len(candidate_ids)
+    return [[matrix[a * num_candidates + b] - matrix[b * num_candidates + a] for b in range(num_candidates)] for a in range(num_candidates)]
+
+def matrix_options_could_change(old_matrix: List[int], new_matrix: List[int], candidate_ids: Dict[str, int], rule: Callable, ballot: VoterPreferences) -> bool:
+    """ Whether a voter casting the ballot could get other outcomes from their ballots after the pairwise matrix changed.
+
+    The outcomes of a voter only depend on the matrix of all other voters, and the voter's ballot
+    moves every margin by one. Copeland and Condorcet only see on which side of the tie a margin
+    ends up, so margins beyond one on the same side are as good as equal. Condorcet falls back to
+    Borda scores, which only depend on the summed margins of every candidate, unless a candidate
+    wins every pair by more than one. Schulze is only known to keep its outcomes on an unchanged
+    matrix.
+    """
+    if old_matrix == new_matrix:
+        return False
+    if rule is not copeland_ranking and rule is not condorcet_ranking:
+        return True
+
+    old_margins = get_margins(old_matrix, candidate_ids, ballot)
+    new_margins = get_margins(new_matrix, candidate_ids, ballot)
+    clamped = [[max(-2, min(2, margin)) for margin in row] for row in new_margins]
+    if [[max(-2, min(2, margin)) for margin in row] for row in old_margins] != clamped:
+        return True
+    if rule is copeland_ranking or any(all(margin == 2 for b, margin in enumerate(row) if b != a) for a, row in enumerate(clamped)):
+        return False
+    return [sum(row) for row in old_margins] != [sum(row) for row in new_margins]
+
+class AnalysisSession:
+    """ A profile kept in memory with the strategic options of every distinct ballot per scheme.
+
+    Ballot updates move the changed ballot in the tallies and happiness tables of the scheme
+    contexts, and only search the distinct ballots whose options could have changed. The options of
+    the other ballots are kept with their overall happiness refreshed. Options ranked by overall
+    happiness, constructed or sampled options are searched again on every update.
+
+    Attributes:
+        preferences:    Current ballots of all voters
+        schemes:        Voting schemes analysed
+        engine:         Tally engine
+        option_filter:  Which strategic options the searches keep
+        ballot_counts:  Number of voters casting each distinct ballot
+        contexts:       Shared search state of every scheme for the current ballots
+        options:        Strategic options per scheme and distinct ballot
+    """
+
+    def __init__(self, preferences: SystemPreferences, schemes: Dict[str, Scheme], engine: str = 'python', option_filter: Optional[OptionFilter] = None):
+        self.preferences = [list(ballot) for ballot in preferences]
+        self.schemes = schemes
+        self.engine = engine
+        self.option_filter = option_filter if option_filter is not None else OptionFilter()
+
+        voter_classes = VoterClasses(self.preferences)
+        self.ballot_counts: Dict[tuple, int] = {tuple(ballot): weight for ballot, weight in zip(voter_classes.ballots, voter_classes.weights)}
+        self.contexts: Dict[str, SchemeContext] = {scheme_name: SchemeContext(self.preferences, scheme, engine=engine, voter_classes=voter_classes) for scheme_name, scheme in schemes.items()}
+        self.options: Dict[str, Dict[tuple, VoterOptions]] = {scheme_name: {} for scheme_name in schemes}
+        for scheme_name in schemes:
+            self.search(scheme_name)
+
+    def validate_ballot(self, ballot: VoterPreferences):
+        """ Raise a ValueError unless the ballot ranks exactly the candidates of the profile. """
+        if not isinstance(ballot, list) or sorted(ballot) != sorted(self.preferences[0]):
+            raise ValueError(f"Invalid ballot: {ballot}, it must rank each of {sorted(self.preferences[0])} once.")
+
+    def validate_voter(self, voter_index: int):
+        """ Raise a ValueError unless the voter is in the profile. """
+        if not isinstance(voter_index, int) or not 0 <= voter_index < len(self.preferences):
+            raise ValueError(f"Unavailable voter: {voter_index}")
+
+    def add(self, ballot: VoterPreferences) -> dict:
+        """ Add a voter casting the ballot, they get the next voter index. """
+        self.validate_ballot(ballot)
+        self.preferences.append(list(ballot))
+        voter_index = len(self.preferences) - 1
+        return {"voter": voter_index, **self.update(voter_index, None, self.preferences[voter_index])}
+
+    def remove(self, voter_index: int) -> dict:
+        """ Remove a voter, the voters after them move up by one index. """
+        self.validate_voter(voter_index)
+        if len(self.preferences) == 1:
+            raise ValueError("The last voter cannot be removed.")
+        return self.update(voter_index, self.preferences.pop(voter_index), None)
+
+    def replace(self, voter_index: int, ballot: VoterPreferences) -> dict:
+        """ Let a voter cast a different ballot, casting the same ballot again changes nothing. """
+        self.validate_voter(voter_index)
+        self.validate_ballot(ballot)
+        if ballot == self.preferences[voter_index]:
+            return {"searched": {scheme_name: 0 for scheme_name in self.schemes}, "reused": {scheme_name: len(self.options[scheme_name]) for scheme_name in self.schemes}}
+
+        old_ballot = self.preferences[voter_index]
+        self.preferences[voter_index] = list(ballot)
+        return self.update(voter_index, old_ballot, self.preferences[voter_index])
+
+    def update(self, voter_index: int, old_ballot: Optional[VoterPreferences], new_ballot: Optional[VoterPreferences]) -> dict:
+        """ Follow a voter who changed their ballot in the preferences and search the ballots that need it.
+
+        Added voters have no old ballot and removed ones no new ballot. Returns the number of distinct
+        ballots searched and reused per scheme.
+        """
+        for ballot, weight in ((old_ballot, -1), (new_ballot, 1)):
+            if ballot is not None:
+                key = tuple(ballot)
+                self.ballot_counts[key] = self.ballot_counts.get(key, 0) + weight
+                if not self.ballot_counts[key]:
+                    del self.ballot_counts[key]
+
+        searched: Dict[str, int] = {}
+        reused: Dict[str, int] = {}
+        for scheme_name, context in self.contexts.items():
+            # options are carried over by their outcomes, constructed and sampled options depend on more
+            tally = context.tally
+            reusable = tally is not None and (tally.positional or tally.pairwise) and not self.option_filter.best_response and self.option_filter.budget is None
+            if reusable:
+                old_tally = tally.replace_scores({}) if tally.positional else tally.replace_matrix({})
+
+            context.update_voter(self.preferences, voter_index, old_ballot, new_ballot)
+
+            could_change = None
+            if reusable and tally.positional:
+                new_scores = tally.replace_scores({})
+                could_change = lambda ballot: options_could_change(old_tally, new_scores, tally.score_vector, ballot)
+            elif reusable:
+                new_matrix = tally.replace_matrix({})
+                could_change = lambda ballot: matrix_options_could_change(old_tally, new_matrix, tally.candidate_ids, tally.rule, ballot)
+            searched[scheme_name] = self.search(scheme_name, could_change)
+            reused[scheme_name] = len(self.options[scheme_name]) - searched[scheme_name]
+        return {"searched": searched, "reused": reused}
+
+    def search(self, scheme_name: str, could_change: Optional[Callable[[VoterPreferences], bool]] = None) -> int:
+        """ Search the options of every distinct ballot, keeping those of ballots whose options could not have changed.
+
+        Without a check whether options could change, every ballot is searched. Returns the number of
+        ballots searched.
+        """
+        context = self.contexts[scheme_name]
+        old_options = self.options[scheme_name]
+        options = {}
+        num_searched = 0
+        for key in self.ballot_counts:
+            # options ranked by overall happiness could rank differently even with the same outcomes
+            voter_options = old_options.get(key)
+            refreshable = isinstance(voter_options, VoterOptions) or (isinstance(voter_options, TopOptions) and voter_options.top_key == "voter_happiness")
+            if could_change is not None and refreshable and not could_change(key):
+                voter_options.refresh_overall_happiness(context.happiness_table.overall[context.outcome], context.happiness_table.overall)
+                options[key] = voter_options
+            else:
+                options[key] = search_voter(self.preferences, context, self.preferences.index(list(key)), option_filter=self.option_filter)
+                num_searched += 1
+
+        self.options[scheme_name] = options
+        return num_searched
+
+    def result(self, summary_only: bool = False) -> dict:
+        """ Return the TVA result of the current ballots, in the shape `get_basic_tva_result` returns. """
+        tva_result = {}
+        for scheme_name in self.schemes:
+            options = self.options[scheme_name]
+            tva_result[scheme_name] = get_scheme_result(self.contexts[scheme_name], [options[tuple(ballot)] for ballot in self.preferences])
+            if summary_only:
+                tva_result[scheme_name] = get_scheme_summary(tva_result[scheme_name])
+        return tva_result
+
+def load_session(filename: str, scheme_names: List[str], engine: str, option_filter: OptionFilter) -> AnalysisSession:
+    """ Load a profile into a new session, keeping the loader's messages off the protocol stream. """
+    with redirect_stdout(sys.stderr):
+        return AnalysisSession(parse_prefs(filename), parse_scheme_names(scheme_names), engine, option_filter)
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+class Service:
+    """ JSON-RPC 2.0 methods on an analysis session, one request or response per line.
+
+    Methods:
+        add:        {"ballot": [...]}, returns the new voter index and the searched and reused ballots
+        remove:     {"voter": i}
+        replace:    {"voter": i, "ballot": [...]}
+        result:     {"summary_only": false}, returns the TVA result
+        load:       {"input": "preferences.csv"}, replaces the profile
+
+    Attributes:
+        session:        Analysis session of the current profile
+        scheme_names:   Voting schemes of every loaded profile
+        engine:         Tally engine of every loaded profile
+        option_filter:  Option filter of every loaded profile
+    """
+
+    def __init__(self, session: AnalysisSession, scheme_names: List[str], engine: str, option_filter: OptionFilter):
+        self.session = session
+        self.scheme_names = scheme_names
+        self.engine = engine
+        self.option_filter = option_filter
+
+    def call(self, method: str, params: dict):
+        """ Run a method, invalid parameters raise a KeyError, TypeError or ValueError. """
+        return self.methods[method](self, params)
+
+    def add(self, params: dict):
+        return self.session.add(params["ballot"])
+
+    def remove(self, params: dict):
+        return self.session.remove(params["voter"])
+
+    def replace(self, params: dict):
+        return self.session.replace(params["voter"], params["ballot"])
+
+    def result(self, params: dict):
+        return self.session.result(params.get("summary_only", False))
+
+    def load(self, params: dict):
+        try:
+            self.session = load_session(params["input"], self.scheme_names, self.engine, self.option_filter)
+        except (SystemExit, OSError):
+            raise ValueError(f"Invalid preferences: {params['input']}")
+        return {"voters": len(self.session.preferences)}
+
+    methods: Dict[str, Callable[["Service", dict], Any]] = {
+        "add": add,
+        "remove": remove,
+        "replace": replace,
+        "result": result,
+        "load": load,
+    }
+    """ Handler of every JSON-RPC method. """
+
+    def handle(self, line: str) -> Optional[str]:
+        """ Answer a request line, notifications (requests without an id) get no response. """
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return get_error_response(None, PARSE_ERROR, "Parse error")
+        if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+            return get_error_response(None, INVALID_REQUEST, "Invalid request")
+        request_id = request.get("id")
+
+        params = request.get("params", {})
+        if request["method"] not in self.methods:
+            response = get_error_response(request_id, METHOD_NOT_FOUND, f"Method not found: {request['method']}")
+            return response if "id" in request else None
+        try:
+            if not isinstance(params, dict):
+                raise TypeError("Parameters must be an object.")
+            result = self.call(request["method"], params)
+        except KeyError as error:
+            response = get_error_response(request_id, INVALID_PARAMS, f"Missing parameter: {error.args[0]}")
+        except (TypeError, ValueError) as error:
+            response = get_error_response(request_id, INVALID_PARAMS, str(error))
+        except Exception as error:
+            # the session stays available for the next request
+            response = get_error_response(request_id, INTERNAL_ERROR, f"{error.__class__.__name__}: {error}")
+        else:
+            response = json.dumps({"jsonrpc": "2.0", "id": request_id, "result": result}, default=generic_serializer)
+        return response if "id" in request else None
+
+def get_error_response(request_id, code: int, message: str) -> str:
+    return json.dumps({"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}})
+
+async def answer(service: Service, lock: asyncio.Lock, line: str) -> Optional[str]:
+    """ Answer a request on a worker thread, one request at a time so updates never interleave. """
+    async with lock:
+        return await asyncio.get_running_loop().run_in_executor(None, service.handle, line)
+
+async def serve_stdio(service: Service):
+    """ Answer requests from stdin on stdout until stdin is closed. """
+    lock = asyncio.Lock()
+    loop = asyncio.get_running_loop()
+    while line := await loop.run_in_executor(None, sys.stdin.readline):
+        if not line.strip():
+            continue
+        response = await answer(service, lock, line)
+        if response is not None:
+            sys.stdout.write(response + "\n")
+            sys.stdout.flush()
+
+async def serve_socket(service: Service, socket_path: Optional[str], port: Optional[int]):
+    """ Answer requests of any number of clients on a Unix socket or a local TCP port. """
+    lock = asyncio.Lock()
+
+    async def serve_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        while line := await reader.readline():
+            if not line.strip():
+                continue
+            response = await answer(service, lock, line.decode())
+            if response is not None:
+                writer.write(response.encode() + b"\n")
+                await writer.drain()
+        writer.close()
+
+    if socket_path is not None:
+        server = await asyncio.start_unix_server(serve_client, socket_path)
+    else:
+        server = await asyncio.start_server(serve_client, '127.0.0.1', port)
+    print("Listening on", socket_path or f"127.0.0.1:{port}", file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+def parse_args():
+    """ Parse command line arguments. """
+
+    parser = argparse.ArgumentParser(description="Serve TVA results of a profile kept in memory over JSON-RPC, with incremental ballot updates.")
+    parser.add_argument('input', type=str, help='Input file with preferences.')
+    parser.add_argument('-s', '--schemes', nargs='+', type=str, help='Voting schemes.', default=['plurality', 'voting_for_two', 'borda', 'anti_plurality'])
+    parser.add_argument('-e', '--engine', type=str, help='One of python, numpy.', default='python')
+    parser.add_argument('--socket', type=str, help='Listen on this Unix socket instead of stdin and stdout.')
+    parser.add_argument('--port', type=int, help='Listen on this local TCP port instead of stdin and stdout.')
+    parser.add_argument('--risk-only', action='store_true', help='Stop every search at the first strategic option, enough for the strategic voting risk.')
+    parser.add_argument('--top-k', type=int, help='Only keep the K best strategic options of every voter.', default=0)
+    parser.add_argument('--top-key', type=str, help='Rank the best options by voter_happiness or overall_happiness.', default='voter_happiness')
+    args = parser.parse_args()
+
+    validate_engine(args.engine)
+    validate_option_filter(args.risk_only, args.top_k, args.top_key)
+    if args.socket is not None and args.port is not None:
+        print("Listen on a socket or a port, not both.")
+        sys.exit(1)
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    option_filter = OptionFilter(args.risk_only, args.top_k, args.top_key)
+    service = Service(load_session(args.input, args.schemes, args.engine, option_filter), args.schemes, args.engine, option_filter)
+    if args.socket is None and args.port is None:
+        asyncio.run(serve_stdio(service))
+    else:
+        asyncio.run(serve_socket(service, args.socket, args.port))
@@ -0,0 +1,43 @@
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+
+class SearchStats:
+    """ Counters and timers of the searches of one voting scheme.
+
+    Searches take an optional instance and skip all bookkeeping when they get None, so the
+    instrumentation costs nothing unless profiling is on.
+
+    Attributes:
+        counters:   Number of permutations enumerated, scheme evaluations, options produced etc.
+        seconds:    Summed wall time per phase
+    """
+
+    def __init__(self):
+        self.counters: Dict[str, int] = Counter()
+        self.seconds: Dict[str, float] = defaultdict(float)
+
+    def count(self, name: str, amount: int = 1):
+        """ Increase a counter. """
+        self.counters[name] += amount
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """ Add the wall time of the block to a timer. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+
+    def merge(self, other: 'SearchStats'):
+        """ Add the counters and timers of another instance, e.g. of a job run on a worker. """
+        self.counters.update(other.counters)
+        for name, seconds in other.seconds.items():
+            self.seconds[name] += seconds
+
+    def to_dict(self) -> dict:
+        """ Return the counters and timers in the shape of the JSON output. """
+        return {**dict(sorted(self.counters.items())), "seconds": {**self.seconds, "total": sum(self.seconds.values())}}
@@ -0,0 +1,191 @@
+from typing import Dict, List, Optional
+
+from ballots import VoterClasses
+from schemes import PAIRWISE_RULES, VOTE_COUNTING_SCHEMES, get_score_vector
+from tva_types import Scheme, SystemPreferences, VoterPreferences
+
+
+class BaseTally:
+    """ Outcomes of a voting scheme over a fixed set of preferences, derived by replacing ballots.
+
+    Every tally decides `replace_ballots`, the other outcome methods are built on it, and follows
+    changed ballots with `update_voter`. What else a tally offers is declared by its flags, which the
+    searches check instead of its type.
+
+    Attributes:
+        positional:         Whether the tally keeps the scores of a positional scoring rule
+                            (`score_vector`, `replace_scores`), which pruning and constructed ballots work on
+        pairwise:           Whether the tally keeps a pairwise majority matrix (`replace_matrix`, `get_ballot_rule`)
+        rank_happiness:     Whether the tally calculates happiness levels on its rank matrix (`happiness`)
+    """
+
+    positional = False
+    pairwise = False
+    rank_happiness = False
+
+    def replace_ballots(self, replacements: Dict[int, VoterPreferences], get_full_outcome: bool = False):
+        """ Return the outcome (and optionally the full outcome) if voters cast the replacement ballots. """
+        raise NotImplementedError
+
+    def update_voter(self, voter_index: int, old_ballot: Optional[VoterPreferences], new_ballot: Optional[VoterPreferences]):
+        """ Follow a voter changing their ballot in the preferences, a voter without an old ballot was added and one without a new ballot removed. """
+        raise NotImplementedError
+
+    def outcome(self, get_full_outcome: bool = False):
+        """ Return the outcome (and optionally the full outcome) of the unmodified preferences. """
+        return self.replace_ballots({}, get_full_outcome)
+
+    def replace_ballot(self, voter_index: int, ballot: VoterPreferences, get_full_outcome: bool = False):
+        """ Return the outcome (and optionally the full outcome) if one voter casts a different ballot. """
+        return self.replace_ballots({voter_index: ballot}, get_full_outcome)
+
+    def replace_ballot_batch(self, voter_index: int, ballots: List[VoterPreferences], get_full_outcome: bool = False) -> list:
+        """ Return the outcomes for a batch of alternative ballots of one voter. """
+        return [self.replace_ballot(voter_index, ballot, get_full_outcome) for ballot in ballots]
+
+class Tally(BaseTally):
+    """ Score tally of a positional voting scheme over a fixed set of preferences.
+
+    The profile is scored once. The outcome of replacing ballots is then derived by removing the
+    points of the original ballots and adding those of the replacements, instead of rescoring
+    every voter.
+
+    Attributes:
+        preferences:            Preferences the tally was built from
+        score_vector:           Points awarded for each position of a ballot
+        scores:                 Summed points of each candidate over all ballots
+        counts_votes_only:      Whether candidates without points are left out of the ranking and
+                                appended in the order of the first ballot (as `Counter` does)
+    """
+
+    positional = True
+
+    def __init__(self, preferences: SystemPreferences, score_vector: List[int], counts_votes_only: bool = False, voter_classes: Optional[VoterClasses] = None):
+        self.preferences = preferences
+        self.score_vector = score_vector
+        self.counts_votes_only = counts_votes_only
+        if voter_classes is None:
+            voter_classes = VoterClasses(preferences)
+
+        # identical ballots are scored once and weighted by the number of voters casting them
+        self.scores: Dict[str, int] = {candidate: 0 for candidate in preferences[0]}
+        for ballot, weight in zip(voter_classes.ballots, voter_classes.weights):
+            self.add_ballot(self.scores, ballot, weight)
+
+    def add_ballot(self, scores: Dict[str, int], ballot: VoterPreferences, weight: int = 1):
+        """ Add the points of a ballot cast by weight voters to the given scores (a negative weight removes them). """
+        add_points(scores, self.score_vector, ballot, weight)
+
+    def update_voter(self, voter_index: int, old_ballot: Optional[VoterPreferences], new_ballot: Optional[VoterPreferences]):
+        """ Move the points of a voter who changed their ballot, added voters have no old ballot and removed ones no new ballot. """
+        if old_ballot is not None:
+            self.add_ballot(self.scores, old_ballot, -1)
+        if new_ballot is not None:
+            self.add_ballot(self.scores, new_ballot)
+
+    def replace_scores(self, replacements: Dict[int, VoterPreferences], removed: List[int] = []) -> Dict[str, int]:
+        """ Return the scores if voters cast the replacement ballots and the removed voters cast none. """
+        scores = self.scores.copy()
+        for voter_index, ballot in replacements.items():
+            self.add_ballot(scores, self.preferences[voter_index], -1)
+            self.add_ballot(scores, ballot)
+        for voter_index in removed:
+            self.add_ballot(scores, self.preferences[voter_index], -1)
+        return scores
+
+    def replace_ballots(self, replacements: Dict[int, VoterPreferences], get_full_outcome: bool = False):
+        """ Return the outcome (and optionally the full outcome) if voters cast the replacement ballots. """
+        scores = self.replace_scores(replacements)
+        outcome = get_winner(scores)
+        if get_full_outcome:
+            first_ballot = replacements.get(0, self.preferences[0])
+            return outcome, get_ranking(scores, first_ballot, self.counts_votes_only)
+        return outcome
+
+    def replace_ballot_batch(self, voter_index: int, ballots: List[VoterPreferences], get_full_outcome: bool = False) -> list:
+        """ Return the outcomes for a batch of alternative ballots of one voter, whose own points are removed once. """
+        other_scores = self.replace_scores({}, [voter_index])
+        results = []
+        for ballot in ballots:
+            scores = other_scores.copy()
+            self.add_ballot(scores, ballot)
+            outcome = get_winner(scores)
+            if get_full_outcome:
+                first_ballot = ballot if voter_index == 0 else self.preferences[0]
+                results.append((outcome, get_ranking(scores, first_ballot, self.counts_votes_only)))
+            else:
+                results.append(outcome)
+        return results
+
+def add_points(scores: Dict[str, int], score_vector: List[int], ballot: VoterPreferences, weight: int = 1):
+    """ Add the points of a ballot cast by weight voters to the given scores. """
+    for points, candidate in zip(score_vector, ballot):
+        scores[candidate] += weight * points
+
+def get_winner(scores: Dict[str, int]) -> str:
+    """ Return the candidate with the highest score, ties are broken alphabetically. """
+    return min(scores, key=lambda candidate: (-scores[candidate], candidate))
+
+def get_reachable_winners(scores: Dict[str, int], score_vector: List[int], num_free_ballots: int) -> set:
+    """ Return the candidates that could still win once the free ballots are added to the scores.
+
+    The bound is optimistic: a candidate gets the most points from every free ballot, while each
+    rival gets the fewest. A candidate that cannot win even then is out of reach.
+    """
+    most_points = max(score_vector) * num_free_ballots
+    fewest_points = min(score_vector) * num_free_ballots
+
+    reachable = set()
+    for candidate in scores:
+        best_score = scores[candidate] + most_points
+        if all(scores[rival] + fewest_points < best_score or (scores[rival] + fewest_points == best_score and candidate < rival) for rival in scores if rival != candidate):
+            reachable.add(candidate)
+    return reachable
+
+def get_best_response(scores: Dict[str, int], score_vector: List[int], target: str, ballot: VoterPreferences) -> Optional[VoterPreferences]:
+    """ Construct a ballot that makes the target win, or return None if no ballot can.
+
+    The scores are those of all other voters. The target takes the first position, and every rival
+    can take at most the points that still leave it behind the target (ties are broken
+    alphabetically). The rivals with the most room take the positions with the most points. That
+    is an optimal matching, since the points never increase along a ballot, so the target can win
+    exactly if it respects every rival's room. Rivals with equal room keep the order of the ballot.
+    """
+    target_score = scores[target] + score_vector[0]
+    room = {rival: target_score - scores[rival] - (1 if rival < target else 0) for rival in ballot if rival != target}
+    rivals = sorted(room, key=lambda rival: -room[rival])
+    for points, rival in zip(score_vector[1:], rivals):
+        if points > room[rival]:
+            return None
+    return [target] + rivals
+
+def get_ranking(scores: Dict[str, int], first_ballot: VoterPreferences, counts_votes_only: bool) -> List[str]:
+    """ Return all candidates ordered the same way the scheme functions order their full outcome. """
+    ranked = [candidate for candidate in scores if scores[candidate] > 0 or not counts_votes_only]
+    ranked.sort(key=lambda candidate: (-scores[candidate], candidate))
+    if counts_votes_only:
+        ranked.extend(candidate for candidate in first_ballot if scores[candidate] == 0)
+    return ranked
+
+def is_positional(tally) -> bool:
+    """ Whether the tally keeps the scores of a positional scoring rule, which pruning and constructed ballots work on. """
+    return tally is not None and tally.positional
+
+ENGINES = ['python', 'numpy']
+""" Available tally engines, the numpy engine scores ballots on an integer rank matrix. """
+
+def get_tally(preferences: SystemPreferences, scheme: Scheme, engine: str = 'python', voter_classes: Optional[VoterClasses] = None) -> Optional[BaseTally]:
+    """ Build a tally for the scheme, or return None if the scheme is neither a positional scoring rule nor Condorcet-family.
+
+    Condorcet-family schemes are tallied on a pairwise majority matrix with either engine.
+    """
+    score_vector = get_score_vector(scheme, len(preferences[0]))
+    if score_vector is None:
+        if scheme in PAIRWISE_RULES:
+            from pairwise import PairwiseTally
+            return PairwiseTally(preferences, PAIRWISE_RULES[scheme], voter_classes)
+        return None
+    if engine == 'numpy':
+        from numpy_engine import RankMatrixTally
+        return RankMatrixTally(preferences, score_vector, scheme in VOTE_COUNTING_SCHEMES, voter_classes)
+    return Tally(preferences, score_vector, scheme in VOTE_COUNTING_SCHEMES, voter_classes)
@@ -0,0 +1,41 @@
+from itertools import permutations
+
+import pytest
+
+from ballots import OptionColumns, expand_ballot_class, get_ballot_classes, get_num_ballot_classes, get_permutation, get_permutation_index, get_permutation_key
+from schemes import get_ballot_blocks
+from tva_io import scheme_by_name
+from tva_types import VotingOption
+
+BALLOT = ['C', 'A', 'E', 'B', 'D']
+
+@pytest.mark.parametrize("scheme_name", ['plurality', 'voting_for_two', 'anti_plurality', 'borda', 'copeland'])
+def test_ballot_classes_cover_every_permutation_once(scheme_name):
+    block_sizes = get_ballot_blocks(scheme_by_name(scheme_name), len(BALLOT))
+    representatives = list(get_ballot_classes(BALLOT, block_sizes))
+    assert representatives[0] == BALLOT
+    assert len(representatives) == get_num_ballot_classes(block_sizes)
+
+    expanded = [tuple(ballot) for representative in representatives for ballot in expand_ballot_class(representative, block_sizes)]
+    assert sorted(expanded) == sorted(permutations(BALLOT))
+
+@pytest.mark.parametrize("block_sizes", [[1, 1, 1, 1, 1], [1, 4], [2, 3], [4, 1], [1, 3, 1], [5]])
+def test_ballot_classes_expand_in_permutation_order(block_sizes):
+    for representative in get_ballot_classes(BALLOT, block_sizes):
+        expanded = list(expand_ballot_class(representative, block_sizes))
+        assert expanded[0] == representative
+        assert expanded == sorted(expanded, key=lambda ballot: get_permutation_key(ballot, BALLOT))
+
+@pytest.mark.parametrize("num_candidates", [1, 2, 3, 4, 5])
+def test_permutation_index_round_trip(num_candidates):
+    original_ballot = BALLOT[:num_candidates]
+    for index, ballot in enumerate(permutations(original_ballot)):
+        assert get_permutation_index(list(ballot), original_ballot) == index
+        assert get_permutation(index, original_ballot) == list(ballot)
+
+def test_option_columns_restore_the_options():
+    ballots = [list(ballot) for ballot in permutations(BALLOT)][::7]
+    options = [VotingOption(ballot, ballot[0], 1 - i / len(ballots), 0.25, 2.5 + i, 3.0) for i, ballot in enumerate(ballots)]
+    columns = OptionColumns.from_options(options)
+    assert len(columns) == len(options)
+    assert [option.to_dict() for option in columns] == [option.to_dict() for option in options]
@@ -0,0 +1,53 @@
+from itertools import product
+
+import pytest
+
+from benchmark import GENERATORS, generate_profile
+from ballots import get_ballot_classes
+from collusion import PackedScores, get_member_classes, get_strategic_options_for_group_aggregated, get_strategic_options_for_group_rek, get_target_outcomes
+from schemes import get_ballot_blocks
+from tally import add_points, get_tally
+from tva_io import scheme_by_name
+from voting import OptionFilter, get_happiness_table
+
+@pytest.mark.parametrize("score_vector", [[1, 0, 0, 0], [1, 1, 0, 0], [1, 1, 1, 0], [3, 2, 1, 0]])
+@pytest.mark.parametrize("num_ballots", [1, 2, 3, 5])
+def test_packed_points_add_up_without_carrying(score_vector, num_ballots):
+    candidates = ['A', 'B', 'C', 'D']
+    packed_scores = PackedScores(candidates, score_vector, num_ballots)
+    scores = {'A': 7, 'B': 0, 'C': 2, 'D': 5}
+    ballots = list(get_ballot_classes(candidates, [1, 1, 1, 1]))
+    for members in product(ballots[::5], repeat=num_ballots):
+        expected = scores.copy()
+        for ballot in members:
+            add_points(expected, score_vector, ballot)
+        assert packed_scores.add_to(scores, sum(packed_scores.pack(ballot) for ballot in members)) == expected
+
+def test_packed_fields_hold_the_most_points_of_all_ballots():
+    packed_scores = PackedScores(['A', 'B', 'C'], [2, 1, 0], 4)
+    packed = 4 * packed_scores.pack(['A', 'B', 'C'])
+    assert packed_scores.add_to({'A': 0, 'B': 0, 'C': 0}, packed) == {'A': 8, 'B': 4, 'C': 0}
+
+def get_rows(keyed_options):
+    return sorted((key, [option.to_dict() for option in row]) for key, row in keyed_options)
+
+@pytest.mark.parametrize("generator", GENERATORS)
+@pytest.mark.parametrize("scheme_name", ['plurality', 'voting_for_two', 'anti_plurality', 'borda'])
+@pytest.mark.parametrize("risk_only", [False, True])
+def test_aggregated_search_finds_the_rows_of_the_plain_search(generator, scheme_name, risk_only):
+    scheme = scheme_by_name(scheme_name)
+    option_filter = OptionFilter(risk_only=risk_only)
+    for (num_voters, collusion_group), seed in product([(3, [0, 1]), (5, [1, 3]), (6, [1, 3, 4]), (9, [0, 2, 5])], range(3)):
+        prefs = generate_profile(generator, num_voters, 4, seed)
+        # members with the same ballot want the same outcomes, so most groups have strategic rows
+        for member in collusion_group:
+            prefs[member] = list(prefs[collusion_group[0]])
+        tally = get_tally(prefs, scheme)
+        happiness_table = get_happiness_table(prefs, tally)
+        true_happiness_levels = happiness_table.levels[tally.outcome()]
+        target_outcomes = get_target_outcomes(happiness_table, true_happiness_levels, collusion_group)
+        member_classes = get_member_classes(prefs, collusion_group, get_ballot_blocks(scheme, 4))
+
+        aggregated = get_strategic_options_for_group_aggregated(prefs, true_happiness_levels, scheme, collusion_group, tally, happiness_table, target_outcomes, tally.replace_scores({}, collusion_group), option_filter=option_filter)
+        plain = get_strategic_options_for_group_rek({}, prefs, true_happiness_levels, scheme, collusion_group, 0, tally, happiness_table, option_filter=option_filter, member_classes=member_classes, target_outcomes=target_outcomes)
+        assert get_rows(aggregated) == get_rows(plain)
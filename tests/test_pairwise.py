@@ -0,0 +1,38 @@
+from itertools import permutations
+
+import pytest
+
+from benchmark import GENERATORS, generate_profile
+from pairwise import PairwiseTally
+from schemes import PAIRWISE_RULES
+from tva_io import scheme_by_name
+
+def replace_voter(prefs, voter_index, ballot):
+    return prefs[:voter_index] + [list(ballot)] + prefs[voter_index + 1:]
+
+@pytest.mark.parametrize("generator", GENERATORS)
+@pytest.mark.parametrize("scheme_name", ['copeland', 'condorcet', 'schulze'])
+def test_ballot_batches_match_the_scheme(generator, scheme_name):
+    scheme = scheme_by_name(scheme_name)
+    for num_voters in [1, 2, 3, 4, 7]:
+        for num_candidates in [2, 3, 4]:
+            prefs = generate_profile(generator, num_voters, num_candidates)
+            tally = PairwiseTally(prefs, PAIRWISE_RULES[scheme])
+            ballots = [list(ballot) for ballot in permutations(prefs[0])]
+            for voter_index in range(num_voters):
+                outcomes = tally.replace_ballot_batch(voter_index, ballots)
+                full_outcomes = tally.replace_ballot_batch(voter_index, ballots, get_full_outcome=True)
+                for ballot, outcome, full_outcome in zip(ballots, outcomes, full_outcomes):
+                    expected = scheme(replace_voter(prefs, voter_index, ballot))
+                    assert (outcome, tuple(full_outcome)) == (expected[0], tuple(expected)), (prefs, voter_index, ballot)
+
+@pytest.mark.parametrize("scheme_name", ['copeland', 'condorcet', 'schulze'])
+def test_ballot_rule_leaves_the_matrix_unchanged(scheme_name):
+    prefs = generate_profile('impartial_culture', 5, 4)
+    tally = PairwiseTally(prefs, PAIRWISE_RULES[scheme_by_name(scheme_name)])
+    matrix = tally.replace_matrix({}, [0])
+    before = matrix.copy()
+    decide = tally.get_ballot_rule(matrix)
+    for ballot in permutations(prefs[0]):
+        assert decide(list(ballot)) == tally.replace_ballot(0, list(ballot))
+    assert matrix == before
@@ -0,0 +1,101 @@
+import json
+from itertools import permutations
+from random import Random
+
+import pytest
+
+from benchmark import GENERATORS, generate_profile
+from service import AnalysisSession, matrix_options_could_change, options_could_change
+from tally import get_tally
+from tva_io import generic_serializer, parse_scheme_names, scheme_by_name
+from voting import OptionFilter
+
+SCHEME_NAMES = ['plurality', 'voting_for_two', 'anti_plurality', 'borda', 'copeland', 'condorcet', 'schulze']
+
+PROFILE_SIZES = [(1, 2), (2, 3), (3, 4), (4, 4), (7, 3), (10, 3)]
+""" Profiles small enough to try every ballot of every voter, with enough voters for margins beyond one. """
+
+def replace_voter(prefs, voter_index, ballot):
+    return prefs[:voter_index] + [list(ballot)] + prefs[voter_index + 1:]
+
+def get_changes(prefs, ballots):
+    """ Yield every profile one voter changes the given one into, with the voter and their old and new ballot. """
+    for voter_index, old_ballot in enumerate(prefs):
+        for ballot in ballots:
+            yield replace_voter(prefs, voter_index, ballot), voter_index, old_ballot, ballot
+        if len(prefs) > 1:
+            yield prefs[:voter_index] + prefs[voter_index + 1:], voter_index, old_ballot, None
+    for ballot in ballots:
+        yield prefs + [ballot], len(prefs), None, ballot
+
+def could_change(tally, new_tally, ballot):
+    if tally.positional:
+        return options_could_change(tally.scores, new_tally.scores, tally.score_vector, ballot)
+    return matrix_options_could_change(tally.matrix, new_tally.matrix, tally.candidate_ids, tally.rule, ballot)
+
+@pytest.mark.parametrize("generator", GENERATORS)
+@pytest.mark.parametrize("scheme_name", SCHEME_NAMES)
+def test_kept_options_keep_their_outcomes(generator, scheme_name):
+    scheme = scheme_by_name(scheme_name)
+    for num_voters, num_candidates in PROFILE_SIZES:
+        for seed in range(2):
+            prefs = generate_profile(generator, num_voters, num_candidates, seed)
+            ballots = [list(ballot) for ballot in permutations(prefs[0])]
+            tally = get_tally(prefs, scheme)
+            for new_prefs, voter_index, old_ballot, new_ballot in get_changes(prefs, ballots):
+                new_tally = get_tally(prefs, scheme)
+                new_tally.update_voter(voter_index, old_ballot, new_ballot)
+                for ballot in [ballot for ballot in ballots if ballot in prefs and ballot in new_prefs]:
+                    if could_change(tally, new_tally, ballot):
+                        continue
+                    before, after = prefs.index(ballot), new_prefs.index(ballot)
+                    for option in ballots:
+                        assert scheme(replace_voter(prefs, before, option))[0] == scheme(replace_voter(new_prefs, after, option))[0], (prefs, new_prefs, ballot, option)
+
+@pytest.mark.parametrize("engine", ['python', 'numpy'])
+@pytest.mark.parametrize("scheme_name", SCHEME_NAMES)
+def test_updated_tally_matches_rebuilt_tally(engine, scheme_name):
+    scheme = scheme_by_name(scheme_name)
+    prefs = generate_profile('impartial_culture', 6, 4)
+    ballots = [list(ballot) for ballot in permutations(prefs[0])]
+    for new_prefs, voter_index, old_ballot, new_ballot in get_changes(prefs, ballots[:6]):
+        tally = get_tally(list(prefs), scheme, engine)
+        tally.preferences[:] = new_prefs
+        tally.update_voter(voter_index, old_ballot, new_ballot)
+        assert tally.outcome(True) == get_tally(new_prefs, scheme, engine).outcome(True)
+
+OPTION_FILTERS = {
+    'all': OptionFilter(),
+    'risk_only': OptionFilter(risk_only=True),
+    'top_voter': OptionFilter(top_k=3),
+    'top_overall': OptionFilter(top_k=3, top_key='overall_happiness'),
+    'best_response': OptionFilter(best_response=True),
+}
+
+def dump(result):
+    return json.dumps(result, default=generic_serializer)
+
+@pytest.mark.parametrize("engine", ['python', 'numpy'])
+@pytest.mark.parametrize("filter_name", OPTION_FILTERS)
+def test_updated_session_matches_new_session(engine, filter_name):
+    option_filter = OPTION_FILTERS[filter_name]
+    prefs = generate_profile('many_duplicates', 8, 4)
+    session = AnalysisSession(prefs, parse_scheme_names(SCHEME_NAMES), engine, option_filter)
+    rng = Random(0)
+    for _ in range(12):
+        ballot = rng.sample(prefs[0], len(prefs[0]))
+        operation = rng.random()
+        if operation < 0.25:
+            session.add(ballot)
+        elif operation < 0.4 and len(session.preferences) > 2:
+            session.remove(rng.randrange(len(session.preferences)))
+        else:
+            session.replace(rng.randrange(len(session.preferences)), ballot)
+        assert dump(session.result()) == dump(AnalysisSession(session.preferences, session.schemes, engine, option_filter).result())
+
+def test_same_ballot_is_not_searched_again():
+    prefs = generate_profile('impartial_culture', 50, 4)
+    session = AnalysisSession(prefs, parse_scheme_names(SCHEME_NAMES))
+    counts = session.replace(3, list(prefs[3]))
+    assert counts["searched"] == {scheme_name: 0 for scheme_name in SCHEME_NAMES}
+    assert counts["reused"] == {scheme_name: len(session.ballot_counts) for scheme_name in SCHEME_NAMES}
@@ -0,0 +1,18 @@
+from cache import ResultCache
+from tva_io import load_profile
+
+LINES = ["A,B,C,B,A\n", "B,C,A,B,C\n", "C,A,B,A,B\n"]
+
+def test_profile_decodes_the_valid_ballots():
+    profile = load_profile(LINES)
+    assert len(profile) == 4
+    assert list(profile) == [['A', 'B', 'C'], ['B', 'C', 'A'], ['C', 'A', 'B'], ['A', 'C', 'B']]
+    assert profile[-1] == profile[3] == ['A', 'C', 'B']
+    assert profile[1:3] == [['B', 'C', 'A'], ['C', 'A', 'B']]
+    assert profile[0][0] is profile[3][0]
+
+def test_profile_is_keyed_without_decoding(tmp_path):
+    cache = ResultCache(str(tmp_path), 1 << 20)
+    key = cache.get_key(load_profile(LINES), "borda", mode="basic")
+    assert key == cache.get_key(load_profile(LINES), "borda", mode="basic")
+    assert key != cache.get_key(load_profile(LINES[::-1]), "borda", mode="basic")
@@ -1,10 +1,17 @@
+import csv
+import importlib.util
 import json
+import mmap
+import os
 import sys
-from typing import List, Dict
-import pandas as pd
-
-from schemes import anti_plurality, borda, plurality, voting_for_two
-from tva_types import Scheme, SystemPreferences
+from collections import Counter
+from array import array
+from typing import Iterable, Iterator, List, Dict, Sequence, TextIO
+
+from ballots import OptionColumns, TopOptions, VoterOptions
+from schemes import anti_plurality, borda, condorcet, copeland, plurality, schulze, voting_for_two
+from tally import ENGINES
+from tva_types import Scheme, VoterPreferences, VotingOption
 import argparse
 
 def parse_groups(groups_str: str, voters: List[int]) -> List[List[int]]:
@@ -58,39 +65,137 @@ def parse_scheme_names(scheme_names: List[str]):
         schemes[scheme_name] = scheme
     return schemes
 
-def parse_prefs(filename: str) -> SystemPreferences:
-    """ Parses and validates preferences from a CSV file."""
-
-    input_df = pd.read_csv(filename, header=None)
-
-    input_df = input_df.transpose()
-    removed_voters = []
-
-    for i in range(input_df.shape[0]):
-        pref = input_df.iloc[i].dropna().tolist()
-        is_valid = True
-
-        # check for duplicate or missing candidates
-        if len(pref) != len(set(pref)):
-            removed_voters.append(i+1)
-            input_df.drop(i, inplace=True)
-            is_valid = False
+class Profile(Sequence):
+    """ Voter preferences with candidates interned as integer IDs.
+
+    The ballots stay packed as candidate IDs, two bytes per position. Accessing a voter decodes their
+    ballot into candidate names, all voters sharing the same name strings, so the searches take the
+    profile as it is instead of a copy as lists of names.
+
+    Attributes:
+        candidates:     Candidate names by ID
+        ballots:        Candidate IDs of all ballots, one ballot after another
+        num_voters:     Number of ballots
+    """
+
+    def __init__(self, candidates: List[str], ballots: array, num_voters: int):
+        self.candidates = candidates
+        self.ballots = ballots
+        self.num_voters = num_voters
+
+    def __len__(self) -> int:
+        return self.num_voters
+
+    def __getitem__(self, voter_index):
+        if isinstance(voter_index, slice):
+            return [self[i] for i in range(*voter_index.indices(self.num_voters))]
+        if voter_index < 0:
+            voter_index += self.num_voters
+        if not 0 <= voter_index < self.num_voters:
+            raise IndexError(voter_index)
+        return [self.candidates[candidate_id] for candidate_id in self.ballot(voter_index)]
+
+    def __iter__(self) -> Iterator[VoterPreferences]:
+        for voter_index in range(self.num_voters):
+            yield [self.candidates[candidate_id] for candidate_id in self.ballot(voter_index)]
+
+    def ballot(self, voter_index: int) -> List[int]:
+        """ Return the candidate IDs of a voter's ballot. """
+        num_candidates = len(self.candidates)
+        return self.ballots[voter_index * num_candidates:(voter_index + 1) * num_candidates].tolist()
+
+def read_lines(filename: str, use_mmap: bool = False) -> Iterator[str]:
+    """ Yield the lines of a file, optionally reading it through a memory map. """
+    if not use_mmap or os.path.getsize(filename) == 0:
+        with open(filename, newline='') as file:
+            yield from file
+        return
+
+    with open(filename, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for line in iter(mapped.readline, b''):
+            yield line.decode()
+
+def load_profile(lines: Iterable[str]) -> Profile:
+    """ Load and validate preferences with one column per voter and one row per position.
+
+    The rows are validated as they are read. Voters with empty, duplicate, invalid (not a single
+    letter) or missing candidates are discarded, and so are voters ranking other candidates than
+    most voters.
+    """
+    candidate_ids: Dict[str, int] = {}
+    candidates: List[str] = []
+    positions: List[array] = []
+    seen: List[int] = []
+    invalid: List[bool] = []
+
+    for row in csv.reader(lines):
+        if not row:
+            continue
+        if not positions:
+            seen = [0] * len(row)
+            invalid = [False] * len(row)
+        elif len(row) > len(seen):
+            print("Invalid preferences: row", len(positions) + 1, "has more voters than the first row.")
+            sys.exit(1)
 
-        # candidate names must be single characters
-        for candidate in pref:
-            if not candidate.isalpha() or len(candidate) > 1:
-                removed_voters.append(i+1)
-                input_df.drop(i, inplace=True)
-                is_valid = False
-                break
+        position = array('H', bytes(2 * len(seen)))
+        for voter_index, candidate in enumerate(row):
+            if invalid[voter_index]:
+                continue
+
+            # candidate names must be single letters
+            if len(candidate) != 1 or not candidate.isalpha():
+                invalid[voter_index] = True
+                continue
+
+            candidate_id = candidate_ids.get(candidate)
+            if candidate_id is None:
+                candidate_id = candidate_ids[candidate] = len(candidates)
+                candidates.append(sys.intern(candidate))
+
+            # check for duplicate candidates
+            if seen[voter_index] >> candidate_id & 1:
+                invalid[voter_index] = True
+                continue
+            seen[voter_index] |= 1 << candidate_id
+            position[voter_index] = candidate_id
+
+        # voters without a candidate in a row have one missing
+        for voter_index in range(len(row), len(seen)):
+            invalid[voter_index] = True
+        positions.append(position)
+
+    # every ballot must rank the same candidates, those ranked by most valid voters (the earliest set on a tie)
+    valid_voters = [voter_index for voter_index in range(len(seen)) if not invalid[voter_index]]
+    invalid_voters = [voter_index for voter_index in range(len(seen)) if invalid[voter_index]]
+    other_voters = []
+    if valid_voters:
+        candidate_set = Counter(seen[voter_index] for voter_index in valid_voters).most_common(1)[0][0]
+        other_voters = [voter_index for voter_index in valid_voters if seen[voter_index] != candidate_set]
+        valid_voters = [voter_index for voter_index in valid_voters if seen[voter_index] == candidate_set]
+
+    if invalid_voters:
+        print("Discarded invalid voters:", [voter_index + 1 for voter_index in invalid_voters])
+    if other_voters:
+        print("Discarded voters ranking other candidates than most voters:", [voter_index + 1 for voter_index in other_voters])
+
+    if not valid_voters:
+        print("No valid voters in the preferences.")
+        sys.exit(1)
 
-        if is_valid:
-            input_df.iloc[i] = pref
+    # candidate IDs are assigned in order of appearance, only those ranked by valid voters are kept
+    ballots = array('H', (position[voter_index] for voter_index in valid_voters for position in positions))
+    ranked = [candidate_id for candidate_id in range(len(candidates)) if candidate_set >> candidate_id & 1]
+    if len(ranked) < len(candidates):
+        new_ids = {candidate_id: new_id for new_id, candidate_id in enumerate(ranked)}
+        ballots = array('H', (new_ids[candidate_id] for candidate_id in ballots))
+        candidates = [candidates[candidate_id] for candidate_id in ranked]
 
-    if removed_voters:
-        print("Discarded invalid voters:", removed_voters)
+    return Profile(candidates, ballots, len(valid_voters))
 
-    return input_df.values.tolist()
+def parse_prefs(filename: str, use_mmap: bool = False) -> Profile:
+    """ Parses and validates preferences from a CSV file."""
+    return load_profile(read_lines(filename, use_mmap))
 
 def scheme_by_name(scheme_name: str) -> Scheme:
     """ Maps a string to a voting scheme. """
@@ -99,7 +204,10 @@ def scheme_by_name(scheme_name: str) -> Scheme:
         'plurality': plurality,
         'voting_for_two': voting_for_two,
         'anti_plurality': anti_plurality,
-        'borda': borda
+        'borda': borda,
+        'copeland': copeland,
+        'condorcet': condorcet,
+        'schulze': schulze
     }
     return schemes[scheme_name] if scheme_name in schemes else None
 
@@ -109,10 +217,71 @@ def validate_mode(mode: str):
         print("Invalid mode:", mode)
         sys.exit(1)
 
-def validate_runoff(runoff: int, num_candidates: int):
-    """ Validate the runoff argument. """
-    if runoff < 0 or runoff > num_candidates - 1:
-        print("Invalid number of runoff elections:", runoff)
+def validate_engine(engine: str):
+    """ Validate the engine argument. """
+    if engine not in ENGINES:
+        print("Invalid engine:", engine)
+        sys.exit(1)
+
+    if engine == 'numpy' and importlib.util.find_spec('numpy') is None:
+        print("The numpy engine requires numpy to be installed.")
+        sys.exit(1)
+
+def validate_workers(workers: int):
+    """ Validate the workers argument. """
+    if workers < 1:
+        print("Invalid number of workers:", workers)
+        sys.exit(1)
+
+def validate_format(output_format: str):
+    """ Validate the format argument. """
+    if output_format not in OUTPUT_FORMATS:
+        print("Invalid output format:", output_format)
+        sys.exit(1)
+
+def validate_cache_size(cache_size: int):
+    """ Validate the cache size argument. """
+    if cache_size < 0:
+        print("Invalid cache size:", cache_size)
+        sys.exit(1)
+
+def validate_option_filter(risk_only: bool, top_k: int, top_key: str, best_response: bool = False, mode: str = 'basic'):
+    """ Validate the risk-only, top-k and best-response arguments. """
+    if top_k < 0:
+        print("Invalid number of top options:", top_k)
+        sys.exit(1)
+
+    if top_key not in ['voter_happiness', 'overall_happiness']:
+        print("Invalid top key:", top_key)
+        sys.exit(1)
+
+    if risk_only and top_k > 0:
+        print("Risk-only and top-k cannot be combined.")
+        sys.exit(1)
+
+    if best_response and mode != 'basic':
+        print("Best responses are only constructed in basic mode.")
+        sys.exit(1)
+
+def validate_budget(evaluations: int, seconds: float, best_response: bool, mode: str):
+    """ Validate the budget arguments of the approximate search. """
+    if evaluations < 0 or seconds < 0:
+        print("Invalid search budget:", evaluations, "evaluations,", seconds, "seconds")
+        sys.exit(1)
+
+    if (evaluations > 0 or seconds > 0) and (best_response or mode == 'runoff'):
+        print("The approximate search does not run in runoff mode or with best responses.")
+        sys.exit(1)
+
+def validate_runoff(rounds: List[int], num_candidates: int):
+    """ Validate the runoff argument, later rounds must advance fewer (and at least two) candidates. """
+    for runoff in rounds:
+        if runoff < 0 or runoff > num_candidates - 1:
+            print("Invalid number of runoff elections:", runoff)
+            sys.exit(1)
+
+    if len(rounds) > 1 and (min(rounds) < 2 or any(later >= earlier for earlier, later in zip(rounds, rounds[1:]))):
+        print("Invalid runoff rounds:", rounds, "Each round must advance fewer candidates than the one before, and at least two.")
         sys.exit(1)
 
 def parse_args():
@@ -127,7 +296,7 @@ def parse_args():
     parser.add_argument('mode', type=str, help='One of basic, runoff, collusion', default='basic')
 
     # Schemes
-    parser.add_argument('-s', '--schemes', nargs='+', type=str, help='List of voting schemes. Available schemes: plurality, voting-for-two, borda, anti-plurality.', default=['plurality', 'voting_for_two', 'borda', 'anti_plurality'])
+    parser.add_argument('-s', '--schemes', nargs='+', type=str, help='List of voting schemes. Available schemes: plurality, voting-for-two, borda, anti-plurality, copeland, condorcet, schulze.', default=['plurality', 'voting_for_two', 'borda', 'anti_plurality'])
     
     # String encoded group list
     parser.add_argument('-g', '--groups', type=str, help='Nested list of collusion groups.', default='[]')
@@ -136,19 +305,60 @@ def parse_args():
     parser.add_argument('-o', '--output', type=str, help='Output file name.')
 
     # Number of runoff elections
-    parser.add_argument('-r', '--runoff', type=int, help='Number of runoff elections.', default=0)
+    parser.add_argument('-r', '--runoff', nargs='+', type=int, help='Number of runoff elections, or the number of candidates advancing from each round for more than two rounds.', default=[0])
 
     # Runoff-Output file name
     parser.add_argument('-ro', '--runoff_output', type=str, help='Runoff-Output file name.')
 
+    # Tally engine
+    parser.add_argument('-e', '--engine', type=str, help='One of python, numpy (rank-matrix engine for large profiles).', default='python')
+
+    # Number of worker processes
+    parser.add_argument('-w', '--workers', type=int, help='Number of worker processes to spread voters and groups over.', default=1)
+
+    # Memory-mapped input
+    parser.add_argument('--mmap', action='store_true', help='Read the input file through a memory map.')
+
+    # Result cache
+    parser.add_argument('--cache-dir', type=str, help='Directory of the result cache.', default='.tva_cache')
+    parser.add_argument('--cache-size', type=int, help='Size cap of the result cache in MB.', default=256)
+    parser.add_argument('--no-cache', action='store_true', help='Neither read nor write cached results.')
+    parser.add_argument('--clear-cache', action='store_true', help='Remove all cached results before running.')
+
+    # Option filters
+    parser.add_argument('--risk-only', action='store_true', help='Stop every search at the first strategic option, enough for the strategic voting risk.')
+    parser.add_argument('--top-k', type=int, help='Only keep the K best strategic options of every voter or group.', default=0)
+    parser.add_argument('--top-key', type=str, help='Rank the best options by voter_happiness (summed over a group) or overall_happiness.', default='voter_happiness')
+    parser.add_argument('--best-response', action='store_true', help='Construct one ballot per outcome a voter can bring about instead of enumerating all ballots (positional schemes).')
+
+    # Approximate search
+    parser.add_argument('--budget-evaluations', type=int, help='Search a sample of the ballots (of the combinations of ballots for groups) with at most this many evaluations per scheme, not in runoff mode.', default=0)
+    parser.add_argument('--budget-seconds', type=float, help='Search a sample of the ballots (of the combinations of ballots for groups) for at most this many seconds per scheme, not in runoff mode.', default=0.0)
+    parser.add_argument('--seed', type=int, help='Seed of the approximate search.', default=0)
+
+    # Search statistics
+    parser.add_argument('--profile', action='store_true', help='Add search statistics (counters and timings) to every scheme result.')
+
+    # Output format
+    parser.add_argument('-f', '--format', type=str, help='One of json, ndjson (one compact record per scheme and voter).', default='json')
+
+    # Summary only
+    parser.add_argument('--summary-only', action='store_true', help='Only write outcomes, happiness levels, option counts per voter and the strategic voting risk.')
+
     args = parser.parse_args()
 
     # Read preferences from input file
-    system_preferences = parse_prefs(args.input)
+    system_preferences = parse_prefs(args.input, args.mmap)
 
     # Validation
     validate_mode(args.mode)
     print("Mode:", args.mode)
+    validate_engine(args.engine)
+    validate_workers(args.workers)
+    validate_format(args.format)
+    validate_cache_size(args.cache_size)
+    validate_option_filter(args.risk_only, args.top_k, args.top_key, args.best_response, args.mode)
+    validate_budget(args.budget_evaluations, args.budget_seconds, args.best_response, args.mode)
 
     # Set voting schemes
     schemes: List[Scheme] = parse_scheme_names(args.schemes)
@@ -157,7 +367,7 @@ def parse_args():
     # Validate runoff
     if args.mode == 'runoff':
         validate_runoff(args.runoff, len(system_preferences[0]))
-        print ("Number of runoff elections:", args.runoff)
+        print ("Number of runoff elections:", *args.runoff)
 
     # Custom parsing for the nested list
     groups: List[List[int]] = []
@@ -165,7 +375,7 @@ def parse_args():
         groups = parse_groups(args.groups, list(range(len(system_preferences)))) if args.groups else []
         print("Collusion groups:", groups)
     
-    return args.mode, system_preferences, schemes, groups, args.output, args.runoff, args.runoff_output
+    return system_preferences, schemes, groups, args
 
 def tva_result_to_json(basic_tva_result) -> str:
     """ Convert TVA result to a JSON string. """
@@ -173,7 +383,12 @@ def tva_result_to_json(basic_tva_result) -> str:
 
 def generic_serializer(obj):
     """A generic JSON serializer for objects not serializable by default json code"""
-    if hasattr(obj, "__dict__"):
+    if isinstance(obj, (VoterOptions, TopOptions, OptionColumns)):
+        # Expand the options of one voter at a time while streaming
+        return list(obj)
+    elif isinstance(obj, VotingOption):
+        return obj.to_dict()
+    elif hasattr(obj, "__dict__"):
         # Serialize objects by turning their __dict__ property into a dict.
         # This works for most custom classes.
         return obj.__dict__
@@ -183,11 +398,79 @@ def generic_serializer(obj):
     # Add more checks here for other types if necessary.
     raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
 
-def write_to_output(basic_tva_result, output_file=None):
+OUTPUT_FORMATS = ['json', 'ndjson']
+""" Available output formats, ndjson writes one compact record per scheme and strategic voter. """
+
+def get_scheme_summary(scheme_result: dict) -> dict:
+    """ Scheme result with the strategic options of each voter replaced by their number. """
+    summary = {
+        "non_strategic_outcome": scheme_result["non_strategic_outcome"],
+        "non_strategic_happiness_levels": scheme_result["non_strategic_happiness_levels"],
+        "non_strategic_overall_happiness": scheme_result["non_strategic_overall_happiness"],
+        "strategic_option_counts": [len(voting_options) for voting_options in scheme_result["voters"]],
+        "strategic_voting_risk": scheme_result["strategic_voting_risk"]
+    }
+    if "approximate_search" in scheme_result:
+        summary["approximate_search"] = scheme_result["approximate_search"]
+    if "stats" in scheme_result:
+        summary["stats"] = scheme_result["stats"]
+    return summary
+
+def iter_json(tva_result: dict, summary_only: bool = False) -> Iterator[str]:
+    """ Yield the result as indented JSON in chunks, the options are expanded voter by voter. """
+    if summary_only:
+        tva_result = {scheme_name: get_scheme_summary(scheme_result) for scheme_name, scheme_result in tva_result.items()}
+    encoder = json.JSONEncoder(indent=4, default=generic_serializer)
+    return encoder.iterencode(tva_result)
+
+def iter_ndjson(tva_result: dict, summary_only: bool = False) -> Iterator[str]:
+    """ Yield the result as lines of compact JSON.
+
+    Every scheme gets a line with its outcome and risk, followed by a line per voter with strategic
+    options. The true happiness of a voter is written once and each option as a list of the ballot,
+    outcome, voter happiness and overall happiness.
+    """
+    encoder = json.JSONEncoder(separators=(',', ':'))
+    for scheme_name, scheme_result in tva_result.items():
+        summary = get_scheme_summary(scheme_result)
+        if not summary_only:
+            del summary["strategic_option_counts"]
+        yield encoder.encode({"scheme": scheme_name, **summary}) + "\n"
+        if summary_only:
+            continue
+
+        for voter_index, voting_options in enumerate(scheme_result["voters"]):
+            voting_options = list(voting_options)
+            if not voting_options:
+                continue
+            yield encoder.encode({
+                "scheme": scheme_name,
+                "voter": voter_index,
+                "true_voter_happiness": voting_options[0].true_voter_happiness,
+                "true_overall_happiness": voting_options[0].true_overall_happiness,
+                "options": [[option.modified_preference_list, option.voting_outcome, option.voter_happiness, option.overall_happiness] for option in voting_options]
+            }) + "\n"
+
+def get_round_output_file(output_file, round_index: int, num_rounds: int):
+    """ Output file of a runoff round, numbered if there are several rounds to write. """
+    if output_file is None or num_rounds == 1:
+        return output_file
+    root, extension = os.path.splitext(output_file)
+    return f"{root}_round{round_index + 1}{extension}"
+
+def write_result(file: TextIO, tva_result: dict, output_format: str = 'json', summary_only: bool = False):
+    """ Stream the result to an open file in the given format. """
+    chunks = iter_ndjson(tva_result, summary_only) if output_format == 'ndjson' else iter_json(tva_result, summary_only)
+    for chunk in chunks:
+        file.write(chunk)
+
+def write_to_output(tva_result, output_file=None, output_format='json', summary_only=False):
     """ Write to output file or print to console if no output file is specified. """
     if output_file:
         with open(output_file, "w") as file:
-            file.write(tva_result_to_json(basic_tva_result))
+            write_result(file, tva_result, output_format, summary_only)
             print("Results written to", output_file)
     else:
-        print(tva_result_to_json(basic_tva_result))
\ No newline at end of file
+        write_result(sys.stdout, tva_result, output_format, summary_only)
+        if output_format == 'json':
+            print()
@@ -7,7 +7,7 @@ SystemPreferences = List[VoterPreferences]
 """ All voter preferences. """
 
 Scheme = Callable[[SystemPreferences], str]
-""" Function that takes all voter preferences and returns the winner of the vote. """
+""" Function that takes all voter preferences (and optionally the number of voters behind each) and returns the winner of the vote. """
 
 class VotingOption:
     """ A voting option for a voter.
@@ -21,6 +21,8 @@ class VotingOption:
         true_overall_happiness:         Summed happiness of all voters with the original voting outcome
     """
 
+    __slots__ = ("modified_preference_list", "voting_outcome", "voter_happiness", "true_voter_happiness", "overall_happiness", "true_overall_happiness")
+
     def __init__(self, preference_list: VoterPreferences, voting_outcome: str, voter_happiness: float, true_voter_happiness: float, overall_happiness: float, true_overall_happiness: float):
         self.modified_preference_list: VoterPreferences = preference_list  # 𝑣̃𝑖𝑗
         self.voting_outcome: str = voting_outcome  # 𝑂̃
@@ -29,6 +31,10 @@ class VotingOption:
         self.overall_happiness: float = overall_happiness  # 𝐻̃
         self.true_overall_happiness: float = true_overall_happiness  # 𝐻
 
+    def to_dict(self) -> dict:
+        """ Return the attributes as a dict, in the shape of the JSON output. """
+        return {attribute: getattr(self, attribute) for attribute in self.__slots__}
+
 class VoteProps:
     """ Properties of a vote.
     
@@ -1,7 +1,23 @@
-from random import randrange
-from itertools import permutations
-from typing import Dict, List
-from tva_types import SystemPreferences, Scheme, VotingOption
+import time
+from math import factorial, prod
+from random import Random
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+from ballots import TopOptions, VoterClasses, VoterOptions, batched, get_ballot_classes, get_class_representative, get_num_ballot_classes
+from cache import ResultCache
+from parallel import run_jobs
+from schemes import VOTE_COUNTING_SCHEMES, get_ballot_blocks
+from stats import SearchStats
+from tally import BaseTally, Tally, get_best_response, get_tally, is_positional
+from tva_types import SystemPreferences, Scheme, VoterPreferences
+
+BATCH_SIZE = 1024
+""" Number of alternative ballots of a voter that are scored together. """
+
+NEIGHBOURHOOD_SIZE = 32
+""" Number of random swap and insert moves the approximate search proposes per step. """
+
+RESTART_AFTER = 8
+""" Number of steps without improvement after which the approximate search restarts elsewhere. """
 
 def happiness(original_prefs: SystemPreferences, outcome: str) -> List[float]:
     """ Calculate the happiness levels for each voter based on the outcome. """
@@ -12,7 +28,7 @@ def happiness(original_prefs: SystemPreferences, outcome: str) -> List[float]:
         happiness_levels.append(happiness_level)
     return happiness_levels
 
-def alternate_happiness(preferences, outcome, variant, acceptance=1, happiness_ranks=[1, 0.9, 0.7, 0.4, 0.15, 0.05]):
+def alternate_happiness(preferences, outcome, variant, acceptance=1, happiness_ranks=[1, 0.9, 0.7, 0.4, 0.15, 0.05], seed=0):
     #Temporary method as a storage for different happiness functions
     happiness_levels = []
     if variant == 0: #Squared positional happiness
@@ -47,9 +63,10 @@ def alternate_happiness(preferences, outcome, variant, acceptance=1, happiness_r
             else:
                 happiness_level = 0
             happiness_levels.append(happiness_level)
-    elif variant == 5: #random varient from the previouse 5
+    elif variant == 5: #random varient from the previouse 5, seeded so each voter keeps theirs for every outcome
+        voter_variants = Random(seed)
         for pref in preferences:
-            happiness_level = alternate_happiness([pref], outcome, randrange(5), acceptance, happiness_ranks)[0]
+            happiness_level = alternate_happiness([pref], outcome, voter_variants.randrange(5), acceptance, happiness_ranks)[0]
             happiness_levels.append(happiness_level)
     return happiness_levels
 
@@ -63,33 +80,178 @@ def get_vote_result(modified_prefs: SystemPreferences, original_prefs: SystemPre
         return outcome, happiness_levels, full_outcome
     return outcome, happiness_levels
 
-def get_strategic_options_for_voter(original_system_prefs: SystemPreferences, voter_index: int, scheme: Scheme, full_outcome: list[str] = [], runoff: int = 0) -> List[VotingOption]:
-    """ Find strategic voting options for a given voter and voting scheme. """
+def get_happiness_levels(original_system_prefs: SystemPreferences, outcome: str, tally: Optional[BaseTally] = None) -> List[float]:
+    """ Calculate the happiness levels, on the rank matrix if the tally keeps one. """
+    if tally is not None and tally.rank_happiness:
+        return tally.happiness(outcome)
+    return happiness(original_system_prefs, outcome)
 
-    voter_original_prefs = original_system_prefs[voter_index]
-    voter_pref_permutations = list(permutations(voter_original_prefs))
-    strategic_voting_options: List[VotingOption] = []
-    suboptimal_strategic_voting_options: List[VotingOption] = []
+class HappinessTable:
+    """ Happiness of all voters for every candidate that could win.
+
+    The original preferences never change during a search, so happiness only depends on the outcome
+    and is computed once per candidate instead of once per evaluated ballot.
+
+    Attributes:
+        levels:     Happiness levels of all voters per outcome
+        overall:    Summed happiness of all voters per outcome
+    """
+
+    def __init__(self, candidates: List[str], get_levels: Callable[[str], List[float]]):
+        self.levels: Dict[str, List[float]] = {candidate: get_levels(candidate) for candidate in candidates}
+        self.overall: Dict[str, float] = {candidate: sum(levels) for candidate, levels in self.levels.items()}
+
+def get_happiness_table(original_system_prefs: SystemPreferences, tally: Optional[BaseTally] = None, voter_classes: Optional[VoterClasses] = None) -> HappinessTable:
+    """ Tabulate the (linear) happiness levels for every outcome, once per distinct ballot if voter classes are given. """
+    if voter_classes is None or (tally is not None and tally.rank_happiness):
+        return HappinessTable(original_system_prefs[0], lambda outcome: get_happiness_levels(original_system_prefs, outcome, tally))
+    return HappinessTable(original_system_prefs[0], lambda outcome: voter_classes.expand(happiness(voter_classes.ballots, outcome)))
+
+def get_alternate_happiness_table(original_system_prefs: SystemPreferences, variant: int, acceptance: int = 1, seed: int = 0) -> HappinessTable:
+    """ Tabulate the happiness levels of an alternate happiness variant for every outcome. """
+    return HappinessTable(original_system_prefs[0], lambda outcome: alternate_happiness(original_system_prefs, outcome, variant, acceptance, seed=seed))
+
+def get_tallied_outcome(original_system_prefs: SystemPreferences, scheme: Scheme, tally: Optional[BaseTally], get_full_outcome: bool = False, voter_classes: Optional[VoterClasses] = None):
+    """ Calculate the outcome (and optionally the full outcome) of the unmodified preferences, reusing the tally if there is one. """
+
+    if tally is None:
+        if voter_classes is None:
+            outcome, full_outcome = scheme(original_system_prefs)
+        else:
+            outcome, full_outcome = scheme(voter_classes.ballots, voter_classes.weights)
+        return (outcome, full_outcome) if get_full_outcome else outcome
+    return tally.outcome(get_full_outcome)
 
-    # Iterate through all permutations of the voter's preferences
-    for i, permutation in enumerate(voter_pref_permutations):
-        voter_prefs = list(permutation)
+def get_modified_outcomes(original_system_prefs: SystemPreferences, voter_index: int, ballots: List[List[str]], scheme: Scheme, tally: Optional[BaseTally], get_full_outcome: bool = False) -> list:
+    """ Calculate the outcome (and optionally the full outcome) for each ballot a single voter could cast instead. """
 
-        # Update the system preferences (modified copy)
+    if tally is not None:
+        return tally.replace_ballot_batch(voter_index, ballots, get_full_outcome)
+
+    outcomes = []
+    for voter_prefs in ballots:
         modified_system_prefs = [original_voter_prefs if voter_index != i else voter_prefs for i, original_voter_prefs in enumerate(original_system_prefs)]
+        outcome, full_outcome = scheme(modified_system_prefs)
+        outcomes.append((outcome, full_outcome) if get_full_outcome else outcome)
+    return outcomes
+
+def iter_modified_outcomes(original_system_prefs: SystemPreferences, voter_index: int, ballots: Iterable[List[str]], scheme: Scheme, tally: Optional[BaseTally], get_full_outcome: bool = False) -> Iterator[tuple]:
+    """ Yield each ballot together with its outcome, evaluating the ballots in batches. """
+    for batch in batched(ballots, BATCH_SIZE):
+        yield from zip(batch, get_modified_outcomes(original_system_prefs, voter_index, batch, scheme, tally, get_full_outcome))
+
+class SearchBudget:
+    """ Limits of an approximate search, which samples a voter's (or group's) ballots instead of enumerating them.
+
+    Attributes:
+        evaluations:    Number of ballot classes evaluated (0 for no limit)
+        seconds:        Wall time (0 for no limit)
+        seed:           Seed of the random moves, every voter and group draws from a generator of their own
+    """
+
+    def __init__(self, evaluations: int = 0, seconds: float = 0.0, seed: int = 0):
+        self.evaluations = evaluations
+        self.seconds = seconds
+        self.seed = seed
+
+    def share(self, num_searches: int) -> 'SearchBudget':
+        """ Return the budget of each of this many searches splitting this budget equally. """
+        evaluations = max(1, self.evaluations // num_searches) if self.evaluations > 0 else 0
+        return SearchBudget(evaluations, self.seconds / max(1, num_searches), self.seed)
+
+    def fits(self, num_classes: int) -> bool:
+        """ Whether enumerating this many ballot classes stays within the evaluations, or a batch without a limit. """
+        return num_classes <= (self.evaluations or BATCH_SIZE)
+
+    def to_dict(self) -> dict:
+        return {"evaluations": self.evaluations, "seconds": self.seconds, "seed": self.seed}
+
+class OptionFilter:
+    """ Which strategic options a search keeps.
+
+    Attributes:
+        risk_only:      Stop at the first strategic ballot, which is all the risk needs
+        top_k:          Keep only this many options with the highest happiness (0 keeps all)
+        top_key:        Happiness the best options are ranked by, voter_happiness or overall_happiness
+        best_response:  Construct one ballot per outcome a voter can bring about instead of
+                        enumerating all ballots (positional schemes outside of runoffs)
+        budget:         Search a sample of the ballots (or of the combinations of a group's
+                        ballots) within this budget instead of all of them, outside of runoffs.
+                        The options found are a subset of all options
+    """
+
+    def __init__(self, risk_only: bool = False, top_k: int = 0, top_key: str = "voter_happiness", best_response: bool = False, budget: Optional[SearchBudget] = None):
+        self.risk_only = risk_only
+        self.top_k = top_k
+        self.top_key = top_key
+        self.best_response = best_response
+        self.budget = budget
 
-        # Calculate results for the current permutation
+    def share_budget(self, num_searches: int) -> 'OptionFilter':
+        """ Return the filter for each of this many searches splitting the budget equally. """
+        if self.budget is None:
+            return self
+        return OptionFilter(self.risk_only, self.top_k, self.top_key, self.best_response, self.budget.share(num_searches))
+
+    def new_options(self, original_ballot: List[str], block_sizes: List[int], true_voter_happiness: float, true_overall_happiness: float):
+        """ Return an empty container for the options of a voter that keeps what the filter asks for. """
+        if self.top_k > 0:
+            return TopOptions(original_ballot, block_sizes, true_voter_happiness, true_overall_happiness, self.top_k, self.top_key)
+        if self.risk_only:
+            # the single strategic ballot is kept on its own, not with its whole class
+            return VoterOptions(original_ballot, [1] * len(original_ballot), true_voter_happiness, true_overall_happiness)
+        return VoterOptions(original_ballot, block_sizes, true_voter_happiness, true_overall_happiness)
+
+    def get_cache_params(self) -> dict:
+        """ Parameters the options depend on, for the result cache key. """
+        return {"risk_only": self.risk_only, "top_k": self.top_k, "top_key": self.top_key if self.top_k > 0 else None, "best_response": self.best_response, "budget": self.budget.to_dict() if self.budget is not None else None}
+
+def get_strategic_options_for_voter(original_system_prefs: SystemPreferences, voter_index: int, scheme: Scheme, full_outcome: list[str] = [], runoff: int = 0, tally: Optional[BaseTally] = None, happiness_table: Optional[HappinessTable] = None, runoff_happiness_table: Optional[HappinessTable] = None, stats: Optional[SearchStats] = None, option_filter: Optional[OptionFilter] = None) -> VoterOptions:
+    """ Find strategic voting options for a given voter and voting scheme.
+
+    A tally and happiness tables of the unmodified preferences can be passed in to avoid recomputing
+    them for every voter. Search statistics are counted if stats are passed in. An option filter can
+    stop the search at the first strategic ballot or only keep the best options.
+    """
+
+    if option_filter is None:
+        option_filter = OptionFilter()
+
+    if tally is None:
+        tally = get_tally(original_system_prefs, scheme)
+    if happiness_table is None:
+        happiness_table = get_happiness_table(original_system_prefs, tally)
+    if option_filter.best_response and is_positional(tally) and runoff == 0:
+        return get_best_responses(original_system_prefs, voter_index, tally, happiness_table, option_filter, stats)
+    if runoff > 0 and runoff_happiness_table is None:
+        runoff_happiness_table = get_alternate_happiness_table(original_system_prefs, 1, runoff)
+
+    voter_original_prefs = original_system_prefs[voter_index]
+    block_sizes = get_ballot_blocks(scheme, len(voter_original_prefs))
+    if option_filter.budget is not None and runoff == 0 and not option_filter.budget.fits(get_num_ballot_classes(block_sizes)):
+        return get_approximate_options_for_voter(original_system_prefs, voter_index, scheme, block_sizes, tally, happiness_table, option_filter, stats)
+    if runoff > 0 and voter_index == 0 and scheme in VOTE_COUNTING_SCHEMES:
+        # the full outcome lists candidates without votes in the order of the first ballot
+        block_sizes = [1] * len(voter_original_prefs)
+
+    # Iterate through one ballot per class of permutations the scheme cannot tell apart
+    ballot_classes = get_ballot_classes(voter_original_prefs, block_sizes)
+    for i, (voter_prefs, result) in enumerate(iter_modified_outcomes(original_system_prefs, voter_index, ballot_classes, scheme, tally, runoff > 0)):
+
+        # Results for the current permutation, only the voter's own ballot is replaced
         if runoff > 0:
-            outcome, happiness_levels, new_full_outcome = get_vote_result(modified_system_prefs, original_system_prefs, scheme, True)
-            voter_happiness = alternate_happiness(original_system_prefs, outcome, 1, runoff)
+            outcome, new_full_outcome = result
+            voter_happiness = runoff_happiness_table.levels[outcome]
         else:
-            outcome, happiness_levels = get_vote_result(modified_system_prefs, original_system_prefs, scheme)
-            voter_happiness = happiness_levels[voter_index]
-        overall_happiness: float = sum(happiness_levels)
+            outcome = result
+            voter_happiness = happiness_table.levels[outcome][voter_index]
+        overall_happiness: float = happiness_table.overall[outcome]
 
         if i == 0: # Remebmer the first (original) permutation's results
             true_voter_happiness = voter_happiness
             true_overall_happiness = overall_happiness
+            strategic_voting_options = option_filter.new_options(voter_original_prefs, block_sizes, true_voter_happiness, true_overall_happiness)
+            suboptimal_strategic_voting_options = option_filter.new_options(voter_original_prefs, block_sizes, true_voter_happiness, true_overall_happiness)
 
         # print(f"Permutation {i+1}: Outcome: {outcome}, Happiness levels: {happiness_levels}")
 
@@ -99,55 +261,351 @@ def get_strategic_options_for_voter(original_system_prefs: SystemPreferences, vo
         if not is_strategic :
             continue
 
-        voting_option = VotingOption(voter_prefs, outcome, voter_happiness, true_voter_happiness, overall_happiness, true_overall_happiness)
+        # Every permutation in the class is an equally strategic ballot
+        voting_option = (voter_prefs, outcome, voter_happiness, overall_happiness)
         if runoff > 0:
-            suboptimal_strategic_voting_options.append(voting_option)
+            suboptimal_strategic_voting_options.add(*voting_option)
             if new_full_outcome[1] not in full_outcome[:2]:
-                strategic_voting_options.append(voting_option)
+                strategic_voting_options.add(*voting_option)
         else:
-            strategic_voting_options.append(voting_option)
+            strategic_voting_options.add(*voting_option)
+
+        if option_filter.risk_only:
+            break
 
     # If no strategic options were found, return the suboptimal options
     if not strategic_voting_options:
-        strategic_voting_options = suboptimal_strategic_voting_options.copy()
+        strategic_voting_options = suboptimal_strategic_voting_options
+
+    if stats is not None:
+        # every class is decided by one evaluation and stands for all of its permutations
+        stats.count("search_space_classes", get_num_ballot_classes(block_sizes))
+        stats.count("ballot_classes", i + 1)
+        stats.count("permutations", (i + 1) * prod(factorial(size) for size in block_sizes))
+        stats.count("scheme_evaluations", i + 1)
+        stats.count("options", len(strategic_voting_options))
+
+    return strategic_voting_options
+
+def get_best_responses(original_system_prefs: SystemPreferences, voter_index: int, tally: Tally, happiness_table: HappinessTable, option_filter: OptionFilter, stats: Optional[SearchStats] = None) -> VoterOptions:
+    """ Find a ballot for every outcome a voter prefers to the true outcome and can make win.
+
+    Whether a candidate can be made to win is decided by the greedy construction of
+    `tally.get_best_response`, so every voter costs a polynomial number of steps in the number of
+    candidates instead of enumerating all permutations of their ballot.
+    """
+
+    voter_original_prefs = original_system_prefs[voter_index]
+    scores = tally.replace_scores({}, [voter_index])
+    true_outcome = tally.outcome()
+    true_voter_happiness = happiness_table.levels[true_outcome][voter_index]
+    true_overall_happiness = happiness_table.overall[true_outcome]
+    best_responses = option_filter.new_options(voter_original_prefs, [1] * len(voter_original_prefs), true_voter_happiness, true_overall_happiness)
+
+    # only outcomes the voter ranks above the true outcome make them happier
+    for target in voter_original_prefs[:voter_original_prefs.index(true_outcome)]:
+        ballot = get_best_response(scores, tally.score_vector, target, voter_original_prefs)
+        if stats is not None:
+            stats.count("scheme_evaluations")
+        if ballot is None:
+            continue
+
+        best_responses.add(ballot, target, happiness_table.levels[target][voter_index], happiness_table.overall[target])
+        if option_filter.risk_only:
+            break
+
+    if stats is not None:
+        stats.count("options", len(best_responses))
+    return best_responses
+
+def get_random_moves(ballot: List[str], num_moves: int, rng: Random) -> List[List[str]]:
+    """ Return ballots that each differ from the ballot by swapping two candidates or moving one candidate elsewhere. """
+    neighbours = []
+    for _ in range(num_moves):
+        neighbour = list(ballot)
+        i, j = rng.sample(range(len(ballot)), 2)
+        if rng.random() < 0.5:
+            neighbour[i], neighbour[j] = neighbour[j], neighbour[i]
+        else:
+            neighbour.insert(j, neighbour.pop(i))
+        neighbours.append(neighbour)
+    return neighbours
+
+def get_approximate_options_for_voter(original_system_prefs: SystemPreferences, voter_index: int, scheme: Scheme, block_sizes: List[int], tally: Optional[BaseTally], happiness_table: HappinessTable, option_filter: OptionFilter, stats: Optional[SearchStats] = None) -> VoterOptions:
+    """ Search a sample of a voter's ballot classes within the budget of the option filter.
+
+    The search starts with one ballot per candidate the voter prefers to the true outcome, ranking
+    that candidate first and the others from the weakest to the strongest (as the other voters
+    rank them). It then climbs from the best of them with random swap and insert moves towards
+    ballots that make the voter happier, and restarts from a random ballot when the moves stop
+    helping. Every class is evaluated at most once. Options can only be missed, so the strategic
+    voting risk is a lower bound of the exhaustive one.
+    """
+
+    budget = option_filter.budget
+    deadline = time.perf_counter() + budget.seconds if budget.seconds > 0 else None
+    rng = Random(f"{budget.seed}:{voter_index}")
+
+    voter_original_prefs = original_system_prefs[voter_index]
+    num_classes = get_num_ballot_classes(block_sizes)
+    max_evaluations = min(budget.evaluations or num_classes, num_classes)
+
+    true_outcome, full_outcome = get_tallied_outcome(original_system_prefs, scheme, tally, True)
+    true_voter_happiness = happiness_table.levels[true_outcome][voter_index]
+    true_overall_happiness = happiness_table.overall[true_outcome]
+    strategic_voting_options = option_filter.new_options(voter_original_prefs, block_sizes, true_voter_happiness, true_overall_happiness)
+
+    # the original ballot's class is known from the tally without evaluating it
+    seen = {tuple(voter_original_prefs)}
+    if is_positional(tally):
+        # ranked by the points of all other voters, strongest first
+        scores = tally.replace_scores({}, [voter_index])
+        ranking = sorted(voter_original_prefs, key=lambda candidate: (-scores[candidate], candidate))
+    else:
+        # candidates missing from the full outcome (without votes) count as the weakest
+        ranking = full_outcome + [candidate for candidate in voter_original_prefs if candidate not in full_outcome]
+    ballots = [[target] + [candidate for candidate in reversed(ranking) if candidate != target] for target in voter_original_prefs[:voter_original_prefs.index(true_outcome)]]
+    current, current_happiness, stalled = voter_original_prefs, true_voter_happiness, 0
+    done = False
+    while not done and len(seen) < max_evaluations and (deadline is None or time.perf_counter() < deadline):
+        representatives = []
+        for ballot in ballots:
+            representative = get_class_representative(ballot, voter_original_prefs, block_sizes)
+            if tuple(representative) not in seen and len(seen) < max_evaluations:
+                seen.add(tuple(representative))
+                representatives.append(representative)
+
+        best, best_happiness = None, -1.0
+        for representative, outcome in zip(representatives, get_modified_outcomes(original_system_prefs, voter_index, representatives, scheme, tally)):
+            voter_happiness = happiness_table.levels[outcome][voter_index]
+            if voter_happiness > best_happiness:
+                best, best_happiness = representative, voter_happiness
+            if voter_happiness > true_voter_happiness:
+                strategic_voting_options.add(representative, outcome, voter_happiness, happiness_table.overall[outcome])
+                if option_filter.risk_only:
+                    done = True
+                    break
+
+        # move to the best new ballot unless it is worse, give up on the region after a while
+        if best is not None and best_happiness >= current_happiness:
+            stalled = 0 if best_happiness > current_happiness else stalled + 1
+            current, current_happiness = best, best_happiness
+        else:
+            stalled += 1
+        if stalled >= RESTART_AFTER:
+            current = rng.sample(voter_original_prefs, len(voter_original_prefs))
+            current_happiness, stalled = -1.0, 0
+        ballots = get_random_moves(current, NEIGHBOURHOOD_SIZE, rng)
+
+    if stats is not None:
+        stats.count("search_space_classes", num_classes)
+        stats.count("ballot_classes", len(seen))
+        stats.count("permutations", len(seen) * prod(factorial(size) for size in block_sizes))
+        stats.count("scheme_evaluations", len(seen) - 1)
+        stats.count("options", len(strategic_voting_options))
 
     return strategic_voting_options
 
-def get_basic_tva_result(original_system_prefs: SystemPreferences, schemes: Dict[str, Scheme], runoff: int = 0) -> dict:
-    """ Calculate the basic TVA result for a given voting scheme and set of preferences. """
+def get_search_coverage(budget: SearchBudget, classes: int, evaluated: int, strategic_voting_risk: float) -> dict:
+    """ Describe how much of the ballot classes of all searched voters (or groups) an approximate search covered. """
+    return {
+        "budget": budget.to_dict(),
+        "ballot_classes": classes,
+        "evaluated_ballot_classes": evaluated,
+        "coverage": evaluated / classes if classes else 1.0,
+        "strategic_voting_risk_lower_bound": strategic_voting_risk
+    }
+
+class SchemeContext:
+    """ Everything the searches of one voting scheme share, independent of the searching voter or group.
+
+    Attributes:
+        scheme:                     Voting scheme
+        tally:                      Tally of the unmodified preferences (None if the scheme has none)
+        happiness_table:            Happiness of all voters per outcome
+        runoff_happiness_table:     Happiness per outcome of the runoff variant (None without runoff)
+        outcome:                    Non-strategic outcome
+        full_outcome:               Non-strategic full outcome
+        stats:                      Search statistics of the scheme (None unless profiling)
+    """
+
+    def __init__(self, original_system_prefs: SystemPreferences, scheme: Scheme, runoff: int = 0, engine: str = 'python', voter_classes: Optional[VoterClasses] = None, profile: bool = False):
+        self.scheme = scheme
+        self.stats = SearchStats() if profile else None
+        start = time.perf_counter()
+
+        self.tally = get_tally(original_system_prefs, scheme, engine, voter_classes)
+        self.happiness_table = get_happiness_table(original_system_prefs, self.tally, voter_classes)
+        self.runoff_happiness_table = get_alternate_happiness_table(original_system_prefs, 1, runoff) if runoff > 0 else None
+        self.outcome, self.full_outcome = get_tallied_outcome(original_system_prefs, scheme, self.tally, True, voter_classes)
+
+        if self.stats is not None:
+            self.stats.seconds["context"] += time.perf_counter() - start
+            self.stats.count("scheme_evaluations")
+            self.stats.count("happiness_evaluations", len(self.happiness_table.levels) * len(original_system_prefs) * (2 if runoff > 0 else 1))
+
+    def update_voter(self, original_system_prefs: SystemPreferences, voter_index: int, old_ballot: Optional[VoterPreferences], new_ballot: Optional[VoterPreferences]):
+        """ Follow a voter who changed their ballot in the preferences, added voters have no old ballot and removed ones no new ballot.
+
+        The tally moves the voter's ballot and only the voter's happiness levels are calculated. The
+        summed happiness is added up again, so it stays exactly that of a rebuilt context. The runoff
+        happiness table is not updated, so only contexts without a runoff can follow changes.
+        """
+        if self.tally is not None:
+            self.tally.update_voter(voter_index, old_ballot, new_ballot)
+        for outcome, levels in self.happiness_table.levels.items():
+            if new_ballot is None:
+                del levels[voter_index]
+            elif old_ballot is None:
+                levels.insert(voter_index, happiness([new_ballot], outcome)[0])
+            else:
+                levels[voter_index] = happiness([new_ballot], outcome)[0]
+            self.happiness_table.overall[outcome] = sum(levels)
+        self.outcome, self.full_outcome = get_tallied_outcome(original_system_prefs, self.scheme, self.tally, True)
+
+def search_voter(original_system_prefs: SystemPreferences, context: SchemeContext, voter_index: int, runoff: int = 0, stats: Optional[SearchStats] = None, option_filter: Optional[OptionFilter] = None) -> VoterOptions:
+    """ Find the strategic voting options of a voter with the shared state of a scheme, counting into the given stats. """
+    if stats is None:
+        return get_strategic_options_for_voter(original_system_prefs, voter_index, context.scheme, context.full_outcome, runoff, context.tally, context.happiness_table, context.runoff_happiness_table, option_filter=option_filter)
+
+    with stats.timer("search"):
+        return get_strategic_options_for_voter(original_system_prefs, voter_index, context.scheme, context.full_outcome, runoff, context.tally, context.happiness_table, context.runoff_happiness_table, stats, option_filter)
+
+def get_search_keys(voter_classes: VoterClasses, runoff: int = 0) -> List[int]:
+    """ Return the key under which each voter's options are searched, voters with identical ballots share one. """
+    search_keys = voter_classes.voter_class.copy()
+    if runoff > 0 and search_keys:
+        # the first ballot also orders the full outcome, so voter 0 is searched on their own
+        search_keys[0] = -1
+    return search_keys
+
+def get_basic_tva_result(original_system_prefs: SystemPreferences, schemes: Dict[str, Scheme], runoff: int = 0, engine: str = 'python', workers: int = 1, voter_classes: Optional[VoterClasses] = None, profile: bool = False, cache: Optional[ResultCache] = None, option_filter: Optional[OptionFilter] = None) -> dict:
+    """ Calculate the basic TVA result for a given voting scheme and set of preferences.
+
+    The engine selects how schemes are tallied, see `tally.ENGINES`. With more than one worker the
+    voters are searched on a process pool. Profiling adds search statistics to every scheme result.
+    With a cache, only schemes without a cached result are searched. The option filter selects
+    which options are kept for every voter.
+    """
+
+    if option_filter is None:
+        option_filter = OptionFilter()
 
     num_voters = len(original_system_prefs)
+    if voter_classes is None:
+        voter_classes = VoterClasses(original_system_prefs)
+
+    # voters with identical ballots have identical options, so each class is searched once
+    search_keys = get_search_keys(voter_classes, runoff)
+    search_voters: Dict[int, int] = {}
+    for voter_index, search_key in enumerate(search_keys):
+        search_voters.setdefault(search_key, voter_index)
+
+    cache_keys: Dict[str, str] = {}
+    cached_results: Dict[str, dict] = {}
+    if cache is not None:
+        for scheme_name in schemes:
+            cache_keys[scheme_name] = cache.get_key(original_system_prefs, scheme_name, mode="runoff" if runoff > 0 else "basic", runoff=runoff, happiness_variant=1 if runoff > 0 else 0, **option_filter.get_cache_params())
+            scheme_result = cache.get(cache_keys[scheme_name])
+            if scheme_result is not None:
+                cached_results[scheme_name] = scheme_result
+
+    # an approximate search splits its budget over the searched voters and counts what it covered
+    search_filter = option_filter.share_budget(len(search_voters))
+    collect_stats = profile or option_filter.budget is not None
+
+    contexts: Dict[str, SchemeContext] = {}
+    jobs = [(scheme_name, voter_index) for scheme_name in schemes if scheme_name not in cached_results for voter_index in search_voters.values()]
+    job_stats: Dict[str, SearchStats] = {}
+    if workers > 1 and jobs:
+        job_results = []
+        for (scheme_name, _), (options, stats) in zip(jobs, run_jobs(workers, init_basic_worker, (original_system_prefs, schemes, runoff, engine, collect_stats, search_filter), run_basic_job, jobs)):
+            job_results.append(options)
+            if stats is not None:
+                job_stats.setdefault(scheme_name, SearchStats()).merge(stats)
+    else:
+        job_results = []
+        for scheme_name, voter_index in jobs:
+            if scheme_name not in contexts:
+                contexts[scheme_name] = SchemeContext(original_system_prefs, schemes[scheme_name], runoff, engine, voter_classes, collect_stats)
+            job_results.append(search_voter(original_system_prefs, contexts[scheme_name], voter_index, runoff, contexts[scheme_name].stats, search_filter))
+    options_by_job = dict(zip(jobs, job_results))
 
     basic_tva_result = {}
     for scheme_name, scheme in schemes.items():
-        if runoff > 0:
-            non_strategic_outcome, non_strategic_happiness_levels, non_strategic_full_outcome = get_vote_result(original_system_prefs, original_system_prefs, scheme, True)
-        else:
-            non_strategic_outcome, non_strategic_happiness_levels = get_vote_result(original_system_prefs, original_system_prefs, scheme)
-
-        scheme_result = {}
-        scheme_result["non_strategic_outcome"] = non_strategic_outcome
-        scheme_result["non_strategic_happiness_levels"] = non_strategic_happiness_levels
-        scheme_result["non_strategic_overall_happiness"] = sum(non_strategic_happiness_levels)
-        scheme_result["voters"] = []
-
-        num_strategic_voters = 0
-        for voter_index in range(num_voters):
-            if runoff > 0:
-                strategic_voting_options = get_strategic_options_for_voter(original_system_prefs, voter_index, scheme, non_strategic_full_outcome, runoff)
-            else:
-                strategic_voting_options = get_strategic_options_for_voter(original_system_prefs, voter_index, scheme)
-            if len(strategic_voting_options) >= 1:
-                num_strategic_voters += 1
-            scheme_result["voters"].append(strategic_voting_options)
+        if scheme_name in cached_results:
+            basic_tva_result[scheme_name] = cached_results[scheme_name]
+            continue
+
+        if scheme_name not in contexts:
+            contexts[scheme_name] = SchemeContext(original_system_prefs, scheme, runoff, engine, voter_classes, collect_stats)
+        context = contexts[scheme_name]
+        if scheme_name in job_stats:
+            context.stats.merge(job_stats[scheme_name])
 
-        scheme_result["strategic_voting_risk"] = get_strategic_voting_risk(num_strategic_voters, num_voters)
+        scheme_result = get_scheme_result(context, [options_by_job[(scheme_name, search_voters[search_keys[voter_index]])] for voter_index in range(num_voters)])
+        if option_filter.budget is not None:
+            scheme_result["approximate_search"] = get_search_coverage(option_filter.budget, context.stats.counters["search_space_classes"], context.stats.counters["ballot_classes"], scheme_result["strategic_voting_risk"])
+        if profile:
+            scheme_result["stats"] = {"mode": "runoff" if runoff > 0 else "basic", **context.stats.to_dict()}
         basic_tva_result[scheme_name] = scheme_result
+        if cache is not None:
+            cache.put(cache_keys[scheme_name], scheme_result)
 
     if runoff > 0:
-        return basic_tva_result, non_strategic_full_outcome
+        # the candidates advancing from the round are taken from the last scheme's full outcome
+        scheme_name, scheme = list(schemes.items())[-1]
+        if scheme_name not in contexts:
+            contexts[scheme_name] = SchemeContext(original_system_prefs, scheme, runoff, engine, voter_classes)
+        return basic_tva_result, contexts[scheme_name].full_outcome
     return basic_tva_result
 
+def get_scheme_result(context: SchemeContext, voters_options: list) -> dict:
+    """ Assemble the result of a scheme from its context and the strategic options of every voter. """
+    scheme_result = {}
+    scheme_result["non_strategic_outcome"] = context.outcome
+    scheme_result["non_strategic_happiness_levels"] = context.happiness_table.levels[context.outcome]
+    scheme_result["non_strategic_overall_happiness"] = context.happiness_table.overall[context.outcome]
+    scheme_result["voters"] = voters_options
+
+    num_strategic_voters = sum(1 for strategic_voting_options in voters_options if len(strategic_voting_options) >= 1)
+    scheme_result["strategic_voting_risk"] = get_strategic_voting_risk(num_strategic_voters, len(voters_options))
+    return scheme_result
+
+def get_runoff_tva_results(original_system_prefs: SystemPreferences, schemes: Dict[str, Scheme], rounds: List[int], engine: str = 'python', workers: int = 1, profile: bool = False, cache: Optional[ResultCache] = None, option_filter: Optional[OptionFilter] = None) -> List[dict]:
+    """ Calculate the TVA result of every round of a runoff election.
+
+    Each entry of rounds is the number of candidates advancing from a round, taken from the top of
+    the last scheme's full outcome. These rounds are analysed in runoff mode, the final round is a
+    basic vote among the remaining candidates. Later rounds mask the ballot classes of the previous
+    round instead of regrouping all voters.
+    """
+
+    voter_classes = VoterClasses(original_system_prefs)
+    round_prefs = original_system_prefs
+    tva_results = []
+    for advancing in rounds:
+        tva_result, full_outcome = get_basic_tva_result(round_prefs, schemes, advancing, engine, workers, voter_classes, profile, cache, option_filter)
+        tva_results.append(tva_result)
+
+        voter_classes = voter_classes.restrict(set(full_outcome[:advancing]))
+        round_prefs = voter_classes.expand(voter_classes.ballots)
+
+    tva_results.append(get_basic_tva_result(round_prefs, schemes, engine=engine, workers=workers, voter_classes=voter_classes, profile=profile, cache=cache, option_filter=option_filter))
+    return tva_results
+
+def init_basic_worker(original_system_prefs: SystemPreferences, schemes: Dict[str, Scheme], runoff: int, engine: str, profile: bool = False, option_filter: Optional[OptionFilter] = None) -> dict:
+    """ Worker state for basic mode, scheme contexts are built on a worker's first job of a scheme. """
+    return {"prefs": original_system_prefs, "schemes": schemes, "runoff": runoff, "engine": engine, "profile": profile, "option_filter": option_filter, "voter_classes": VoterClasses(original_system_prefs), "contexts": {}}
+
+def run_basic_job(state: dict, scheme_name: str, voter_index: int) -> tuple:
+    """ Search the strategic options of one voter for one scheme on a worker, returning them with the job's stats. """
+    contexts = state["contexts"]
+    if scheme_name not in contexts:
+        contexts[scheme_name] = SchemeContext(state["prefs"], state["schemes"][scheme_name], state["runoff"], state["engine"], state["voter_classes"])
+    stats = SearchStats() if state["profile"] else None
+    return search_voter(state["prefs"], contexts[scheme_name], voter_index, state["runoff"], stats, state["option_filter"]), stats
+
 
 def get_strategic_voting_risk(num_strategic_voters: int, num_voters: int) -> float:
     """ Ratio of voters with strategic options to all voters. """